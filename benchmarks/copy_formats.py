@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+import time
+
+### benchmark: text (csv) vs binary (PGCOPY) COPY for the same cleaned dataframe
+### usage: python benchmarks/copy_formats.py [table ...]   (defaults to dataLPI geoIndicators)
+### loads into session temp tables only, the target tables are never touched
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.data_loader import process_csv
+from scripts.copy_writer import dataframe_to_csv_buffer
+from scripts.pgcopy import binary_column_kinds, staging_types, dataframe_to_binary_buffer
+from scripts.schemaplan import get_schemaplan
+from scripts.db_pool import get_connection, close_pool
+from config import DATA_DIR
+
+BATCH_SIZE = 10000
+
+
+def bench_format(df, table_name: str, copy_format: str) -> dict:
+    pg_types = get_schemaplan().pg_types(table_name)
+    column_list = ', '.join([f'"{col}"' for col in df.columns])
+    typed_columns = ', '.join([f'"{col}" {pg_types[col]}' for col in df.columns])
+    timings = {"format": copy_format, "table": table_name, "rows": df.height,
+               "serialize_s": 0.0, "copy_s": 0.0, "cast_s": 0.0, "bytes": 0}
+
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f'CREATE TEMP TABLE bench_target ({typed_columns})')
+        if copy_format == "binary":
+            kinds = binary_column_kinds(df.schema, pg_types)
+            staging_columns = ', '.join([f'"{col}" {pg_type}' for col, pg_type in staging_types(kinds).items()])
+            cursor.execute(f'CREATE TEMP TABLE bench_staging ({staging_columns})')
+            copy_target, copy_options = "bench_staging", "FORMAT binary"
+        else:
+            copy_target, copy_options = "bench_target", "FORMAT csv, HEADER true"
+
+        for offset in range(0, df.height, BATCH_SIZE):
+            chunk = df.slice(offset, BATCH_SIZE)
+            started = time.perf_counter()
+            buffer = dataframe_to_binary_buffer(chunk, kinds) if copy_format == "binary" else dataframe_to_csv_buffer(chunk)
+            timings["serialize_s"] += time.perf_counter() - started
+            timings["bytes"] += buffer.getbuffer().nbytes
+
+            started = time.perf_counter()
+            cursor.copy_expert(f'COPY {copy_target} ({column_list}) FROM STDIN WITH ({copy_options})', buffer)
+            timings["copy_s"] += time.perf_counter() - started
+
+        if copy_format == "binary":
+            # the text path parses straight into the target types; the binary path pays for the casts here
+            started = time.perf_counter()
+            select_list = ', '.join([f'"{col}"::{pg_types[col]}' for col in df.columns])
+            cursor.execute(f'INSERT INTO bench_target ({column_list}) SELECT {select_list} FROM bench_staging')
+            timings["cast_s"] = time.perf_counter() - started
+        # rolled back by get_connection: nothing is kept
+
+    timings["total_s"] = timings["serialize_s"] + timings["copy_s"] + timings["cast_s"]
+    return {key: round(value, 4) if isinstance(value, float) else value for key, value in timings.items()}
+
+
+if __name__ == '__main__':
+    tables = sys.argv[1:] or ["dataLPI", "geoIndicators"]
+    results = []
+    for table_name in tables:
+        processed = process_csv(os.path.join(DATA_DIR, f"{table_name}.csv"))
+        if processed is None:
+            print(f"skipping {table_name}: could not process {table_name}.csv", file=sys.stderr)
+            continue
+        for copy_format in ("csv", "binary"):
+            results.append(bench_format(processed['dataframe'], table_name, copy_format))
+            print(json.dumps(results[-1]))
+    close_pool()
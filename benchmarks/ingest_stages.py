@@ -0,0 +1,188 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+### benchmark: per-stage timings (scan, collect, normalize, prefilter, datevisited, serialize, copy,
+### merge) of every registry table on seeded synthetic data (see benchmarks/synthetic.py). the
+### file is cleaned by process_csv itself, so the scan/cleaning numbers are the ingester's.
+### usage: python benchmarks/ingest_stages.py [rows] [seed] [out.json]
+###        python benchmarks/ingest_stages.py --compare base.json head.json
+### connects with BENCH_DBNAME, BENCH_DBUSER, BENCH_DBPASSWORD, BENCH_DBHOST and BENCH_DBPORT (a
+### throwaway local postgres), never with the PROD_DB* settings. everything is loaded into the
+### BENCH_SCHEMA schema, which is dropped and recreated at the start and dropped at the end.
+
+BENCH_SCHEMA = "ingest_bench"
+BENCH_DB_SETTINGS = ("DBNAME", "DBUSER", "DBPASSWORD", "DBHOST", "DBPORT")
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BENCH_DIR))
+
+# the BENCH_DB* settings may sit in .env next to the production ones
+load_dotenv()
+if sys.argv[1:2] != ["--compare"]:
+    _missing = [f"BENCH_{setting}" for setting in ("DBNAME", "DBUSER", "DBHOST") if not os.getenv(f"BENCH_{setting}")]
+    if _missing:
+        sys.exit(f"ingest_stages:: set {', '.join(_missing)} to a throwaway database, the benchmark drops its schema.")
+    _bench_target = [os.getenv(f"BENCH_{setting}") for setting in ("DBHOST", "DBPORT", "DBNAME")]
+    if _bench_target == [os.getenv(f"PROD_{setting}") for setting in ("DBHOST", "DBPORT", "DBNAME")]:
+        sys.exit("ingest_stages:: BENCH_DB* points at the PROD_DB* database, refusing to run.")
+# config builds DATABASE_CONFIG and DBSCHEMA from the environment when it is imported: point
+# them at the bench database and schema, whatever was exported for the ingester
+for setting in BENCH_DB_SETTINGS:
+    if os.getenv(f"BENCH_{setting}") is None:
+        os.environ.pop(f"PROD_{setting}", None)
+    else:
+        os.environ[f"PROD_{setting}"] = os.environ[f"BENCH_{setting}"]
+os.environ["DBSCHEMA"] = BENCH_SCHEMA
+
+import polars as pl
+
+from config import DBSCHEMA, COPY_FORMAT, ROW_HASHES
+from scripts.schemaplan import get_schemaplan
+from scripts.data_loader import process_csv
+from scripts.copy_writer import dataframe_to_csv_buffer
+from scripts.pgcopy import binary_column_kinds, staging_types, dataframe_to_binary_buffer
+from scripts.db_connector import fetch_table_columns, build_merge_query
+from scripts.ddl import reconcile_tables
+from scripts.db_pool import get_connection, close_pool
+from scripts.header_cache import set_header_lookup, clear_header_lookup
+from scripts.run_report import aggregate_stages
+from scripts import run_metrics
+from synthetic import write_dataset, benchmark_tables
+
+# the schema the whole run is dropped with: never anything but the bench one
+if DBSCHEMA != BENCH_SCHEMA:
+    sys.exit(f"ingest_stages:: DBSCHEMA is {DBSCHEMA!r}, not {BENCH_SCHEMA!r}, refusing to run.")
+
+BATCH_SIZE = 10000
+# the process_csv stages come from run_metrics, the rest are timed here
+PROCESS_STAGES = ("scan", "collect", "normalize", "prefilter", "datevisited")
+STAGES = PROCESS_STAGES + ("serialize", "copy", "merge")
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = {}
+
+    def __call__(self, stage: str, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        self.seconds[stage] = round(self.seconds.get(stage, 0.0) + time.perf_counter() - started, 4)
+        return result
+
+
+def bench_table(table_name: str, path: str) -> dict:
+    timer = StageTimer()
+    schemaplan = get_schemaplan()
+
+    stages_before = run_metrics.stage_mark()
+    processed = process_csv(path)
+    if processed is None:
+        raise RuntimeError(f"process_csv failed for {table_name} (see log)")
+    df = processed['dataframe']
+    processed_stages = aggregate_stages(run_metrics.stages_since(stages_before)).get(table_name, {})
+    for stage in PROCESS_STAGES:
+        if stage in processed_stages:
+            timer.seconds[stage] = processed_stages[stage]["wall_s"]
+    rows_in = pl.scan_csv(path).select(pl.len()).collect().item()
+
+    with get_connection() as conn, conn.cursor() as cursor:
+        column_types = fetch_table_columns(cursor, table_name)
+        columns = [col for col in column_types if col in df.columns]
+        df = df.select(columns)
+        column_list = ', '.join([f'"{col}"' for col in columns])
+        staging = f'"{table_name}_bench_staging"'
+        if COPY_FORMAT == "binary":
+            kinds = binary_column_kinds(df.schema, schemaplan.pg_types(table_name))
+            staging_columns = ', '.join([f'"{col}" {pg_type}' for col, pg_type in staging_types(kinds).items()])
+            cursor.execute(f"CREATE TEMP TABLE {staging} ({staging_columns})")
+            select_list = ', '.join([f'"{col}"::{column_types[col]}' for col in columns])
+            serialize, copy_options = (lambda chunk: dataframe_to_binary_buffer(chunk, kinds)), "FORMAT binary"
+        else:
+            cursor.execute(f'CREATE TEMP TABLE {staging} AS SELECT {column_list} FROM {DBSCHEMA}."{table_name}" WITH NO DATA')
+            select_list = column_list
+            serialize, copy_options = dataframe_to_csv_buffer, "FORMAT csv, HEADER true"
+
+        copy_bytes = 0
+        for offset in range(0, df.height, BATCH_SIZE):
+            buffer = timer("serialize", serialize, df.slice(offset, BATCH_SIZE))
+            copy_bytes += buffer.getbuffer().nbytes
+            timer("copy", cursor.copy_expert, f"COPY {staging} ({column_list}) FROM STDIN WITH ({copy_options})", buffer)
+
+        timer("merge", cursor.execute, build_merge_query(table_name, staging, columns, select_list))
+        inserted, updated = cursor.fetchone()
+        cursor.execute(f"DROP TABLE {staging}")
+        conn.commit()
+
+    if table_name == "dataHeader":
+        # as in ingest_runner: the child tables look their DateVisited up here
+        set_header_lookup(df)
+
+    return {"rows_in": rows_in, "rows_out": df.height, "copy_bytes": copy_bytes, "inserted": inserted,
+            "updated": updated, "stages": {stage: timer.seconds.get(stage, 0.0) for stage in STAGES}}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def run(rows: int, seed: int) -> dict:
+    report = {"commit": git_commit(), "polars": pl.__version__, "rows": rows, "seed": seed,
+              "copy_format": COPY_FORMAT, "row_hashes": ROW_HASHES, "tables": {}}
+    with tempfile.TemporaryDirectory(prefix="ingest_bench_") as data_dir:
+        paths = write_dataset(data_dir, rows, seed)
+        with get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS "{DBSCHEMA}" CASCADE; CREATE SCHEMA "{DBSCHEMA}"')
+            conn.commit()
+        clear_header_lookup()
+        try:
+            reconcile_tables(benchmark_tables())
+            for table_name in benchmark_tables():
+                report["tables"][table_name] = bench_table(table_name, paths[table_name])
+                print(json.dumps({"table": table_name, **report["tables"][table_name]}), file=sys.stderr)
+        finally:
+            with get_connection() as conn, conn.cursor() as cursor:
+                cursor.execute(f'DROP SCHEMA IF EXISTS "{DBSCHEMA}" CASCADE')
+                conn.commit()
+            close_pool()
+    return report
+
+
+def compare(base_path: str, head_path: str):
+    # head / base seconds per table and stage; > 1 means head is slower
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+    print(f"{'table':<28} {'stage':<10} {base['commit']:>10} {head['commit']:>10} {'ratio':>7}")
+    for table_name, head_table in head["tables"].items():
+        base_table = base["tables"].get(table_name)
+        if base_table is None:
+            continue
+        for stage in STAGES:
+            before, after = base_table["stages"].get(stage, 0.0), head_table["stages"].get(stage, 0.0)
+            ratio = f"{after / before:.2f}" if before else "-"
+            print(f"{table_name:<28} {stage:<10} {before:>10.4f} {after:>10.4f} {ratio:>7}")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["--compare"]:
+        compare(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    report = run(rows, seed)
+    out_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(BENCH_DIR, "results", f"ingest_stages_{report['commit']}.json")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(out_path)
@@ -0,0 +1,115 @@
+import os
+import sys
+from datetime import date
+
+import numpy as np
+import polars as pl
+
+### seeded synthetic tall tables for every table in the unique key registry that the schemaplan defines.
+### usage: python benchmarks/synthetic.py <out_dir> [rows] [seed]   (defaults to 100000 rows, seed 0)
+### dataHeader gets rows // 20 plots. tables keyed by PrimaryKey alone (geoIndicators, ...) get one row
+### per plot, every other table gets `rows` rows drawing their PrimaryKeys from the plots.
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.schemaplan import get_schemaplan, UNIQUE_KEYS
+
+NA_RATE = {"numeric": 0.10, "integer": 0.05, "text": 0.05, "bit": 0.05, "date": 0.0}
+BIT_VOCABULARIES = (["TRUE", "FALSE"], ["Y", "N"], ["L", "D"], ["0", "1"])
+CODE_CARDINALITY = 20  # distinct values of a non-key text column (species codes, rec types, ...)
+PROJECT_KEY = "BENCH_PROJECT"
+DBKEY = "BENCH_DBKEY"
+
+
+def header_keys(plots: int) -> np.ndarray:
+    return np.array([f"BENCH{i:09d}" for i in range(plots)], dtype=object)
+
+
+def one_row_per_plot(table_name: str) -> bool:
+    return UNIQUE_KEYS.get(table_name) == ["PrimaryKey"]
+
+
+def _with_na(values: np.ndarray, rng, rate: float) -> np.ndarray:
+    values = values.astype(object)
+    values[rng.random(len(values)) < rate] = "NA"
+    return values
+
+
+def _column(table_name: str, col: str, pg_type: str, rows: int, rng, plot_keys: np.ndarray, position: int) -> np.ndarray:
+    pg_type = pg_type.lower()
+    keys = UNIQUE_KEYS.get(table_name, [])
+
+    if col == "PrimaryKey":
+        if one_row_per_plot(table_name):
+            return plot_keys[:rows]
+        return rng.choice(plot_keys, rows)
+    if col == "ProjectKey":
+        return np.full(rows, PROJECT_KEY, dtype=object)
+    if col == "DBKey":
+        return np.full(rows, DBKEY, dtype=object)
+    if col in ("wkb_geometry", "DateLoadedInDb"):
+        return np.full(rows, "", dtype=object)
+    if col == "Longitude_NAD83":
+        return np.round(rng.uniform(-124, -100, rows), 6).astype(str).astype(object)
+    if col == "Latitude_NAD83":
+        return np.round(rng.uniform(31, 49, rows), 6).astype(str).astype(object)
+
+    if pg_type in ("numeric", "double precision", "real"):
+        return _with_na(np.round(rng.gamma(2.0, 15.0, rows), 2).astype(str), rng, NA_RATE["numeric"])
+    if pg_type in ("integer", "int", "bigint", "smallint"):
+        # key integers (SeqNo, PointNbr, ...) are never NA, others are small counts
+        high = 100 if col in keys else 50
+        return _with_na(rng.integers(1, high, rows).astype(str), rng, 0.0 if col in keys else NA_RATE["integer"])
+    if pg_type == "bit":
+        vocabulary = BIT_VOCABULARIES[position % len(BIT_VOCABULARIES)]
+        values = rng.choice(vocabulary, rows).astype(object)
+        values[rng.random(rows) < NA_RATE["bit"]] = ""
+        return values
+    if pg_type == "date":
+        days = rng.integers(date(2010, 1, 1).toordinal(), date(2024, 12, 31).toordinal(), rows)
+        distinct, inverse = np.unique(days, return_inverse=True)
+        return np.array([date.fromordinal(int(d)).isoformat() for d in distinct], dtype=object)[inverse]
+    # text: key parts (LineKey, RecKey, ...) have a few values per plot, other columns are codes
+    cardinality = 5 if col in keys else CODE_CARDINALITY
+    values = np.array([f"{col[:4].upper()}{i}" for i in range(cardinality)], dtype=object)[rng.integers(0, cardinality, rows)]
+    return values if col in keys else _with_na(values, rng, NA_RATE["text"])
+
+
+def generate_table(table_name: str, rows: int, plot_keys: np.ndarray, seed: int = 0) -> pl.DataFrame:
+    """
+    one table as the raw csv would read it (all text), following the schemaplan fields.
+    the seed is mixed with the table name, so every table is reproducible on its own.
+    """
+    rng = np.random.default_rng([seed, sum(table_name.encode())])
+    pg_types = get_schemaplan().pg_types(table_name)
+    return pl.DataFrame({
+        col: pl.Series(col, _column(table_name, col, pg_type, rows, rng, plot_keys, i).tolist(), dtype=pl.Utf8)
+        for i, (col, pg_type) in enumerate(pg_types.items())
+    })
+
+
+def benchmark_tables() -> list[str]:
+    # dataHeader first: everything else references it
+    tables = [table for table in UNIQUE_KEYS if get_schemaplan().has_table(table)]
+    return sorted(tables, key=lambda table: table != "dataHeader")
+
+
+def write_dataset(out_dir: str, rows: int, seed: int = 0) -> dict[str, str]:
+    # table -> csv path of the generated files
+    os.makedirs(out_dir, exist_ok=True)
+    plots = max(1, rows // 20)
+    plot_keys = header_keys(plots)
+    paths = {}
+    for table_name in benchmark_tables():
+        table_rows = plots if one_row_per_plot(table_name) else rows
+        path = os.path.join(out_dir, f"{table_name}.csv")
+        generate_table(table_name, table_rows, plot_keys, seed).write_csv(path)
+        paths[table_name] = path
+    return paths
+
+
+if __name__ == '__main__':
+    out_dir = sys.argv[1]
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    for table_name, path in write_dataset(out_dir, rows, seed).items():
+        print(f"{table_name}: {path}")
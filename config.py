@@ -5,8 +5,9 @@ import logging.config
 
 load_dotenv()
 
-DBSCHEMA = "public_dev"
+DBSCHEMA = os.getenv('DBSCHEMA', "public_dev")
 SCHEMAPLAN_PATH = "./validation_schemas/LDC_SchemaPlan_1.2.4.csv"
+SCHEMAPLAN_CACHE_PATH = "./validation_schemas/.schemaplan_cache.pkl" # compiled schemaplan, rebuilt when the csv changes
 PROJECTFILE_PATH = "./data"
 NOPRIMARYKEYPATH = "./noprimarykey"
 DATABASE_CONFIG = {
@@ -16,9 +17,36 @@ DATABASE_CONFIG = {
     "host": os.getenv('PROD_DBHOST'),
     "port": os.getenv('PROD_DBPORT'),
 }
+DB_POOL_MINCONN = int(os.getenv('DB_POOL_MINCONN', 1))
+DB_POOL_MAXCONN = int(os.getenv('DB_POOL_MAXCONN', 8)) # per process
+DB_POOL_HEALTHCHECK_IDLE = 30 # seconds idle before a pooled connection is pinged on checkout
+COPY_FORMAT = os.getenv('COPY_FORMAT', 'csv') # "csv" or "binary" (PGCOPY) for insert_dataframe_to_db
+ROW_HASHES = os.getenv('ROW_HASHES', 'false').lower() == 'true' # store key/row hashes and only send new or changed rows
+GEOMETRY_SRID = 4326 # SRID of the NAD83 lon/lat pairs encoded into wkb_geometry
+LOAD_MODE = os.getenv('LOAD_MODE', 'merge') # "merge": one staging table + one upsert, "batch": upsert/commit every 10k rows
+COPY_QUEUE_BYTES = int(os.getenv('COPY_QUEUE_BYTES', 256 * 1024 * 1024)) # serialized COPY batches in flight at once, the serializer waits beyond this (the cleaned frame itself isn't counted)
+PARTITION_BY = os.getenv('PARTITION_BY', '') # "projectkey" (LIST) or "datevisited" (RANGE by year) for new tables, empty for plain tables
+PARTITION_SWAP = os.getenv('PARTITION_SWAP', 'true').lower() == 'true' # a single-project load rebuilds and swaps its ProjectKey partition
+BULK_LOAD = os.getenv('BULK_LOAD', 'true').lower() == 'true' # an empty target is copied into directly, its keys, indexes and foreign keys rebuilt after
+BULK_MAINTENANCE_WORK_MEM = os.getenv('BULK_MAINTENANCE_WORK_MEM', '512MB') # sort memory for those index builds
+COPY_SHARDS = int(os.getenv('COPY_SHARDS', 4)) # most connections one table's merge-mode COPY is spread over, 1 disables sharding
+COPY_SHARD_ROWS = int(os.getenv('COPY_SHARD_ROWS', 1_000_000)) # rows per shard, a frame smaller than two shards is copied over one connection
+LOAD_RETRIES = int(os.getenv('LOAD_RETRIES', 5)) # times a table load is retried after losing its database connection
+LOAD_RETRY_BACKOFF = 1.0 # seconds before the first retry, doubled for every further one
+LOAD_RETRY_BACKOFF_MAX = 60.0 # longest wait between two retries
 
 TODAYS_DATE = date.today().isoformat()
 DATA_DIR = "./data" #change to tall?
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 4)) # tables loaded concurrently after dataHeader
+RUN_REPORT_DIR = "./logs/runs" # one json report with per-table, per-stage metrics per ingest run
+PROFILE_DIR = "./logs/profiles" # one directory per profile command
+PARQUET_CACHE = os.getenv('PARQUET_CACHE', 'false').lower() == 'true' # keep a typed parquet copy of every parsed csv
+PARQUET_CACHE_DIR = "./parquet_cache" # cache entries, safe to delete
+PROMETHEUS_TEXTFILE = os.getenv('PROMETHEUS_TEXTFILE') # e.g. /var/lib/node_exporter/tall_ingest.prom, unset to disable
+WATCH_POLL_SECONDS = float(os.getenv('WATCH_POLL_SECONDS', 2)) # how often watch mode looks at DATA_DIR
+WATCH_QUIET_SECONDS = float(os.getenv('WATCH_QUIET_SECONDS', 30)) # a project folder untouched this long has finished landing
+WATCH_MARKER_FILE = "_READY" # or drop this file into a project folder to have it loaded right away
+WATCH_CACHE_SECONDS = 3600 # watch mode re-reads the dataHeader cache and table DDL after this long
 
 LOGGING_CONFIG = {
     'version': 1,
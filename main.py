@@ -1,10 +1,23 @@
-from scripts.data_loader import process_csv, projectkey_extract, load_projecttable
-from scripts.db_connector import insert_dataframe_to_db
+from scripts.data_loader import projectkey_extract, load_projecttable
+from scripts.profiler import profile_table
+from scripts.ingest_runner import ingest_file, ingest_files, log_ingest_summary
+from scripts.schemaplan import get_schemaplan
+from scripts.db_pool import close_pool
+from scripts.manifest import ensure_manifest_table
+from scripts.checkpoint import ensure_journal_table, new_run_id, pending_loads
+from scripts.header_cache import clear_header_lookup, header_keys
+from scripts.ddl import reconcile_tables, reconciled_tables, reset_reconciled
+from scripts.watcher import FolderWatcher
+from scripts.readers import is_input_file, table_name_from_path
+from scripts.run_report import write_run_report
+from scripts import run_metrics
 # from scripts.utils import generate_unique_constraint_query
-from config import DATA_DIR, DATABASE_CONFIG, SCHEMAPLAN_PATH, DBSCHEMA
+from config import DATA_DIR, DATABASE_CONFIG, SCHEMAPLAN_PATH, DBSCHEMA, INGEST_WORKERS, LOAD_MODE, WATCH_POLL_SECONDS, WATCH_QUIET_SECONDS, WATCH_MARKER_FILE, WATCH_CACHE_SECONDS
 import logging
 import cmd
+import time
 import os
+import sys
 
 logger = logging.getLogger(__name__)
 
@@ -19,11 +32,16 @@ class TallIngester(cmd.Cmd):
 
 
     def do_ingest(self, arg):
+        """
+        Ingest every input file in DATA_DIR (.csv, .csv.gz, .csv.zst, .parquet, .arrow/.ipc): dataHeader first, then the remaining tables in parallel.
+        Files unchanged since their last successful load are skipped; pass force to reload them.
+        Usage: ingest [debug] [force] [workers=N]
+        """
         project_key = None
-        # Check if 'debug' is in the argument
-        if 'debug' in arg.split():
-            logging.getLogger().setLevel(logging.DEBUG)  # Set root logger to DEBUG level
-            logger.debug('Debug mode enabled.')
+        options = self._options(arg, "ingest [debug] [force] [workers=N]")
+        if options is None:
+            return
+        workers, force = options
 
         # Ask for confirmation on TABLE_SCHEMA
         table_schema_confirm = input(f'Ingesting to TABLE_SCHEMA: {DBSCHEMA}. Continue? (y/n): ').strip().lower()
@@ -43,35 +61,231 @@ class TallIngester(cmd.Cmd):
             logger.info("Aborting ingestion. Please update the SCHEMAPLAN_PATH configuration.")
             return  # Exit the function if the user does not confirm
 
-        data_dir = DATA_DIR
+        # parse the schemaplan once up front; every module reuses this instance
+        get_schemaplan()
+        run_metrics.reset()
+        clear_header_lookup()
+        reset_reconciled()
+        started = time.time()
+        try:
+            ensure_manifest_table()
+            ensure_journal_table()
+            results = self._ingest(project_key, workers, force, run_id=new_run_id())
+            write_run_report(results, started, workers)
+        finally:
+            close_pool()
+
+    def do_watch(self, arg):
+        """
+        Stay running and ingest project folders as soon as they finish landing in DATA_DIR
+        (each subfolder, or DATA_DIR itself). A folder is ready when it contains the
+        WATCH_MARKER_FILE or nothing in it changed for WATCH_QUIET_SECONDS, and is loaded
+        again whenever its files change. The schemaplan, connection pool, dataHeader key
+        cache and checked table DDL stay warm between loads. Never prompts; stop with Ctrl-C.
+        Usage: watch [debug] [force] [workers=N]
+        """
+        options = self._options(arg, "watch [debug] [force] [workers=N]")
+        if options is None:
+            return
+        workers, force = options
+        logger.info(f"main:: watching {DATA_DIR} (TABLE_SCHEMA: {DBSCHEMA}, database: {DATABASE_CONFIG['host']}, "
+                    f"SCHEMAPLAN: \"{os.path.basename(SCHEMAPLAN_PATH)}\"). Folders load after {WATCH_QUIET_SECONDS}s "
+                    f"without changes or once they contain {WATCH_MARKER_FILE}.")
+
+        get_schemaplan()
+        clear_header_lookup()
+        reset_reconciled()
+        watcher = FolderWatcher()
+        try:
+            ensure_manifest_table()
+            ensure_journal_table()
+            cache_started = time.monotonic()
+            while True:
+                for folder, signature in watcher.poll():
+                    if time.monotonic() - cache_started > WATCH_CACHE_SECONDS:
+                        # other writers may have touched dataHeader or the tables since we cached them
+                        logger.info("main:: dataHeader cache and table checks are stale, reloading them.")
+                        clear_header_lookup()
+                        reset_reconciled()
+                        cache_started = time.monotonic()
 
-        # Initialize a list to hold CSV files
-        csv_files = [file_name for file_name in os.listdir(data_dir) if file_name.endswith(".csv")]
+                    logger.info(f"main:: {folder} has finished landing, ingesting.")
+                    run_metrics.reset()
+                    started = time.time()
+                    try:
+                        results = self._ingest(None, workers, force, folder, new_run_id())
+                        write_run_report(results, started, workers, folder)
+                    except Exception as e:
+                        logger.error(f"main:: ingest of {folder} failed: {e}")
+                    # failed tables are retried once the folder changes again
+                    watcher.mark_done(folder, signature)
+                time.sleep(WATCH_POLL_SECONDS)
+        except KeyboardInterrupt:
+            logger.info("main:: watch stopped.")
+        finally:
+            close_pool()
+
+    def do_resume(self, arg):
+        """
+        Continue the loads an interrupted run left unfinished. Every table with batches in
+        the journal is loaded again from its folder, starting after the last committed
+        batch (LOAD_MODE=batch); tables the run already finished are skipped through the
+        manifest. Never prompts, the interrupted run was already confirmed.
+        Usage: resume [debug] [workers=N]
+        """
+        options = self._options(arg, "resume [debug] [workers=N]")
+        if options is None:
+            return
+        workers, _ = options
+        get_schemaplan()
+        run_metrics.reset()
+        clear_header_lookup()
+        reset_reconciled()
+        started = time.time()
+        try:
+            ensure_manifest_table()
+            ensure_journal_table()
+            pending = pending_loads()
+            if not pending:
+                if LOAD_MODE != "batch":
+                    # merge mode commits a table all at once, there are no batches to continue from
+                    logger.warning(f"main:: nothing to resume: LOAD_MODE is '{LOAD_MODE}', only LOAD_MODE=batch journals "
+                                   "its batches. Run ingest again, finished tables are skipped through the manifest.")
+                else:
+                    logger.info("main:: the journal has no unfinished loads, nothing to resume.")
+                return
+            if LOAD_MODE != "batch":
+                logger.warning(f"main:: LOAD_MODE is '{LOAD_MODE}': the unfinished tables are loaded again from the start, "
+                               "set LOAD_MODE=batch to continue after their last committed batch.")
+            for load in pending:
+                logger.info(f"main:: {load['table_name']} of run {load['run_id']}: {load['rows']} of {load['frame_rows']} rows "
+                            f"committed (last batch at {load['committed_at']}), from {load['source_file']}.")
+
+            # the interrupted run's folders, each ingested whole so dataHeader still goes first
+            folders = sorted({os.path.dirname(load['source_file']) for load in pending if load['source_file']})
+            results = []
+            for folder in folders:
+                if not os.path.isdir(folder):
+                    logger.error(f"main:: {folder} no longer exists, its loads can't be resumed.")
+                    continue
+                logger.info(f"main:: resuming {folder} (TABLE_SCHEMA: {DBSCHEMA}, database: {DATABASE_CONFIG['host']}).")
+                results.extend(self._ingest(None, workers, False, folder, pending[0]['run_id']))
+            write_run_report(results, started, workers)
+        finally:
+            close_pool()
+
+    def do_profile(self, arg):
+        """
+        Load one table's input file from DATA_DIR (process_csv, then insert_dataframe_to_db)
+        under cProfile and tracemalloc, and write the hot spots, the python allocation
+        peaks per stage, the polars plan of the cleaning steps and the EXPLAIN (ANALYZE,
+        BUFFERS) of the merge into one directory under PROFILE_DIR. The rows are really
+        loaded into TABLE_SCHEMA; the manifest is not updated.
+        Usage: profile <table> [debug]
+        """
+        options = self._options(arg, "profile <table> [debug]")
+        if options is None:
+            return
+        table_names = [option for option in arg.split() if option != 'debug']
+        if len(table_names) != 1:
+            print("Usage: profile <table>")
+            return
+        table_name = table_names[0]
+        input_files = sorted(file_name for file_name in os.listdir(DATA_DIR)
+                             if is_input_file(file_name) and table_name_from_path(file_name) == table_name)
+        if not input_files:
+            logger.error(f"main:: no input file for table '{table_name}' in {DATA_DIR}.")
+            return
+        file_path = os.path.join(DATA_DIR, input_files[0])
+
+        confirm = input(f"Profiling loads {file_path} into {DBSCHEMA}.\"{table_name}\" on {DATABASE_CONFIG['host']}. Continue? (y/n): ").strip().lower()
+        if confirm != 'y':
+            logger.info("Aborting profile.")
+            return
+
+        project_key = None
+        if any(file_name.endswith(".xlsx") and 'project' in file_name for file_name in os.listdir(DATA_DIR)):
+            project_key = projectkey_extract(DATA_DIR)
+        get_schemaplan()
+        run_metrics.reset()
+        clear_header_lookup()
+        reset_reconciled()
+        try:
+            report_dir = profile_table(file_path, project_key)
+            print(f"Profile written to {report_dir}")
+        finally:
+            close_pool()
+
+    def _options(self, arg, usage: str = "<command> [debug] [force] [workers=N]"):
+        # (workers, force) from the shared ingest/watch/resume/profile options, None (usage printed) if they don't parse
+        workers = INGEST_WORKERS
+        force = 'force' in arg.split()
+        # Check if 'debug' is in the argument
+        if 'debug' in arg.split():
+            logging.getLogger().setLevel(logging.DEBUG)  # Set root logger to DEBUG level
+            logger.debug('Debug mode enabled.')
+        for option in arg.split():
+            if option.startswith('workers='):
+                value = option.split('=', 1)[1]
+                if not value.isdigit() or int(value) < 1:
+                    logger.error(f"main:: workers must be a positive integer, got '{value}'.")
+                    print(f"Usage: {usage}")
+                    return None
+                workers = int(value)
+        return workers, force
+
+    def _ingest(self, project_key, workers, force, data_dir=DATA_DIR, run_id=None):
+
+        # Initialize a list to hold the input files (csv, compressed csv, parquet, arrow ipc)
+        csv_files = sorted(file_name for file_name in os.listdir(data_dir) if is_input_file(file_name))
         project_file = [file_name for file_name in os.listdir(data_dir) if file_name.endswith(".xlsx") and 'project' in file_name]
 
         if len(project_file)>0:
             logger.info("main:: project xlsx found, extracting projectkey")
-            projectpath = os.path.join(DATA_DIR,project_file[0])
+            projectpath = os.path.join(data_dir,project_file[0])
             load_projecttable(projectpath, 'tblProject')
-            project_key = projectkey_extract()
-
-        # Check if "dataHeader.csv" exists and process it first
-        if "dataHeader.csv" in csv_files:
-            file_path = os.path.join(data_dir, "dataHeader.csv")
-            result = process_csv(file_path, project_key)
-            df = result['dataframe']
-            table_name = result['table_name']
-            insert_dataframe_to_db(df, table_name)
-            logger.info(f"main:: Ingested file: dataHeader.csv into table \"{table_name}\" ")
-            csv_files.remove("dataHeader.csv")  # Remove it from the list to avoid reprocessing
-
-        # Process remaining CSV files
-        for file_name in csv_files:
-            file_path = os.path.join(data_dir, file_name)
-            result = process_csv(file_path, project_key)
-            df = result['dataframe']
-            table_name = result['table_name']
-            insert_dataframe_to_db(df, table_name)
+            project_key = projectkey_extract(data_dir)
+
+        results = []
+
+        # compare every table of this run with pg_catalog once, before any worker starts
+        unchecked = [table_name_from_path(file_name) for file_name in csv_files]
+        unchecked = [table_name for table_name in unchecked if table_name not in reconciled_tables()]
+        try:
+            if unchecked:
+                reconcile_tables(unchecked)
+        except Exception as e:
+            logger.warning(f"main:: catalog check failed, tables will be checked as they load: {e}")
+
+        # Check if a dataHeader file exists and process it first
+        header_files = [file_name for file_name in csv_files if table_name_from_path(file_name) == "dataHeader"]
+        if header_files:
+            header_file = header_files[0]
+            if len(header_files) > 1:
+                logger.warning(f"main:: several dataHeader files found, only {header_file} is loaded.")
+            file_path = os.path.join(data_dir, header_file)
+            header_result = ingest_file(file_path, project_key, force, run_id)
+            results.append(header_result)
+            # Remove them from the list to avoid reprocessing
+            csv_files = [file_name for file_name in csv_files if file_name not in header_files]
+            if header_result['status'] not in ('ok', 'skipped'):
+                # every other table references dataHeader, loading them now would only fail on the foreign key
+                logger.error(f"main:: {header_file} failed to ingest, skipping the remaining tables.")
+                log_ingest_summary(results)
+                return results
+            logger.info(f"main:: Ingested file: {header_file} into table \"{header_result['table_name']}\" ")
+
+        # Process remaining CSV files; they only depend on dataHeader, so they load concurrently
+        file_paths = [os.path.join(data_dir, file_name) for file_name in csv_files]
+        if file_paths:
+            try:
+                # read the committed dataHeader keys once here (unless still cached); the workers inherit them
+                header_keys()
+            except Exception as e:
+                logger.warning(f"main:: could not cache dataHeader keys, workers will read them themselves: {e}")
+        results.extend(ingest_files(file_paths, project_key, workers, force, run_id))
+        log_ingest_summary(results)
+        return results
 
     # def do_generate(self, arg):
     #     """
@@ -99,4 +313,8 @@ class TallIngester(cmd.Cmd):
         return True
 
 if __name__ == '__main__':
-    TallIngester().cmdloop()
+    if len(sys.argv) > 1:
+        # headless: run one command and exit, e.g. `python main.py watch workers=4`
+        TallIngester().onecmd(' '.join(sys.argv[1:]))
+    else:
+        TallIngester().cmdloop()
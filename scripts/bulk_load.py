@@ -0,0 +1,118 @@
+import logging
+
+import psycopg2
+
+from config import DBSCHEMA, BULK_MAINTENANCE_WORK_MEM
+from scripts.db_pool import get_connection
+from scripts.ddl import validate_foreign_keys, unmark_reconciled
+
+logger = logging.getLogger(__name__)
+
+
+def is_empty(cursor, table_name: str) -> bool:
+    cursor.execute(f'SELECT NOT EXISTS (SELECT 1 FROM {DBSCHEMA}."{table_name}")')
+    return cursor.fetchone()[0]
+
+
+def deferrable_definitions(cursor, table_name: str) -> dict:
+    """
+    what a bulk load can drop from DBSCHEMA.table_name and rebuild afterwards:
+    "keys" (primary key and unique constraints), "indexes" (indexes not backing a
+    constraint) and "foreign_keys", as (name, definition). a key that a foreign key of
+    another table depends on (dataHeader's PrimaryKey) can't be dropped and isn't listed.
+    """
+    relation = f'"{DBSCHEMA}"."{table_name}"'
+    cursor.execute("""
+        SELECT con.conname, con.contype, pg_get_constraintdef(con.oid)
+        FROM pg_catalog.pg_constraint con
+        WHERE con.conrelid = to_regclass(%s) AND con.contype IN ('p', 'u', 'f')
+          AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_constraint ref
+                          WHERE ref.contype = 'f' AND ref.conindid = con.conindid AND con.contype <> 'f')
+        ORDER BY con.conname
+    """, (relation,))
+    definitions = {"keys": [], "indexes": [], "foreign_keys": []}
+    for name, contype, definition in cursor.fetchall():
+        # a foreign key left NOT VALID earlier says so in its definition, restore_foreign_keys adds that itself
+        definitions["foreign_keys" if contype == 'f' else "keys"].append((name, definition.removesuffix(" NOT VALID")))
+
+    cursor.execute("""
+        SELECT c.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_catalog.pg_index i
+        JOIN pg_catalog.pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = to_regclass(%s)
+          AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_constraint con WHERE con.conindid = i.indexrelid)
+        ORDER BY c.relname
+    """, (relation,))
+    definitions["indexes"] = cursor.fetchall()
+    return definitions
+
+
+def drop_foreign_keys(cursor, table_name: str, definitions: dict):
+    # they lock the referenced table (dataHeader) too: the caller commits this on its own,
+    # so the COPY and the index builds don't hold that lock
+    for name, _ in definitions["foreign_keys"]:
+        cursor.execute(f'ALTER TABLE {DBSCHEMA}."{table_name}" DROP CONSTRAINT "{name}"')
+    if definitions["foreign_keys"]:
+        logger.info(f"bulk_load:: {table_name}: dropped {len(definitions['foreign_keys'])} foreign keys for the load.")
+
+
+def drop_deferred(cursor, table_name: str, definitions: dict):
+    # keys and indexes, in the load's transaction (foreign keys: drop_foreign_keys)
+    table = f'{DBSCHEMA}."{table_name}"'
+    for name, _ in definitions["keys"]:
+        cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+    for name, _ in definitions["indexes"]:
+        cursor.execute(f'DROP INDEX {DBSCHEMA}."{name}"')
+    logger.info(f"bulk_load:: {table_name}: dropped {len(definitions['keys'])} keys and {len(definitions['indexes'])} indexes for the load.")
+
+
+def rebuild_deferred(cursor, table_name: str, definitions: dict):
+    # rebuild what drop_deferred removed, each index sorted once from the loaded rows
+    table = f'{DBSCHEMA}."{table_name}"'
+    # a bigger sort budget, and postgres may build each btree with parallel workers
+    cursor.execute("SET LOCAL maintenance_work_mem = %s", (BULK_MAINTENANCE_WORK_MEM,))
+    for name, definition in definitions["keys"]:
+        logger.info(f"bulk_load:: {table_name}: ADD CONSTRAINT \"{name}\" {definition}")
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}')
+    for _, definition in definitions["indexes"]:
+        logger.info(f"bulk_load:: {table_name}: {definition}")
+        cursor.execute(definition)
+
+
+def restore_foreign_keys(conn, table_name: str, definitions: dict) -> list[str]:
+    """
+    add the foreign keys drop_foreign_keys removed back NOT VALID, which is instant, in a
+    transaction of their own, then validate them (ddl.validate_foreign_keys). returns the
+    constraints left NOT VALID because some rows fail them; the ddl reconciler tries
+    those again on later runs.
+    """
+    if not definitions["foreign_keys"]:
+        return []
+    table = f'{DBSCHEMA}."{table_name}"'
+    conn.rollback()
+    with conn.cursor() as cursor:
+        for name, definition in definitions["foreign_keys"]:
+            logger.info(f"bulk_load:: {table_name}: ADD CONSTRAINT \"{name}\" {definition} NOT VALID")
+            cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition} NOT VALID')
+    conn.commit()
+    return validate_foreign_keys(conn, table_name, [name for name, _ in definitions["foreign_keys"]])
+
+
+def restore_after_failure(conn, table_name: str, definitions: dict):
+    """
+    a bulk load failed after its foreign keys were dropped (and that committed): roll the
+    load back and put them back, over a fresh connection if `conn` lost its server. if that
+    fails too, the table is reconciled again before the next attempt, which re-adds them.
+    """
+    if not definitions["foreign_keys"]:
+        return
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        pass
+    try:
+        with get_connection() as fk_conn:
+            restore_foreign_keys(fk_conn, table_name, definitions)
+    except Exception as e:
+        logger.error(f"bulk_load:: {table_name}: could not restore the foreign keys: {e}")
+        unmark_reconciled(table_name)
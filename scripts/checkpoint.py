@@ -0,0 +1,139 @@
+import logging
+import os
+import random
+import time
+from datetime import datetime
+
+import psycopg2
+
+from config import DBSCHEMA, LOAD_RETRY_BACKOFF, LOAD_RETRY_BACKOFF_MAX
+from scripts.db_pool import get_connection
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_TABLE = "ingest_journal"
+# source row number of every frame row while it is loaded in journaled batches
+ROW_ORDINAL = "__row_ordinal"
+
+
+def new_run_id() -> str:
+    return f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+
+
+def source_key(fingerprint: dict) -> str:
+    # one string for the manifest fingerprint: batch ranges are only valid for the exact same input
+    return f"{fingerprint['content_sha256']}:{fingerprint['schemaplan_version']}:{fingerprint['cleaner_version']}"
+
+
+def ensure_journal_table():
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DBSCHEMA}."{JOURNAL_TABLE}" (
+                run_id TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                project_key TEXT NOT NULL DEFAULT '',
+                source_file TEXT,
+                source TEXT NOT NULL,
+                batch_start BIGINT NOT NULL,
+                batch_end BIGINT NOT NULL,
+                frame_rows BIGINT NOT NULL,
+                inserted BIGINT NOT NULL,
+                updated BIGINT NOT NULL,
+                committed_at TIMESTAMP NOT NULL DEFAULT now(),
+                PRIMARY KEY (table_name, project_key, source, batch_start)
+            );
+        """)
+        conn.commit()
+
+
+def resume_point(cursor, table_name: str, checkpoint: dict, frame_rows: int) -> dict:
+    """
+    how far earlier attempts at this table/project/input got: the source rows already
+    committed ("rows", batches are recorded in order so it's the highest batch_end) and
+    what they inserted and updated. entries made for a frame of another size are ignored,
+    the boundaries they describe don't apply to this one.
+    """
+    cursor.execute(f"""
+        SELECT max(batch_end), sum(inserted), sum(updated), min(frame_rows), max(frame_rows)
+        FROM {DBSCHEMA}."{JOURNAL_TABLE}"
+        WHERE table_name = %s AND project_key = %s AND source = %s
+    """, (table_name, checkpoint["project_key"] or '', checkpoint["source"]))
+    rows, inserted, updated, min_frame, max_frame = cursor.fetchone()
+    if rows is None:
+        return {"rows": 0, "inserted": 0, "updated": 0}
+    if min_frame != frame_rows or max_frame != frame_rows:
+        logger.warning(f"checkpoint:: journal of {table_name} was written for {max_frame} rows, the frame has {frame_rows}; starting over.")
+        return {"rows": 0, "inserted": 0, "updated": 0}
+    return {"rows": int(rows), "inserted": int(inserted), "updated": int(updated)}
+
+
+def record_batch(cursor, checkpoint: dict, table_name: str, batch_start: int, batch_end: int, frame_rows: int,
+                 inserted: int, updated: int):
+    # runs in the batch's own transaction: the journal never gets ahead of (or behind) the table
+    cursor.execute(f"""
+        INSERT INTO {DBSCHEMA}."{JOURNAL_TABLE}"
+            (run_id, table_name, project_key, source_file, source, batch_start, batch_end, frame_rows, inserted, updated)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (table_name, project_key, source, batch_start) DO UPDATE SET
+            run_id = EXCLUDED.run_id,
+            batch_end = EXCLUDED.batch_end,
+            inserted = EXCLUDED.inserted,
+            updated = EXCLUDED.updated,
+            committed_at = now()
+    """, (checkpoint["run_id"], table_name, checkpoint["project_key"] or '', checkpoint.get("source_file"),
+          checkpoint["source"], batch_start, batch_end, frame_rows, inserted, updated))
+
+
+def clear_journal(table_name: str, project_key: str):
+    # the table is fully loaded (and in the manifest): its batch ranges, of any input, are done with
+    try:
+        with get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"""
+                DELETE FROM {DBSCHEMA}."{JOURNAL_TABLE}" WHERE table_name = %s AND project_key = %s
+            """, (table_name, project_key or ''))
+            conn.commit()
+    except Exception as e:
+        # left over entries only matter to the same input, whose resume finds it complete
+        logger.warning(f"checkpoint:: could not clear the journal of {table_name}: {e}")
+
+
+def pending_loads() -> list[dict]:
+    # loads with committed batches that never finished, most recently active first
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT max(run_id), table_name, project_key, source_file, max(batch_end), max(frame_rows), max(committed_at)
+            FROM {DBSCHEMA}."{JOURNAL_TABLE}"
+            GROUP BY table_name, project_key, source_file
+            ORDER BY max(committed_at) DESC
+        """)
+        return [{"run_id": run_id, "table_name": table_name, "project_key": project_key, "source_file": source_file,
+                 "rows": rows, "frame_rows": frame_rows, "committed_at": committed_at}
+                for run_id, table_name, project_key, source_file, rows, frame_rows, committed_at in cursor.fetchall()]
+
+
+# serialization failure, deadlock, server shutting down or starting up: the next attempt can succeed
+RETRYABLE_PGCODES = {"40001", "40P01", "57P01", "57P02", "57P03"}
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    whether a failed load is worth another attempt: a lost connection (no SQLSTATE, or
+    class 08) or one of RETRYABLE_PGCODES. disk full, out of memory, a cancelled or timed
+    out statement... fail the same way again.
+    """
+    pgcode = getattr(error, "pgcode", None)
+    if pgcode is None:
+        # psycopg2 raises these without a SQLSTATE when the connection itself is gone
+        return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+    return pgcode.startswith("08") or pgcode in RETRYABLE_PGCODES
+
+
+def backoff(attempt: int) -> float:
+    """
+    sleep before retry number `attempt` (0 based): LOAD_RETRY_BACKOFF doubled every
+    attempt up to LOAD_RETRY_BACKOFF_MAX, with up to 50% jitter so workers that lost the
+    same server don't all reconnect at once. returns the seconds slept.
+    """
+    delay = min(LOAD_RETRY_BACKOFF_MAX, LOAD_RETRY_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.0)
+    time.sleep(delay)
+    return delay
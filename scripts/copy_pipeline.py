@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from config import COPY_QUEUE_BYTES
+from scripts import run_metrics
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class ByteBudgetQueue:
+    """
+    queue bounded by the bytes it holds rather than by its length. put() blocks while
+    the queued and in-flight batches already use max_bytes; a batch is only released
+    (release()) once the consumer is done with it. one batch is always let through, so a
+    single batch larger than the budget can't deadlock the pipeline.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items = deque()
+        self._bytes = 0
+        self._failed = None
+        self._cond = threading.Condition()
+
+    def put(self, item, nbytes: int) -> float:
+        # returns the seconds the producer was held back
+        started = time.perf_counter()
+        with self._cond:
+            while self._failed is None and self._bytes and self._bytes + nbytes > self.max_bytes:
+                self._cond.wait()
+            if self._failed is not None:
+                raise RuntimeError("COPY consumer failed") from self._failed
+            self._items.append((item, nbytes))
+            self._bytes += nbytes
+            self._cond.notify_all()
+        return time.perf_counter() - started
+
+    def get(self):
+        with self._cond:
+            while not self._items:
+                self._cond.wait()
+            return self._items.popleft()
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self._bytes -= nbytes
+            self._cond.notify_all()
+
+    def close(self):
+        # end of input: the consumer stops after the batches already queued
+        with self._cond:
+            self._items.append((_DONE, 0))
+            self._cond.notify_all()
+
+    def fail(self, error: BaseException):
+        # wakes a blocked producer, which then raises instead of queueing more
+        with self._cond:
+            self._failed = error
+            self._cond.notify_all()
+
+
+def pipelined_copy(batches, consume, max_bytes: int = COPY_QUEUE_BYTES):
+    """
+    run consume(batch) for every (batch, nbytes) that the `batches` iterator yields, on a
+    consumer thread, while the calling thread produces the next ones. at most max_bytes
+    of produced batches are held at a time; the producer waits when they are. the first
+    error on either side stops both and is raised here.
+    """
+    queue = ByteBudgetQueue(max_bytes)
+    errors = []
+
+    def consumer():
+        while True:
+            item, nbytes = queue.get()
+            if item is _DONE:
+                return
+            try:
+                consume(item)
+            except BaseException as e:
+                errors.append(e)
+                queue.fail(e)
+                return
+            finally:
+                queue.release(nbytes)
+
+    thread = threading.Thread(target=consumer, name="copy-consumer", daemon=True)
+    thread.start()
+    waited = 0.0
+    try:
+        for batch, nbytes in batches:
+            waited += queue.put(batch, nbytes)
+    except RuntimeError:
+        # the consumer's error is the one worth reporting
+        if not errors:
+            raise
+    finally:
+        queue.close()
+        thread.join()
+        run_metrics.increment("copy.backpressure_seconds", waited)
+    if errors:
+        raise errors[0]
+    if waited:
+        logger.debug(f"copy_pipeline:: producer waited {waited:.3f}s on the {max_bytes} byte budget.")
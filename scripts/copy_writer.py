@@ -0,0 +1,15 @@
+import io
+
+import polars as pl
+
+
+def dataframe_to_csv_buffer(df: pl.DataFrame) -> io.BytesIO:
+    """
+    serialize df for COPY ... FROM STDIN WITH (FORMAT csv, HEADER true). polars writes the
+    csv from its arrow buffers, so no per-row python objects are created and nothing hits disk.
+    nulls are written as unquoted empty fields, which COPY reads back as NULL.
+    """
+    buffer = io.BytesIO()
+    df.write_csv(buffer, include_header=True)
+    buffer.seek(0)
+    return buffer
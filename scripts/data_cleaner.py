@@ -1,4 +1,7 @@
-from config import TODAYS_DATE
+from config import TODAYS_DATE, GEOMETRY_SRID
+from scripts.ewkb import encode_points_hex
+from scripts.row_hash import key_hash
+from scripts.schemaplan import VALUE_RULES
 import polars as pl
 # from datetime import datetime
 import logging
@@ -9,7 +12,7 @@ logger = logging.getLogger(__name__)
 def add_or_update_project_key(csv_df: pl.DataFrame, project_key: str) -> pl.DataFrame:
 
     # Check if 'ProjectKey' column exists in the DataFrame
-    if 'ProjectKey' in csv_df.columns:
+    if 'ProjectKey' in csv_df.collect_schema().names():
         # Update existing 'ProjectKey' column with the given project_key value
         csv_df = csv_df.with_columns(pl.lit(project_key).alias('ProjectKey'))
     else:
@@ -18,8 +21,12 @@ def add_or_update_project_key(csv_df: pl.DataFrame, project_key: str) -> pl.Data
 
     return csv_df
 
-def deduplicate_dataframe(df: pl.DataFrame, subset:list[str]) -> pl.DataFrame:
-    return df.unique(subset=subset)
+def deduplicate_dataframe(df: pl.DataFrame, subset:list[str], by_hash: bool = False) -> pl.DataFrame:
+    if by_hash:
+        # one 64 bit key hash per row instead of comparing the key columns as tuples
+        return df.filter(key_hash(subset).is_first_distinct())
+    # first of each key, in file order: the same input always gives the same frame
+    return df.unique(subset=subset, keep="first", maintain_order=True)
 
 def dateloadedfix(df: pl.DataFrame) -> pl.DataFrame:
     # current_date = datetime.now().strftime('%Y-%m-%d')
@@ -36,13 +43,16 @@ def dateloadedfix(df: pl.DataFrame) -> pl.DataFrame:
     )
     return df
 
-def create_postgis_geometry(df: pl.DataFrame) -> pl.DataFrame:
-    if "wkb_geometry" in df.columns:
-        df = df.with_columns(pl.lit(None).alias('wkb_geometry'))
+def create_postgis_geometry(df: pl.DataFrame, srid: int = GEOMETRY_SRID) -> pl.DataFrame:
+    # wkb_geometry as hex EWKB (point + srid) packed from the NAD83 coordinates
+    if "wkb_geometry" in df.collect_schema().names():
         df = df.with_columns(
-            pl.when(pl.col('wkb_geometry').is_null())
-            .then(pl.format("POINT({} {})", pl.col('Longitude_NAD83'), pl.col('Latitude_NAD83')))
-            .otherwise(pl.col('wkb_geometry'))
+            pl.struct(['Longitude_NAD83', 'Latitude_NAD83'])
+            .map_batches(
+                lambda points: encode_points_hex(points.struct.field('Longitude_NAD83'),
+                                                 points.struct.field('Latitude_NAD83'), srid),
+                return_dtype=pl.Utf8,
+            )
             .alias('wkb_geometry')
         )
     else:
@@ -51,9 +61,10 @@ def create_postgis_geometry(df: pl.DataFrame) -> pl.DataFrame:
     return df
 
 def numericfix(df: pl.DataFrame, colscheme: dict) -> pl.DataFrame:
-    for i in df.columns:
+    schema = df.collect_schema()
+    for i in schema.names():
         # if column SHOULD be numeric, but is string
-        if colscheme[i].lower() == 'numeric' and df[i].dtype==pl.Utf8:
+        if colscheme[i].lower() == 'numeric' and schema[i]==pl.Utf8:
             logging.debug(f'data_cleaner.numericfix is casting col "{i}" from str to numeric')
             df = df.with_columns(
                 pl.when(pl.col(i) == "NA")
@@ -66,7 +77,7 @@ def numericfix(df: pl.DataFrame, colscheme: dict) -> pl.DataFrame:
                 pl.col(i).cast(pl.Float64).alias(i)
             )
         # if column SHOULD be numeric, but is integer
-        elif colscheme[i].lower() == 'numeric' and df[i].dtype==pl.Int64:
+        elif colscheme[i].lower() == 'numeric' and schema[i]==pl.Int64:
             logging.debug(f'data_cleaner.numericfix is casting col "{i}" from int to numeric')
             df = df.with_columns(
                 pl.col(i).cast(pl.Float64).alias(i)
@@ -74,9 +85,10 @@ def numericfix(df: pl.DataFrame, colscheme: dict) -> pl.DataFrame:
     return df
 
 def integerfix(df: pl.DataFrame, colscheme: dict) -> pl.DataFrame:
-    for i in df.columns:
+    schema = df.collect_schema()
+    for i in schema.names():
         # if column SHOULD be integer, but is string
-        if colscheme[i].lower() == 'integer' and df[i].dtype==pl.Utf8:
+        if colscheme[i].lower() == 'integer' and schema[i]==pl.Utf8:
             logging.debug(f'data_cleaner.integerfix is casting col "{i}" from str to integer')
             df = df.with_columns(
                 pl.when(pl.col(i) == "NA")
@@ -89,7 +101,7 @@ def integerfix(df: pl.DataFrame, colscheme: dict) -> pl.DataFrame:
                 pl.col(i).cast(pl.Int64).alias(i)
             )
         # if column SHOULD be integer, but is numeric
-        elif colscheme[i].lower() == 'integer' and df[i].dtype==pl.Float64:
+        elif colscheme[i].lower() == 'integer' and schema[i]==pl.Float64:
             logging.debug(f'data_cleaner.integerfix is casting col "{i}" from numeric to integer')
             df = df.with_columns(
                 pl.col(i).cast(pl.Int64).alias(i)
@@ -97,51 +109,42 @@ def integerfix(df: pl.DataFrame, colscheme: dict) -> pl.DataFrame:
     return df
 
 def bitfix(df: pl.DataFrame, colscheme: dict) -> pl.DataFrame:
-    for i in df.columns:
+    schema = df.collect_schema()
+    for i in schema.names():
         # Handle string types that need conversion to bits
-        if colscheme[i].lower() == 'bit' and df.select(pl.col(i)).dtypes[0] == pl.Utf8:
+        if colscheme[i].lower() == 'bit' and schema[i] == pl.Utf8:
             logging.debug(f'data_cleaner.bitfix is processing col "{i}" to bit (found string)')
-            df = df.with_columns(pl.when(pl.col(i) == '').then(None))
-            if df[i].is_in(["TRUE", "FALSE"]).any():
-                df = df.with_columns(
-                    pl.when(pl.col(i) == "TRUE").then(1)
-                    .when(pl.col(i) == "FALSE").then(0)
-                    .otherwise(pl.col(i))
-                    .alias(i)
-                )
+            df = df.with_columns(pl.when(pl.col(i) == '').then(None).otherwise(pl.col(i)).alias(i))
 
-            elif df[i].is_in(["Y", "N"]).any():
-                df = df.with_columns(
-                    pl.when(pl.col(i) == "Y").then(1)
-                    .when(pl.col(i) == "N").then(0)
+            # the vocabulary is picked per column (first one present wins), the checks are
+            # column-wide aggregates so this stays a single expression on a LazyFrame
+            df = df.with_columns(
+                pl.when(pl.col(i).is_in(["TRUE", "FALSE", "true", "false"]).any())
+                .then(
+                    pl.when(pl.col(i).is_in(["TRUE", "true"])).then(pl.lit("1"))
+                    .when(pl.col(i).is_in(["FALSE", "false"])).then(pl.lit("0"))
                     .otherwise(pl.col(i))
-                    .alias(i)
                 )
-
-            elif df[i].is_in(["L", "D", ""]).any():
-                df = df.with_columns(
-                    pl.when(pl.col(i) == "D").then(1)
-                    .when(pl.col(i) == "L").then(0)
-                    .when(pl.col(i) == "").then(None)
+                .when(pl.col(i).is_in(["Y", "N"]).any())
+                .then(
+                    pl.when(pl.col(i) == "Y").then(pl.lit("1"))
+                    .when(pl.col(i) == "N").then(pl.lit("0"))
                     .otherwise(pl.col(i))
-                    .alias(i)
                 )
-
-
-            elif df[i].is_in(["0", "1"]).any():
-                df = df.with_columns(
-                    pl.when(pl.col(i).is_null()).then(None)
-                    .when(pl.col(i) == "1").then(1)
-                    .when(pl.col(i) == "0").then(0)
+                .when(pl.col(i).is_in(["L", "D"]).any())
+                .then(
+                    pl.when(pl.col(i) == "D").then(pl.lit("1"))
+                    .when(pl.col(i) == "L").then(pl.lit("0"))
                     .otherwise(pl.col(i))
-                    .alias(i)
                 )
-
-            # Convert column to string
-            df = df.with_columns(pl.col(i).cast(pl.Utf8).alias(i))
+                # "0"/"1" columns are already in their final form
+                .otherwise(pl.col(i))
+                .cast(pl.Utf8)
+                .alias(i)
+            )
 
         # Handle case where the column is a boolean type
-        elif colscheme[i].lower() == 'bit' and df.select(pl.col(i)).dtypes[0] == pl.Boolean:
+        elif colscheme[i].lower() == 'bit' and schema[i] == pl.Boolean:
             logging.debug(f'data_cleaner.bitfix is processing col "{i}" to bit (found boolean)')
             df = df.with_columns(pl.col(i).cast(pl.Utf8).alias(i))
             df = df.with_columns(
@@ -151,7 +154,7 @@ def bitfix(df: pl.DataFrame, colscheme: dict) -> pl.DataFrame:
                 .alias(i)
             )
 
-        elif colscheme[i].lower() == 'bit' and df.select(pl.col(i)).dtypes[0] == pl.Int64:
+        elif colscheme[i].lower() == 'bit' and schema[i] == pl.Int64:
             logging.debug(f'data_cleaner.bitfix is processing col "{i}" to bit (found integer)')
             df = df.with_columns(
                 pl.when(pl.col(i).is_null()).then(pl.lit(None))
@@ -161,3 +164,62 @@ def bitfix(df: pl.DataFrame, colscheme: dict) -> pl.DataFrame:
                 .alias(i)
             )
     return df
+
+
+def _without_sentinels(name: str, datatype: str) -> pl.Expr:
+    # the VALUE_RULES sentinels of a schemaplan DataType as null, ahead of a cast
+    return pl.when(pl.col(name).is_in(VALUE_RULES[datatype]["sentinels"])).then(pl.lit(None)).otherwise(pl.col(name))
+
+def _numeric_expr(name: str, dtype: pl.DataType):
+    # same steps as numericfix, as one expression
+    if dtype == pl.Utf8:
+        return _without_sentinels(name, "numeric").cast(pl.Float64).alias(name)
+    if dtype == pl.Int64:
+        return pl.col(name).cast(pl.Float64).alias(name)
+    return None
+
+def _integer_expr(name: str, dtype: pl.DataType):
+    # same steps as integerfix, as one expression
+    if dtype == pl.Utf8:
+        return _without_sentinels(name, "integer").cast(pl.Int64).alias(name)
+    if dtype == pl.Float64:
+        return pl.col(name).cast(pl.Int64).alias(name)
+    return None
+
+def _bit_expr(name: str, dtype: pl.DataType):
+    # same steps as bitfix, as one expression. text bit columns are not handled here:
+    # scripts.normalize maps them from their distinct values after the collect
+    if dtype == pl.Boolean:
+        col = pl.col(name).cast(pl.Utf8)
+        return pl.when(col == "true").then(1).when(col == "false").then(0).otherwise(col).alias(name)
+    if dtype == pl.Int64:
+        return (
+            pl.when(pl.col(name).is_null()).then(pl.lit(None))
+            .when(pl.col(name) == pl.lit(1)).then(pl.lit('1'))
+            .when(pl.col(name) == pl.lit(0)).then(pl.lit('0'))
+            .otherwise(pl.lit(None))
+            .alias(name)
+        )
+    return None
+
+_COERCIONS = {"numeric": _numeric_expr, "integer": _integer_expr, "bit": _bit_expr}
+
+def compile_coercion(schema: pl.Schema, colscheme: dict) -> list[pl.Expr]:
+    """
+    the numericfix + integerfix + bitfix step for a frame with this schema, as one
+    expression per column that needs it. columns already in their target dtype get none,
+    text bit columns are left to normalize_values.
+    """
+    exprs = []
+    for name, dtype in schema.items():
+        build = _COERCIONS.get(colscheme[name].lower())
+        expr = build(name, dtype) if build else None
+        if expr is not None:
+            exprs.append(expr)
+    return exprs
+
+def coerce_types(df: pl.DataFrame, colscheme: dict) -> pl.DataFrame:
+    # numericfix, integerfix and the non-text bitfix cases in a single with_columns (one projection on a LazyFrame)
+    exprs = compile_coercion(df.collect_schema(), colscheme)
+    logging.debug(f'data_cleaner.coerce_types is coercing {len(exprs)} columns')
+    return df.with_columns(exprs) if exprs else df
@@ -1,75 +1,109 @@
 import polars as pl
 import logging
 import os
+import tempfile
 
-from config import SCHEMAPLAN_PATH, PROJECTFILE_PATH
-from scripts.data_cleaner import deduplicate_dataframe, bitfix, dateloadedfix, create_postgis_geometry, numericfix, integerfix, add_or_update_project_key
+from config import PROJECTFILE_PATH, ROW_HASHES
+from scripts.data_cleaner import deduplicate_dataframe, dateloadedfix, create_postgis_geometry, coerce_types, add_or_update_project_key
 from scripts.utils import schema_to_dictionary, generate_unique_constraint_standalone
+from scripts.readers import scan_input, table_name_from_path
 from scripts.data_validator import dataframe_validator
+from scripts.normalize import normalize_values
+from scripts import run_metrics
 from scripts.db_connector import insert_project, subset_and_save, populate_datevisited
 
 logger = logging.getLogger(__name__)
 
-def process_csv(file_name: str, project_key: str = None):
+def process_csv(file_name: str, project_key: str = None, plans: list = None):
+    # despite the name, any input format in readers.INPUT_EXTENSIONS (csv, .csv.gz/.zst, parquet, arrow ipc).
+    # given a plans list, the optimized polars plan of the cleaning steps is appended to it
     logger.info(f"Starting process_csv function for file: {file_name}")
-    # Load the CSV into a DataFrame with schemaplan fields
-    filename = os.path.basename(file_name)
-    table_name = os.path.splitext(filename)[0]
+    # Load the file into a DataFrame with schemaplan fields
+    table_name = table_name_from_path(file_name)
     logger.info(f"Extracted table name: {table_name}")
+    # decompressed copies of .gz/.zst inputs live here until the plan is collected
+    scratch = tempfile.TemporaryDirectory(prefix="ingest_")
 
     try:
-        # Validate with schemaplan
-        logger.info(f"Loading CSV from data/{table_name}.csv")
-        csv_df = pl.read_csv(f"data/{table_name}.csv", null_values=["NA", "N/A", "null"], infer_schema_length=10000000)
-        csv_df = dataframe_validator(csv_df, table_name)
+        # Build a lazy scan typed from the schemaplan: no inference pass over the file, and
+        # projection pushdown means only the schemaplan columns are ever parsed
+        logger.info(f"Scanning {file_name}")
+        with run_metrics.stage(table_name, "scan"):
+            csv_lf = scan_input(file_name, table_name, scratch.name)
+
+            # Validate with schemaplan
+            csv_lf = dataframe_validator(csv_lf, table_name)
         logger.info(f"DataFrame validated for table: {table_name}")
 
-        if csv_df is not None:
+        if csv_lf is not None:
             # Cleaning functions: populate fields, clean fields, etc.
             logger.info(f'Working on: "{table_name}"...')
 
             # Add project_key if provided, otherwise check if present in the DataFrame
             if project_key is not None:
-                csv_df = add_or_update_project_key(csv_df, project_key)
+                csv_lf = add_or_update_project_key(csv_lf, project_key)
                 logger.info(f"Project key '{project_key}' added/updated in DataFrame.")
             else:
                 logger.info("Project key not provided. Checking for existing 'ProjectKey' in DataFrame...")
-                if "ProjectKey" in csv_df.columns and csv_df[0].select(pl.col("ProjectKey").unique())[0, 0] is not None:
-                    existing_project_key = csv_df[0].select(pl.col("ProjectKey").unique())[0, 0]
+                existing_project_key = None
+                if "ProjectKey" in csv_lf.collect_schema().names():
+                    existing_project_key = csv_lf.select(pl.col("ProjectKey").first()).collect()[0, 0]
+                if existing_project_key is not None:
                     logger.info(f"Using 'ProjectKey' = {existing_project_key} found within CSV.")
                 else:
                     logger.info("'ProjectKey' not found, proceeding with null 'ProjectKey' column.")
 
             # Additional data processing
             logger.info(f"Creating PostGIS geometry for table: {table_name}")
-            csv_df = create_postgis_geometry(csv_df)
+            csv_lf = create_postgis_geometry(csv_lf)
 
             logger.info(f"Fixing 'DateLoadedInDb' for table: {table_name}")
-            csv_df = dateloadedfix(csv_df)
+            csv_lf = dateloadedfix(csv_lf)
 
             logger.info(f"Deduplicating DataFrame for table: {table_name}")
-            csv_df = deduplicate_dataframe(csv_df, generate_unique_constraint_standalone(table_name))
+            csv_lf = deduplicate_dataframe(csv_lf, generate_unique_constraint_standalone(table_name), by_hash=ROW_HASHES)
 
-            # Apply schema corrections
+            # Apply schema corrections: numeric, integer and bit fixes compiled into one projection
             scheme = schema_to_dictionary(table_name)
-            logger.info(f"Applying numeric fix for table: {table_name}")
-            csv_df = numericfix(csv_df, scheme)
-
-            logger.info(f"Applying integer fix for table: {table_name}")
-            csv_df = integerfix(csv_df, scheme)
-
-            logger.info(f"Applying bit fix for table: {table_name}")
-            csv_df = bitfix(csv_df, scheme)
+            logger.info(f"Applying type coercion for table: {table_name}")
+            csv_lf = coerce_types(csv_lf, scheme)
+
+            # Everything above is one optimized plan; this is the only full pass over the file,
+            # so the "collect" stage covers reading, validating, deduplicating and coercing
+            logger.info(f"Collecting cleaned DataFrame for table: {table_name}")
+            if plans is not None:
+                plans.append(csv_lf.explain())
+            with run_metrics.stage(table_name, "collect") as stage:
+                csv_df = csv_lf.collect()
+                stage["rows_out"] = csv_df.height
+            logger.info(f"Collected {csv_df.height} rows for table: {table_name}")
+
+            # Bit vocabularies, NA sentinels and code maps, decided from each column's distinct values
+            logger.info(f"Normalizing values for table: {table_name}")
+            with run_metrics.stage(table_name, "normalize", rows_in=csv_df.height) as stage:
+                csv_df = normalize_values(csv_df, table_name)
+                stage["rows_out"] = csv_df.height
+
+            # Divert rows without a dataHeader PrimaryKey before they can abort the load
+            diverted = 0
+            if "dataHeader" not in table_name:
+                logger.info(f"Prefiltering rows without a dataHeader PrimaryKey for table: {table_name}")
+                with run_metrics.stage(table_name, "prefilter", rows_in=csv_df.height) as stage:
+                    csv_df = subset_and_save(csv_df, table_name)
+                    stage["rows_out"] = csv_df.height
+                    diverted = stage["rows_in"] - csv_df.height
 
             # Populate 'DateVisited' if necessary
             if "dataHeader" not in table_name:
                 logger.info(f"Not dataHeader! Checking for 'DateVisited' on: {table_name}")
-                if "DateVisited" not in csv_df.columns:
-                    logger.info(f"Adding 'DateVisited' column to table: {table_name}")
-                    csv_df = csv_df.with_columns(pl.lit(None).alias("DateVisited"))
-                if csv_df["DateVisited"].unique().to_list() == [None]:
-                    logger.info(f"Populating 'DateVisited' for table: {table_name} (found None)")
-                    csv_df = populate_datevisited(csv_df, table_name)
+                with run_metrics.stage(table_name, "datevisited", rows_in=csv_df.height) as stage:
+                    if "DateVisited" not in csv_df.columns:
+                        logger.info(f"Adding 'DateVisited' column to table: {table_name}")
+                        csv_df = csv_df.with_columns(pl.lit(None).alias("DateVisited"))
+                    if csv_df["DateVisited"].unique().to_list() == [None]:
+                        logger.info(f"Populating 'DateVisited' for table: {table_name} (found None)")
+                        csv_df = populate_datevisited(csv_df, table_name)
+                    stage["rows_out"] = csv_df.height
 
             logger.info(f"Finished processing CSV for table: {table_name}")
 
@@ -82,10 +116,11 @@ def process_csv(file_name: str, project_key: str = None):
                 csv_df = csv_df.select(schemaplankeys)
             
 
-            # Return the processed DataFrame and table name
+            # Return the processed DataFrame and table name, and how many rows went to NOPRIMARYKEYPATH
             return {
                 'table_name': table_name,
-                'dataframe': csv_df
+                'dataframe': csv_df,
+                'diverted': diverted
             }
         else:
             logger.warning(f"Validation failed for DataFrame of table: {table_name}")
@@ -94,6 +129,8 @@ def process_csv(file_name: str, project_key: str = None):
     except Exception as e:
         logger.error(f"Error processing CSV for table '{table_name}': {e}")
         return None
+    finally:
+        scratch.cleanup()
 
 
 def load_projecttable(excel_path: str, table_name: str):
@@ -110,10 +147,10 @@ def load_projecttable(excel_path: str, table_name: str):
 
     logger.info(f"data_loader:: Data inserted successfully into {table_name}")
 
-def projectkey_extract():
+def projectkey_extract(project_dir: str = PROJECTFILE_PATH):
     # load project path
-    basename = [i for i in os.listdir(PROJECTFILE_PATH) if 'project' in i][0]
-    projectpath = os.path.join(PROJECTFILE_PATH, basename)
+    basename = [i for i in os.listdir(project_dir) if 'project' in i][0]
+    projectpath = os.path.join(project_dir, basename)
 
     df = pl.read_excel(projectpath, sheet_id=0)['Sheet1']
 
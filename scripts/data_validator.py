@@ -1,20 +1,19 @@
 import polars as pl
 import logging
-from config import SCHEMAPLAN_PATH
-from scripts.utils import map_pg_type_to_polars
+from scripts.schemaplan import get_schemaplan
 
 logger = logging.getLogger(__name__)
 
-def dataframe_validator(df: pl.DataFrame, tablename: str) -> pl.DataFrame:
+def dataframe_validator(df: pl.DataFrame | pl.LazyFrame, tablename: str) -> pl.DataFrame | pl.LazyFrame:
     """
     validate the loaded dataframe with schemaplan by selecting columns directly from the
+    schemaplan. works on both eager and lazy frames; a LazyFrame stays lazy.
     """
-    # load entire schemaplan
-    schemaplan = pl.read_csv(SCHEMAPLAN_PATH, encoding='ISO-8859-1', schema_overrides={"Description": pl.Utf8})
+    schemaplan = get_schemaplan()
     # list of column names
-    fieldnames = [i for i in schemaplan.filter(pl.col("Table")==tablename)['Field']]
+    fieldnames = schemaplan.fields(tablename)
     # list of corresponding types (converted from postgres types to polars types)
-    fieldtypes = [map_pg_type_to_polars(i) for i in schemaplan.filter(pl.col("Table")==tablename)['DataType']]
+    fieldtypes = list(schemaplan.polars_dtypes(tablename).values())
 
     # create empty dataframe with the proper columns and dtypes 
     schemaplan_fields = pl.DataFrame(
@@ -22,14 +21,16 @@ def dataframe_validator(df: pl.DataFrame, tablename: str) -> pl.DataFrame:
     )
 
     # select which common columns between both df's so there are no surprises from the csv df
-    common_columns = [col for col in df.columns if col in schemaplan_fields.columns]
+    df_columns = df.collect_schema().names()
+    common_columns = [col for col in df_columns if col in schemaplan_fields.columns]
     df = df.select(common_columns)
 
     # add any column missing from the df PRESENT IN THE SCHEMAPLAN back in, and if it doesn't exist make it null
-    for col in schemaplan_fields.columns:
-        if col not in df.columns:
-            logger.info(f"dataframe_validator added field:\"{col}\" to \"{tablename}\"")
-            df = df.with_columns(pl.lit(None).alias(col))
+    missing_columns = [col for col in schemaplan_fields.columns if col not in common_columns]
+    for col in missing_columns:
+        logger.info(f"dataframe_validator added field:\"{col}\" to \"{tablename}\"")
+    if missing_columns:
+        df = df.with_columns([pl.lit(None).alias(col) for col in missing_columns])
 
 
     # select entire dataframe including the potentially null colums that were just added
@@ -1,20 +1,36 @@
-from csv import DictWriter
 from datetime import time
 import sys
 import psycopg2
 from sqlalchemy import create_engine
 import os
 
-from config import DATABASE_CONFIG, DBSCHEMA, SCHEMAPLAN_PATH, NOPRIMARYKEYPATH
-from scripts.utils import generate_unique_constraint_query
+from config import DBSCHEMA, NOPRIMARYKEYPATH, COPY_FORMAT, LOAD_MODE, GEOMETRY_SRID, ROW_HASHES, PARTITION_SWAP, BULK_LOAD, LOAD_RETRIES
+from scripts.ddl import reconcile_table
+from scripts.schemaplan import get_schemaplan
+from scripts.db_pool import get_connection
+from scripts.copy_writer import dataframe_to_csv_buffer
+from scripts.copy_pipeline import pipelined_copy
+from scripts.partitions import table_partitioning, conflict_columns, ensure_partitions, swap_partition
+from scripts.sharded_copy import shard_count, shard_frame, load_shards, union_source, drop_shards
+from scripts.checkpoint import ROW_ORDINAL, resume_point, record_batch, backoff, is_retryable
+from scripts.bulk_load import (is_empty, deferrable_definitions, drop_foreign_keys, drop_deferred, rebuild_deferred,
+                               restore_foreign_keys, restore_after_failure)
+from scripts.pgcopy import binary_column_kinds, staging_types, dataframe_to_binary_buffer
+from scripts.header_cache import datevisited_for, header_keys
+from scripts.row_hash import HASH_COLUMN_TYPES, ROW_HASH_COLUMN, add_row_hashes, fetch_existing_hashes, split_by_hash
+from scripts import run_metrics
 import polars as pl
 import logging
 
 from psycopg2 import sql
-from tempfile import NamedTemporaryFile
 
 logger = logging.getLogger(__name__)
 
+# stamped on every load, so a difference here alone doesn't make a row "changed"
+MERGE_IGNORED_COLUMNS = ("DateLoadedInDb",)
+# rows per COPY batch (and per commit in batch mode)
+COPY_BATCH_ROWS = 10000
+
 def map_dtype_to_sql(dtype: pl.DataType) -> str:
     if dtype == pl.Int64 or dtype == pl.Int32:
         return "INTEGER"
@@ -26,247 +42,432 @@ def map_dtype_to_sql(dtype: pl.DataType) -> str:
         return "TEXT"
 
 def unique_fields_per_table(table_name: str):
-    table_columns = {
-        # already known
-        "dataGap": ["PrimaryKey","LineKey", "RecKey", "SeqNo", "Gap", "RecType"],
-        "dataHeight": ["PrimaryKey", "LineKey", "RecKey","Height", "PointLoc", "PointNbr", "type", "HeightOption", "Direction"],
-        "dataHorizontalFlux": ["PrimaryKey","BoxID", "StackID"],
-        "dataLPI": ["PrimaryKey","LineKey", "RecKey", "layer", "code", "PointLoc", "PointNbr", "Direction", "chckbox"],
-        "dataSoilStability": ["PrimaryKey","LineKey", "RecKey", "Position","Pos", "Veg"],
-        "dataSpeciesInventory": ["PrimaryKey","LineKey", "RecKey", "Species"],
-        "geoSpecies": ["PrimaryKey","DBKey", "ProjectKey", "Species", "Duration", "GrowthHabit","GrowthHabitSub", "Hgt_Species_Avg_n"],
-
-        # primary key exclusives
-        "geoIndicators": ["PrimaryKey"],
-        "dataHeader": ["PrimaryKey"],
-
-        # to be determined
-        "dataDustDeposition": ["PrimaryKey"],
-        "dataPlotCharacterization": ["PrimaryKey"],
-        "dataSoilHorizons": ["PrimaryKey"],
-        "tblRHEM": ["PrimaryKey","Precipitation_Long_Term_MEAN", "Runoff_Long_Term_MEAN"],
-        # Add more table names and their respective unique constraint columns
-    }
-    return table_columns[table_name]
-
-
-
-def create_table_if_not_exists(table_name: str):
-    conn = None
-    try:
-
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cursor = conn.cursor()
-
-        schemaplan = pl.read_csv(SCHEMAPLAN_PATH, encoding='ISO-8859-1', schema_overrides={"Description": pl.Utf8})
-
-        fieldnames = [i for i in schemaplan.filter(pl.col("Table")==table_name)['Field']]
-        fieldtypes = [i for i in schemaplan.filter(pl.col("Table")==table_name)['DataType']]
-        # columns = ["rid SERIAL PRIMARY KEY"] + [i for i in schemaplan.filter(pl.col("Table")==table_name)['Field']]
-        columns = ["rid SERIAL PRIMARY KEY"] + [f'"{col}" {sqltype}' for col, sqltype in zip(fieldnames, fieldtypes)]
-
-
-        # Add constraints based on the table name
-        if table_name.lower() == "dataheader":
-            # If the table is "dataHeader", add a UNIQUE constraint to the "PrimaryKey" column
-            columns.append(f'UNIQUE ("PrimaryKey")')
-        else:
-            # If the table is not "dataHeader", add a FOREIGN KEY constraint
-            columns.append(f'FOREIGN KEY ("PrimaryKey") REFERENCES {DBSCHEMA}."dataHeader"("PrimaryKey")')
-        columns_sql = ', '.join(columns)
-        create_table_query = f"""
-        CREATE TABLE IF NOT EXISTS {DBSCHEMA}."{table_name}" (
-            {columns_sql}
-        );
-        """
-
-        cursor.execute(create_table_query)
-        conn.commit()
-
-
-        cursor.close()
-
-
-    except Exception as e:
-        if conn:
-            conn.rollback()
-
-        logger.info(f"Error creating table {table_name}: {e}")
-    finally:
-        if conn:
-            conn.close()
-
-
-def create_index_if_not_exist(table_name):
-    conn = None
-    try:
-
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute(f'CREATE INDEX IF NOT EXISTS {table_name}_rid_idx ON {DBSCHEMA}."{table_name}" (rid);')
-        conn.commit()
-
-
-    except Exception as e:
-        if conn:
-            conn.rollback()
-
-        logger.info(f"db_connector::create_index:: Error creating index on {table_name}: {e}")
-    finally:
-        if conn:
-            conn.close()
+    return get_schemaplan().unique_keys(table_name)
+
+
+
+def fetch_table_columns(cursor, table_name: str) -> dict[str, str]:
+    # column name -> formatted postgres type for DBSCHEMA.table_name, in table order, without rid
+    cursor.execute("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_catalog.pg_attribute a
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped AND a.attname <> 'rid'
+        ORDER BY a.attnum
+    """, (f'"{DBSCHEMA}"."{table_name}"',))
+    return dict(cursor.fetchall())
+
+def quote_ident(identifier: str) -> str:
+    return f'"{identifier}"'
+
+def build_merge_query(table_name: str, source: str, columns: list[str], select_list: str,
+                      unique_fields: list[str] = None, partitioned: bool = False) -> str:
+    """
+    set-based upsert of `source` into DBSCHEMA.table_name. conflicting rows are only
+    rewritten when a non-key column (other than MERGE_IGNORED_COLUMNS) actually changed,
+    and only one row of counts (inserted, updated) is sent back. unique_fields is the
+    conflict target, the table's unique key by default. a partitioned parent can't
+    return xmax, so there the new rows are counted against the target instead.
+    """
+    unique_fields = unique_fields or unique_fields_per_table(table_name)
+    column_list = ', '.join([f'"{col}"' for col in columns])
+    update_columns = [col for col in columns if col not in unique_fields]
+    compared_columns = [col for col in update_columns if col not in MERGE_IGNORED_COLUMNS]
+
+    if update_columns:
+        conflict_action = f"DO UPDATE SET {', '.join([f'{quote_ident(col)} = EXCLUDED.{quote_ident(col)}' for col in update_columns])}"
+        if compared_columns:
+            conflict_action += (
+                f" WHERE ({', '.join([f'target.{quote_ident(col)}' for col in compared_columns])})"
+                f" IS DISTINCT FROM ({', '.join([f'EXCLUDED.{quote_ident(col)}' for col in compared_columns])})"
+            )
+    else:
+        conflict_action = "DO NOTHING"
+
+    conflict_target = ', '.join([quote_ident(col) for col in unique_fields])
+    if partitioned:
+        # every part of the statement sees the target as it was before the insert
+        key_match = ' AND '.join([f'existing.{quote_ident(col)} = src.{quote_ident(col)}' for col in unique_fields])
+        return f'''
+        WITH src AS (
+            SELECT {select_list} FROM {source}
+        ), upserted AS (
+            INSERT INTO "{DBSCHEMA}"."{table_name}" AS target ({column_list})
+            SELECT * FROM src
+            ON CONFLICT ({conflict_target}) {conflict_action}
+            RETURNING 1
+        ), new_rows AS (
+            SELECT count(*) AS n FROM src
+            WHERE NOT EXISTS (SELECT 1 FROM "{DBSCHEMA}"."{table_name}" existing WHERE {key_match})
+        )
+        SELECT new_rows.n, (SELECT count(*) FROM upserted) - new_rows.n FROM new_rows;
+    '''
+
+    # xmax is 0 on freshly inserted row versions and set on updated ones
+    return f'''
+        WITH upserted AS (
+            INSERT INTO "{DBSCHEMA}"."{table_name}" AS target ({column_list})
+            SELECT {select_list} FROM {source}
+            ON CONFLICT ({conflict_target}) {conflict_action}
+            RETURNING (target.xmax = 0) AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted;
+    '''
 
-def create_unique_constraint_if_not_exist(table_name):
-    conn = None
+def explain_analyze(cursor, query: str) -> str:
+    # EXPLAIN (ANALYZE, BUFFERS) really runs the query: it's rolled back to a savepoint afterwards
+    cursor.execute("SAVEPOINT explain_analyze")
     try:
-
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cursor = conn.cursor()
-        unique_constraint_query = generate_unique_constraint_query(table_name)
-        cursor.execute(unique_constraint_query)
-        conn.commit()
-
-    except Exception as e:
-        if conn:
-            conn.rollback()
-
-        logger.info(f"db_connector::create_unique:: Error creating unique constraint on {table_name}: {e}")
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}")
+        return "\n".join([line for line, in cursor.fetchall()])
     finally:
-        if conn:
-            conn.close()
-
-def insert_dataframe_to_db(df: pl.DataFrame, table_name: str, geometry_column: str = None, srid: int = 4326):
-    logger.info(f"Starting insertion of DataFrame into table '{table_name}'.")
+        cursor.execute("ROLLBACK TO SAVEPOINT explain_analyze")
+
+def with_srid(df: pl.DataFrame, geometry_column: str, srid: int) -> pl.DataFrame:
+    # ST_SetSRID for a text COPY straight into a geometry column: postgis reads an "SRID=n;"
+    # prefix ahead of hex EWKB and WKT alike, and it wins over any srid inside the value
+    value = pl.col(geometry_column).str.replace(r"^SRID=\d+;", "")
+    return df.with_columns(pl.concat_str([pl.lit(f"SRID={int(srid)};"), value]).alias(geometry_column))
+
+def run_merge(cursor, merge_query: str, explain: list = None) -> tuple[int, int]:
+    # (inserted, updated). given an empty explain list, the plan of this merge is added to it first
+    if explain is not None and not explain:
+        explain.append(explain_analyze(cursor, merge_query))
+    cursor.execute(merge_query)
+    return cursor.fetchone()
+
+def copy_dataframe(cursor, df: pl.DataFrame, table_name: str, target: str, copy_format: str,
+                   binary_kinds: dict = None, after_batch=None, batch_size: int = COPY_BATCH_ROWS):
+    """
+    COPY df into `target` in batches of batch_size. batches are serialized on this thread
+    while a consumer thread copies the previous ones, holding at most COPY_QUEUE_BYTES of
+    serialized batches (see copy_pipeline). after_batch(batch_number, rows), if given,
+    runs on the consumer thread after every batch.
+    """
+    num_chunks = (len(df) + batch_size - 1) // batch_size
+    column_list = ', '.join([f'"{col}"' for col in df.columns])
+    copy_options = "FORMAT binary" if copy_format == "binary" else "FORMAT csv, HEADER true"
+
+    def serialized_batches():
+        # producer: runs on this thread while the previous batch is still being copied
+        for i in range(num_chunks):
+            chunk = df.slice(i * batch_size, batch_size)
+            # serialized from the arrow buffers into memory: no temp files, no per-row python objects
+            with run_metrics.stage(table_name, "serialize", rows_in=chunk.height) as stage:
+                if copy_format == "binary":
+                    buffer = dataframe_to_binary_buffer(chunk, binary_kinds)
+                else:
+                    buffer = dataframe_to_csv_buffer(chunk)
+                stage["bytes"] = buffer.getbuffer().nbytes
+            yield (i, chunk.height, buffer), buffer.getbuffer().nbytes
+
+    def copy_batch(batch):
+        # consumer: the only user of the connection until the pipeline is drained
+        i, rows, buffer = batch
+        logger.info(f"Processing batch {i + 1}/{num_chunks}")
+        with run_metrics.stage(table_name, "copy", rows_in=rows) as stage:
+            cursor.copy_expert(f'''
+                COPY {target} ({column_list}) FROM STDIN WITH ({copy_options});
+            ''', buffer)
+            stage["rows_out"] = rows
+            stage["bytes"] = buffer.getbuffer().nbytes
+        run_metrics.increment("copy.bytes", buffer.getbuffer().nbytes)
+        if after_batch is not None:
+            after_batch(i, rows)
+
+    pipelined_copy(serialized_batches(), copy_batch)
+
+
+def insert_dataframe_to_db(df: pl.DataFrame, table_name: str, geometry_column: str = None, srid: int = GEOMETRY_SRID,
+                           copy_format: str = None, load_mode: str = None, checkpoint: dict = None,
+                           explain: list = None) -> dict:
+    """
+    load df into DBSCHEMA.table_name.
+
+    copy_format is "csv" (text COPY) or "binary" (PGCOPY built from the frame's typed
+    columns), defaulting to COPY_FORMAT. load_mode (default LOAD_MODE) is "merge": the
+    whole frame is copied into one unlogged staging table and upserted with a single
+    statement, or "batch": every 10k rows are copied, upserted and committed on their own.
+    either way serialization and COPY overlap (see copy_dataframe). in merge mode a frame
+    of several COPY_SHARD_ROWS is split by key hash and copied over that many pooled
+    connections at once, into one staging table each, then merged in one statement
+    (see sharded_copy).
+
+    a table LIST-partitioned by ProjectKey (see partitions.py) is not merged when df
+    holds a single project and PARTITION_SWAP is on: the project's partition is rebuilt
+    from df with a plain csv COPY and swapped in, replacing the project's rows.
+
+    with BULK_LOAD, an empty plain table is loaded with a csv COPY straight into it: its
+    keys, indexes and foreign keys are dropped for the COPY and rebuilt from the loaded
+    rows before the commit, the foreign keys NOT VALID and validated after (bulk_load.py).
+
+    geometry_column (hex EWKB or WKT, see create_postgis_geometry) gets `srid` set on its
+    way into a geometry column, on every path: ST_SetSRID in the merge, an "SRID=n;"
+    prefix (with_srid) in the bulk and swap COPYs.
+
+    with ROW_HASHES, key/row hashes are stored with every row and only rows whose hashes
+    aren't in the table yet (for the frame's ProjectKeys) are sent.
+
+    a load that loses its database connection, or hits a deadlock or serialization failure,
+    is retried up to LOAD_RETRIES times with growing waits in between (checkpoint.is_retryable). given a checkpoint ({"run_id", "project_key", "source",
+    "source_file"}, see checkpoint.py), batch mode journals the source rows every
+    committed batch covers in the batch's transaction, and a retried or resumed load of
+    the same input continues after the last of them.
+
+    given an explain list, the EXPLAIN (ANALYZE, BUFFERS) of the first merge statement is
+    appended to it (used by the profile command).
+
+    returns {"rows_affected", "inserted", "updated", "unchanged"} once everything is
+    committed, or None if the load failed (the error is logged)
+    """
+    copy_format = copy_format or COPY_FORMAT
+    load_mode = load_mode or LOAD_MODE
+    logger.info(f"Starting insertion of DataFrame into table '{table_name}' ({load_mode} mode, {copy_format} COPY).")
     logger.info("Ensuring table, index, and constraints exist.")
 
-    create_table_if_not_exists(table_name)
-    logger.info(f"Checked or created table '{table_name}'.")
-
-    create_index_if_not_exist(table_name)
-    logger.info(f"Checked or created index for table '{table_name}'.")
+    for attempt in range(LOAD_RETRIES + 1):
+        try:
+            # compared with pg_catalog once per run, DDL only for what actually differs
+            # (again after a failed bulk load that could not put its foreign keys back)
+            with run_metrics.stage(table_name, "ddl"):
+                reconcile_table(table_name)
+            return _load_dataframe(df, table_name, geometry_column, srid, copy_format, load_mode, checkpoint, explain)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if not is_retryable(e):
+                # disk full, out of memory, statement cancelled...: retrying won't help
+                logger.error(f"Error inserting DataFrame into DB using COPY: {e}")
+                return None
+            # lost connection, server restart, deadlock...: get_connection has rolled back or
+            # discarded the connection, the next attempt borrows a healthy one
+            if attempt == LOAD_RETRIES:
+                logger.error(f"Error inserting DataFrame into DB using COPY, giving up after {attempt + 1} attempts: {e}")
+                return None
+            logger.warning(f"Loading '{table_name}' failed on the database connection: {e}")
+            run_metrics.increment("load.retries")
+            delay = backoff(attempt)
+            logger.info(f"Retrying '{table_name}' after {delay:.1f}s (attempt {attempt + 2} of {LOAD_RETRIES + 1}).")
+        except Exception as e:
+            # get_connection rolls back whatever was not committed before returning the connection
+            logger.warning("Transaction rolled back due to error.")
+            logger.error(f"Error inserting DataFrame into DB using COPY: {e}")
+            return None
 
-    create_unique_constraint_if_not_exist(table_name)
-    logger.info(f"Checked or created unique constraint for table '{table_name}'.")
 
-    conn = None
-    csv_file_path = None
+def _load_dataframe(df: pl.DataFrame, table_name: str, geometry_column: str, srid: int, copy_format: str,
+                    load_mode: str, checkpoint: dict, explain: list) -> dict:
+    # one attempt at insert_dataframe_to_db, raises on failure
+    inserted = 0
+    updated = 0
+    total_rows = len(df)
 
-    try:
-        logger.info("Connecting to the database.")
-        conn = psycopg2.connect(**DATABASE_CONFIG)
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         logger.info(f"Fetching column names for table '{table_name}'.")
-        cursor.execute(f"""
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_schema = '{DBSCHEMA}' AND table_name = '{table_name}' AND column_name <> 'rid'
-        """)
-        columns = [row[0] for row in cursor.fetchall()]
+        column_types = fetch_table_columns(cursor, table_name)
+        columns = list(column_types)
         logger.info(f"Columns found: {columns}")
 
-        temp_table_name = f'"{table_name}_temp"'
-        logger.info(f"Creating temporary table '{temp_table_name}'.")
-        cursor.execute(f"""
-            CREATE TEMP TABLE {temp_table_name} AS
-            SELECT {', '.join([f'"{i}"' for i in columns])} FROM "{DBSCHEMA}"."{table_name}" LIMIT 0
-        """)
-        logger.info(f"Temporary table '{temp_table_name}' created.")
-
-        batch_files = []  # Keep track of created batch file paths
-
-        try:
-            logger.info("Writing DataFrame to CSV in batches.")
-
-            batch_size = 10000  # adjust as needed
-            num_chunks = (len(df) + batch_size - 1) // batch_size
-
-            for i in range(num_chunks):
-                chunk = pl.DataFrame(df[i * batch_size:(i + 1) * batch_size])
-
-                logger.info(f"Processing batch {i + 1}/{num_chunks}, DataFrame type: {type(chunk)}")
-
-                # Align chunk columns with database schema
-                aligned_columns = [col for col in columns if col in chunk.columns]
-                missing_columns = [col for col in columns if col not in chunk.columns]
-
-                logger.debug(f"Aligned columns: {aligned_columns}")
-                logger.debug(f"Missing columns: {missing_columns}")
-
-                for missing_col in missing_columns:
-                    chunk = chunk.with_columns(pl.lit(None).alias(missing_col)) 
-
-                logger.debug(f"Type of chunk after adding missing columns: {type(chunk)}")
-                logger.debug(f"Chunk schema after alignment: {chunk.schema}")
-
-                chunk = chunk.select(aligned_columns)
-                # Write the chunk to CSV
-                with NamedTemporaryFile(delete=False, mode='w', suffix=f'_batch_{i}.csv') as tmp_file:
-                    batch_csv_file_path = tmp_file.name
-                    batch_files.append(batch_csv_file_path)
-
-                with open(batch_csv_file_path, 'w', newline='', encoding='utf-8') as f:
-                    writer = DictWriter(f, fieldnames=aligned_columns)  # database schema ordering
-                    writer.writeheader()
-                    writer.writerows(chunk.to_dicts())
-                logger.info(f"Batch file '{batch_csv_file_path}' created and aligned.")
-
-            # Perform the COPY operation and insert each batch directly into the main table
-            for batch_csv_file_path in batch_files:
-                with open(batch_csv_file_path, 'r', encoding='utf-8') as f:
-                    logger.info(f"Loading batch file '{batch_csv_file_path}' into temporary table.")
-                    cursor.copy_expert(f'''
-                        COPY {temp_table_name} ({', '.join([f'"{col}"' for col in aligned_columns])}) FROM STDIN WITH (FORMAT csv, HEADER true);
-                    ''', f)
-
-                logger.info(f"Inserting batch from temp table into target table '{table_name}'.")
-                cursor.execute(f'''
-                    INSERT INTO "{DBSCHEMA}"."{table_name}" ({', '.join([f'"{col}"' for col in aligned_columns])})
-                    SELECT {', '.join([f'"{col}"' for col in aligned_columns])} FROM {temp_table_name}
-                    ON CONFLICT ({', '.join([f'"{i}"' for i in unique_fields_per_table(table_name)])}) DO UPDATE
-                    SET {', '.join([f'"{col}" = EXCLUDED."{col}"' for col in aligned_columns if col not in unique_fields_per_table(table_name)])}
-                    RETURNING *;  -- Returns rows that were inserted or updated
-                ''')
-
-                # Log the number of rows affected
-                affected_rows = cursor.rowcount
-                logger.info(f"{affected_rows} rows were inserted or updated in '{table_name}'.")
+        partitioning = table_partitioning(cursor, table_name)
+        # only a frame of exactly one non-null partition value owns its partition: the null
+        # partition is shared by every file without a ProjectKey, those rows are merged
+        swap_value = None
+        swap = (PARTITION_SWAP and partitioning is not None and partitioning[0] == "list" and total_rows > 0
+                and partitioning[1] in df.columns and df.get_column(partitioning[1]).null_count() == 0
+                and df.get_column(partitioning[1]).n_unique() == 1)
+        if swap:
+            swap_value = df.get_column(partitioning[1])[0]
+        # locked and checked again right before the load, see below
+        bulk = BULK_LOAD and partitioning is None and total_rows > 0 and is_empty(cursor, table_name)
+
+        journaled = checkpoint is not None and load_mode == "batch" and not (swap or bulk)
+        resumed = {"rows": 0, "inserted": 0, "updated": 0}
+        if journaled:
+            # batch boundaries are recorded as source row numbers, which survive the filters below
+            df = df.with_row_index(ROW_ORDINAL)
+            resumed = resume_point(cursor, table_name, checkpoint, total_rows)
+            if resumed["rows"]:
+                df = df.filter(pl.col(ROW_ORDINAL) >= resumed["rows"])
+                logger.info(f"Resuming '{table_name}' after the {resumed['rows']} of {total_rows} rows committed earlier.")
+
+        if ROW_HASHES:
+            with run_metrics.stage(table_name, "hash_diff", rows_in=len(df)) as stage:
+                df = add_row_hashes(df, unique_fields_per_table(table_name), MERGE_IGNORED_COLUMNS + (ROW_ORDINAL,))
+                if not (swap or bulk):
+                    # a swapped partition is rebuilt from every row, unchanged ones included
+                    df, skipped = split_by_hash(df, fetch_existing_hashes(cursor, table_name, df))
+                    logger.info(f"{skipped} rows of '{table_name}' match their stored row hash, sending {len(df)} new or changed rows.")
+                stage["rows_out"] = len(df)
+        elif ROW_HASH_COLUMN in column_types:
+            # stored hashes are only trusted while every write keeps them current
+            df = df.with_columns([pl.lit(None, pl.Int64).alias(col) for col in HASH_COLUMN_TYPES])
+
+        ordinals = df.get_column(ROW_ORDINAL) if journaled else None
+
+        # Align the DataFrame with the database schema once; batches are zero-copy slices of it
+        aligned_columns = [col for col in columns if col in df.columns]
+        missing_columns = [col for col in columns if col not in df.columns]
+        logger.debug(f"Aligned columns: {aligned_columns}")
+        logger.debug(f"Missing columns: {missing_columns}")
+        df = df.select(aligned_columns)
+        geometry_typed = (geometry_column in aligned_columns
+                          and column_types[geometry_column].lower().startswith("geometry"))
+
+        if swap:
+            # the new partition has the target's column types, which only text COPY converts into
+            logger.info(f"Rebuilding the {partitioning[1]} = {swap_value!r} partition of '{table_name}' from {len(df)} rows.")
+            with run_metrics.stage(table_name, "swap", rows_in=len(df)) as stage:
+                swap_df = with_srid(df, geometry_column, srid) if geometry_typed else df
+                replaced = swap_partition(cursor, table_name, swap_value, partitioning[1],
+                                          lambda target: copy_dataframe(cursor, swap_df, table_name, target, "csv"))
+                stage.update(inserted=len(df), replaced=replaced)
+            conn.commit()
+            cursor.close()
+            logger.info(f"Data insertion into '{table_name}' completed successfully: "
+                        f"partition swapped, {len(df)} rows loaded, {replaced} replaced.")
+            return {"rows_affected": len(df), "inserted": len(df), "updated": 0, "unchanged": 0}
+
+        if bulk:
+            definitions = deferrable_definitions(cursor, table_name)
+            # foreign keys lock dataHeader as well: they are dropped and put back in short
+            # transactions of their own instead of being held through the COPY and index builds
+            drop_foreign_keys(cursor, table_name, definitions)
+            conn.commit()
+            try:
+                # nobody may write in between the check and the commit
+                cursor.execute(f'LOCK TABLE {DBSCHEMA}."{table_name}" IN ACCESS EXCLUSIVE MODE')
+                bulk = is_empty(cursor, table_name)
+                if bulk:
+                    # copied into the table's own column types, which only text COPY converts into
+                    logger.info(f"'{table_name}' is empty, bulk loading {len(df)} rows with its keys and indexes deferred.")
+                    drop_deferred(cursor, table_name, definitions)
+                    bulk_df = with_srid(df, geometry_column, srid) if geometry_typed else df
+                    copy_dataframe(cursor, bulk_df, table_name, f'"{DBSCHEMA}"."{table_name}"', "csv")
+                    with run_metrics.stage(table_name, "index", rows_in=len(df)):
+                        rebuild_deferred(cursor, table_name, definitions)
+                    conn.commit()
+            except Exception:
+                restore_after_failure(conn, table_name, definitions)
+                raise
+            if not bulk:
+                # someone wrote first: merged as usual, with the foreign keys back
+                logger.info(f"'{table_name}' is no longer empty, merging instead of bulk loading.")
+                conn.rollback()
+                restore_foreign_keys(conn, table_name, definitions)
+            else:
+                with run_metrics.stage(table_name, "validate", rows_in=len(df)):
+                    invalid = restore_foreign_keys(conn, table_name, definitions)
+                with run_metrics.stage(table_name, "analyze", rows_in=len(df)):
+                    cursor.execute(f'ANALYZE {DBSCHEMA}."{table_name}"')
+                    conn.commit()
+                cursor.close()
+                if invalid:
+                    # the rows are committed, but the load isn't done: it stays out of the manifest
+                    raise RuntimeError(f"{len(df)} rows were bulk loaded into '{table_name}', but some fail "
+                                       f"{', '.join(invalid)}, which stays NOT VALID until they are fixed or removed")
+                logger.info(f"Data insertion into '{table_name}' completed successfully: bulk loaded, {len(df)} inserted.")
+                return {"rows_affected": len(df), "inserted": len(df), "updated": 0, "unchanged": 0}
+
+        if partitioning is not None:
+            ensure_partitions(cursor, table_name, df, partitioning)
+
+        # session-private and never WAL-logged: concurrent loads of one table don't share it, and a crash leaves nothing behind
+        staging_table = f'"{table_name}_temp"'
+        binary_kinds = None
+        if copy_format == "binary":
+            # binary COPY must match the column types exactly: stage the typed values as
+            # float8/int8/date/text and cast them to the target types in the merge
+            binary_kinds = binary_column_kinds(df.schema, {**get_schemaplan().pg_types(table_name), **HASH_COLUMN_TYPES})
+            staging_columns = ', '.join([f'"{col}" {pg_type}' for col, pg_type in staging_types(binary_kinds).items()])
+            staging_definition = f"({staging_columns})"
+            select_exprs = {col: f'"{col}"::{column_types[col]}' for col in aligned_columns}
+        else:
+            # spelled out, not read from the target: this transaction may hold locks a shard connection would wait on
+            staging_definition = f"({', '.join([f'{quote_ident(col)} {column_types[col]}' for col in aligned_columns])})"
+            select_exprs = {col: f'"{col}"' for col in aligned_columns}
+        if geometry_typed:
+            select_exprs[geometry_column] = f'ST_SetSRID({select_exprs[geometry_column]}, {int(srid)})'
+        select_list = ', '.join(select_exprs.values())
+        unique_fields = conflict_columns(unique_fields_per_table(table_name), partitioning)
+
+        # a large frame is copied over several connections at once, into one staging table each
+        shards = shard_count(cursor, len(df)) if load_mode == "merge" else 1
+        if shards > 1:
+            parts = shard_frame(df, unique_fields, shards)
+            logger.info(f"Copying {len(df)} rows of '{table_name}' in {len(parts)} shards.")
+            stagings = load_shards(
+                cursor, parts, table_name,
+                lambda shard_cursor, staging: shard_cursor.execute(f"CREATE UNLOGGED TABLE {staging} {staging_definition}"),
+                lambda shard_cursor, part, staging: copy_dataframe(shard_cursor, part, table_name, staging, copy_format, binary_kinds))
+            merge_query = build_merge_query(table_name, union_source(stagings), aligned_columns, select_list,
+                                            unique_fields, partitioned=partitioning is not None)
+            logger.info(f"Merging {len(df)} rows from {len(stagings)} staging tables into target table '{table_name}'.")
+            try:
+                with run_metrics.stage(table_name, "merge", rows_in=len(df)) as stage:
+                    inserted, updated = run_merge(cursor, merge_query, explain)
+                    stage.update(inserted=inserted, updated=updated)
+                for staging in stagings:
+                    cursor.execute(f"DROP TABLE {staging}")
+                conn.commit()
+            except Exception:
+                # the shards were committed on their own connections, they don't go with the rollback
+                conn.rollback()
+                drop_shards(stagings)
+                raise
+        else:
+            logger.info(f"Creating staging table {staging_table}.")
+            # pooled sessions outlive this call, so a temp table from an earlier load may still be there
+            cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+            cursor.execute(f"CREATE TEMP TABLE {staging_table} {staging_definition}")
+            merge_query = build_merge_query(table_name, staging_table, aligned_columns, select_list,
+                                            unique_fields, partitioned=partitioning is not None)
+
+            batch_counts = {"inserted": resumed["inserted"], "updated": resumed["updated"], "next_row": resumed["rows"]}
+
+            def merge_batch(i, rows):
+                logger.info(f"Merging batch from {staging_table} into target table '{table_name}'.")
+                with run_metrics.stage(table_name, "merge", rows_in=rows) as stage:
+                    batch_inserted, batch_updated = run_merge(cursor, merge_query, explain)
+                    stage.update(inserted=batch_inserted, updated=batch_updated)
+                batch_counts["inserted"] += batch_inserted
+                batch_counts["updated"] += batch_updated
+                logger.info(f"{batch_inserted} rows inserted, {batch_updated} updated in '{table_name}'.")
+                if journaled:
+                    # every source row up to this batch's last one is done, including rows the hash diff left out
+                    batch_end = ordinals[i * COPY_BATCH_ROWS + rows - 1] + 1
+                    record_batch(cursor, checkpoint, table_name, batch_counts["next_row"], batch_end, total_rows,
+                                 batch_inserted, batch_updated)
+                    batch_counts["next_row"] = batch_end
 
                 conn.commit()
-                logger.info(f"Batch from file '{batch_csv_file_path}' committed successfully.")
+                logger.info(f"Batch {i + 1} committed successfully.")
 
                 # Clear the temp table for the next batch
-                cursor.execute(f"TRUNCATE TABLE {temp_table_name}")
-                logger.info(f"Temporary table '{temp_table_name}' cleared.")
+                cursor.execute(f"TRUNCATE TABLE {staging_table}")
 
-        finally:
-            # Cleanup all batch files
-            for batch_csv_file_path in batch_files:
-                if os.path.exists(batch_csv_file_path):
-                    os.remove(batch_csv_file_path)
-                    logger.info(f"Batch file '{batch_csv_file_path}' removed.")
+            logger.info("Streaming DataFrame to the database in batches.")
+            copy_dataframe(cursor, df, table_name, staging_table, copy_format, binary_kinds,
+                           after_batch=merge_batch if load_mode == "batch" else None)
+            inserted, updated = batch_counts["inserted"], batch_counts["updated"]
 
+            if load_mode == "merge":
+                logger.info(f"Merging {len(df)} staged rows into target table '{table_name}'.")
+                with run_metrics.stage(table_name, "merge", rows_in=len(df)) as stage:
+                    inserted, updated = run_merge(cursor, merge_query, explain)
+                    stage.update(inserted=inserted, updated=updated)
+
+            cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+            conn.commit()
         cursor.close()
-        logger.info(f"Data insertion into '{table_name}' completed successfully.")
 
-    except Exception as e:
-        if conn:
-            conn.rollback()
-            logger.warning("Transaction rolled back due to error.")
-        logger.error(f"Error inserting DataFrame into DB using COPY: {e}")
-    finally:
-        if conn:
-            conn.close()
-            logger.info("Database connection closed.")
-        if csv_file_path and os.path.exists(csv_file_path):
-            os.remove(csv_file_path)
-            logger.info(f"Temporary CSV file '{csv_file_path}' removed.")
+        unchanged = total_rows - inserted - updated
+        logger.info(f"Data insertion into '{table_name}' completed successfully: "
+                    f"{inserted} inserted, {updated} updated, {unchanged} unchanged.")
+        return {"rows_affected": inserted + updated, "inserted": inserted, "updated": updated, "unchanged": unchanged}
 
 
 
-def create_projecttable(columns: list[str], tablename: str):
-    conn = psycopg2.connect(**DATABASE_CONFIG)
 
+def create_projecttable(columns: list[str], tablename: str):
     # Dynamically create the table if it doesn't exist
     create_table_query = sql.SQL("""
         CREATE TABLE IF NOT EXISTS {db_schema}.{table} (
@@ -279,25 +480,19 @@ def create_projecttable(columns: list[str], tablename: str):
         )
 
     try:
-        cursor = conn.cursor()
-        cursor.execute(create_table_query)
-        conn.commit()
-        cursor.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(create_table_query)
+            conn.commit()
+            cursor.close()
 
     except Exception as e:
-        if conn:
-            conn.rollback()
-
         logger.info(f"db_connector::create_project:: Error creating table {tablename}: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 def insert_project(values: list[str], columns: list[str], tablename: str):
     # create if not exist
     create_projecttable(columns, tablename)
 
-    conn = psycopg2.connect(**DATABASE_CONFIG)
     # Insert data into the table
     insert_query = sql.SQL("""
     INSERT INTO {db_schema}.{table} ({columns})
@@ -314,91 +509,68 @@ def insert_project(values: list[str], columns: list[str], tablename: str):
     )
 
     try:
-        cursor = conn.cursor()
-        cursor.execute(insert_query, values)
-        conn.commit()
-        cursor.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(insert_query, values)
+            conn.commit()
+            cursor.close()
 
     except Exception as e:
-        if conn:
-            conn.rollback()
-
         logger.info(f"Error inserting into table {tablename}: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 def subset_and_save(table_df: pl.DataFrame, table_name: str) -> pl.DataFrame:
     logger.info(f'db_connector: Matching "PrimaryKeys" with header.. a subset of "{table_name}" will be produced in the ./noprimarykey dir if mismatches are found.')
     # if dbkey is required, add extraction here here
     # dbkey check and add for csv's with not primarykeys
     dbkey = None
-    if "DBKey" in table_df.columns:
+    if "DBKey" in table_df.columns and table_df.height != 0:
         dbkey = table_df[0].select(pl.col("DBKey").unique())[0,0]
     else:
         dbkey="nodbkey"
 
 
     try:
-        connection = psycopg2.connect(**DATABASE_CONFIG)
-        # Query the "dataHeader" table and load it into a Polars DataFrame
-        query = f'SELECT "PrimaryKey" FROM {DBSCHEMA}."dataHeader";'
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            # Fetch all results into a DataFrame
-            data = cursor.fetchall()
-            dataHeader_df = pl.DataFrame(data, orient="row", schema=["PrimaryKey"])
-
-        # Extract the unique PrimaryKey values from the dataHeader DataFrame
-        primary_keys = dataHeader_df.select(pl.col("PrimaryKey"))
-
-        # Filter tblRHEM_df where PrimaryKey exists in the primary_keys list
-        matching_df = table_df.join(primary_keys, on="PrimaryKey", how="inner")
-
-        # Filter tblRHEM_df where PrimaryKey does not exist in the primary_keys list
+        # the committed dataHeader keys, read once per run with COPY TO
+        primary_keys = header_keys()
+
+        # rows whose PrimaryKey exists in dataHeader
+        matching_df = table_df.join(primary_keys, on="PrimaryKey", how="semi", maintain_order="left")
+
+        # rows the foreign key would reject, and rows with a null PrimaryKey: the foreign key
+        # would take those, but they belong to no plot, so they are diverted too (by choice)
         non_matching_df = table_df.join(primary_keys, on="PrimaryKey", how="anti")
 
-        # Save the non-matching part to a CSV file
-        non_matching_csv_file = os.path.join(NOPRIMARYKEYPATH,f"no_primarykeys_{dbkey}_{table_name}.csv")
-        if non_matching_df.shape[0] != 0:
-            non_matching_df.write_csv(non_matching_csv_file)
+        # Save the non-matching part so it can be fixed and reloaded
+        if non_matching_df.height != 0:
+            os.makedirs(NOPRIMARYKEYPATH, exist_ok=True)
+            non_matching_file = os.path.join(NOPRIMARYKEYPATH, f"no_primarykeys_{dbkey}_{table_name}.parquet")
+            non_matching_df.write_parquet(non_matching_file)
+            logger.warning(f'db_connector::subset_pk:: {non_matching_df.height} rows of "{table_name}" have no PrimaryKey in dataHeader '
+                           f'({non_matching_df.get_column("PrimaryKey").null_count()} of them a null one), saved to {non_matching_file}')
 
         # Return the matching subset for ingestion
         return matching_df
     except Exception as e:
+        # without the key set the foreign key in postgres is still the backstop
         logger.info(f"db_connector::subset_pk:: error: {e}")
-    finally:
-        connection.close()
+        return table_df
 
 def populate_datevisited(table_df: pl.DataFrame, table_name: str) -> pl.DataFrame:
     logger.info(f'populate_datevisited: Matching "DateVisited" on {table_name} to dataHeader...')
 
     try:
-        logger.info("populate_datevisited: Establishing database connection.")
-        connection = psycopg2.connect(**DATABASE_CONFIG)
-        logger.info("populate_datevisited: Database connection established.")
-        primary_keys = table_df["PrimaryKey"].to_list()
-        logger.info(f"populate_datevisited: Retrieved {len(primary_keys)} primary keys from table {table_name}.")
-
-        # Use a single query to fetch all relevant data, avoiding batch processing
-        placeholders = ', '.join(['%s'] * len(primary_keys))  # Prepare placeholders for the IN clause
-        query = f'SELECT "PrimaryKey", "DateVisited" FROM {DBSCHEMA}."dataHeader" WHERE "PrimaryKey" IN ({placeholders});'
-        logger.debug(f"populate_datevisited: Executing query: {query}")
-
-        with connection.cursor() as cursor:
-            cursor.execute(query, primary_keys)
-            data = cursor.fetchall()
-            logger.info(f"populate_datevisited: Fetched {len(data)} records from dataHeader.")
-
-            if data:  # Only process if data was returned
-                dataHeader_combined_df = pl.DataFrame(data, schema=["PrimaryKey", "DateVisited"])
-            else:
-                logger.warning("populate_datevisited: No matching primary keys found in dataHeader.")
-                return table_df  # No matches found, return the original DataFrame
+        # run-scoped lookup: seeded from this run's dataHeader frame or a single COPY of the table
+        dataHeader_combined_df = datevisited_for(table_df["PrimaryKey"])
+        logger.info(f"populate_datevisited: {dataHeader_combined_df.height} matching keys found in the dataHeader lookup.")
+
+        if dataHeader_combined_df.height == 0:
+            logger.warning("populate_datevisited: No matching primary keys found in dataHeader.")
+            return table_df  # No matches found, return the original DataFrame
 
         # Perform the join with the combined dataHeader DataFrame
         logger.info("populate_datevisited: Performing join with the combined dataHeader DataFrame.")
-        merged_df = table_df.join(dataHeader_combined_df, on="PrimaryKey", how="left")
+        # row order is kept: journaled batch boundaries (checkpoint.py) are row numbers of this frame
+        merged_df = table_df.join(dataHeader_combined_df, on="PrimaryKey", how="left", suffix="_right", maintain_order="left")
 
         # Handle updating or renaming the "DateVisited" column
         if "DateVisited" in table_df.columns:
@@ -422,7 +594,3 @@ def populate_datevisited(table_df: pl.DataFrame, table_name: str) -> pl.DataFram
     except Exception as e:
         logger.error(f"populate_datevisited: Error: {e}")
         return table_df  # Return original DataFrame on error
-
-    finally:
-        connection.close()
-        logger.info("populate_datevisited: Database connection closed.")
@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.pool
+
+from config import DATABASE_CONFIG, DB_POOL_MINCONN, DB_POOL_MAXCONN, DB_POOL_HEALTHCHECK_IDLE
+from scripts import run_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MeteredConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool that records connection setup in run_metrics and blocks
+    (instead of raising PoolError) when every connection is checked out
+    """
+
+    def __init__(self, minconn: int, maxconn: int, *args, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._borrowed = 0
+        self._borrowed_lock = threading.Lock()
+        self._last_used = {}
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def _connect(self, key=None):
+        started = time.perf_counter()
+        conn = super()._connect(key)
+        elapsed = time.perf_counter() - started
+        self._last_used[id(conn)] = time.monotonic()
+        run_metrics.increment("db.connections_opened")
+        run_metrics.increment("db.connect_seconds", elapsed)
+        logger.debug(f"db_pool:: opened connection in {elapsed:.3f}s")
+        return conn
+
+    def borrow(self):
+        self._slots.acquire()
+        try:
+            conn = self.getconn()
+            if not self._healthy(conn):
+                logger.info("db_pool:: discarding dead connection, reconnecting.")
+                run_metrics.increment("db.connections_discarded")
+                self.putconn(conn, close=True)
+                conn = self.getconn()
+            run_metrics.increment("db.connections_borrowed")
+            with self._borrowed_lock:
+                self._borrowed += 1
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def give_back(self, conn, close: bool = False):
+        try:
+            self._last_used[id(conn)] = time.monotonic()
+            self.putconn(conn, close=close or bool(conn.closed))
+        finally:
+            with self._borrowed_lock:
+                self._borrowed -= 1
+            self._slots.release()
+
+    def free_slots(self) -> int:
+        # connections that can still be borrowed without waiting for one to come back
+        with self._borrowed_lock:
+            return self.maxconn - self._borrowed
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        # only ping connections that sat idle long enough for the server/network to drop them
+        idle = time.monotonic() - self._last_used.get(id(conn), 0)
+        if idle < DB_POOL_HEALTHCHECK_IDLE:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> MeteredConnectionPool:
+    # one pool per process; a forked/spawned worker builds its own instead of sharing sockets
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = MeteredConnectionPool(DB_POOL_MINCONN, DB_POOL_MAXCONN, **DATABASE_CONFIG)
+            _pool_pid = os.getpid()
+            logger.debug(f"db_pool:: created pool (min={DB_POOL_MINCONN}, max={DB_POOL_MAXCONN}) in pid {_pool_pid}")
+        return _pool
+
+
+@contextmanager
+def get_connection():
+    """
+    borrow a pooled connection. whatever the caller left uncommitted is rolled back before
+    the connection goes back to the pool.
+    """
+    pool = get_pool()
+    conn = pool.borrow()
+    broken = False
+    try:
+        yield conn
+    except psycopg2.InterfaceError:
+        broken = True
+        raise
+    finally:
+        if not conn.closed:
+            try:
+                conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                broken = True
+        pool.give_back(conn, close=broken)
+
+
+def close_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+            logger.debug("db_pool:: closed all pooled connections.")
+        _pool = None
+        _pool_pid = None
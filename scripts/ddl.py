@@ -0,0 +1,279 @@
+import logging
+
+import psycopg2
+
+from config import DBSCHEMA, ROW_HASHES
+from scripts.db_pool import get_connection
+from scripts.schemaplan import get_schemaplan, UNIQUE_KEYS
+from scripts.row_hash import HASH_COLUMN_TYPES, KEY_HASH_COLUMN, ROW_HASH_COLUMN
+from scripts.partitions import planned_partitioning, conflict_columns, PARTITION_STRATEGIES
+from scripts import run_metrics
+
+logger = logging.getLogger(__name__)
+
+# schemaplan spellings -> what format_type() reports for them
+_TYPE_ALIASES = {
+    "int": "integer",
+    "int4": "integer",
+    "int8": "bigint",
+    "float": "double precision",
+    "float8": "double precision",
+    "varchar": "character varying",
+    "bit": "bit(1)",
+    "timestamp": "timestamp without time zone",
+}
+
+# tables already checked in this run (per process, the pool workers get the parent's set)
+_reconciled = set()
+
+
+class CatalogSnapshot:
+    """
+    tables, columns, constraints, indexes and partitioning of DBSCHEMA, read from
+    pg_catalog in four queries. constraints are (name, type, columns, referenced table),
+    indexes are (name, key columns, unique), partitioning is (strategy, column).
+    """
+
+    def __init__(self, columns: dict, constraints: dict, indexes: dict, partitioning: dict = None):
+        self.columns = columns
+        self.constraints = constraints
+        self.indexes = indexes
+        self.partitioning = partitioning or {}
+
+    @classmethod
+    def read(cls, cursor, schema: str = DBSCHEMA) -> "CatalogSnapshot":
+        cursor.execute("""
+            SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod)
+            FROM pg_catalog.pg_class c
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+            WHERE n.nspname = %s AND c.relkind IN ('r', 'p')
+            ORDER BY c.relname, a.attnum
+        """, (schema,))
+        columns = {}
+        for table, column, pg_type in cursor.fetchall():
+            columns.setdefault(table, {})[column] = pg_type
+
+        cursor.execute("""
+            SELECT c.relname, con.conname, con.contype,
+                   array(SELECT a.attname FROM unnest(con.conkey) WITH ORDINALITY k(attnum, ord)
+                         JOIN pg_catalog.pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+                         ORDER BY k.ord),
+                   ref.relname, con.convalidated
+            FROM pg_catalog.pg_constraint con
+            JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_catalog.pg_class ref ON ref.oid = con.confrelid
+            WHERE n.nspname = %s AND con.contype IN ('p', 'u', 'f')
+        """, (schema,))
+        constraints = {}
+        for table, name, contype, cols, ref_table, validated in cursor.fetchall():
+            constraints.setdefault(table, []).append((name, contype, tuple(cols), ref_table, validated))
+
+        cursor.execute("""
+            SELECT t.relname, i.relname,
+                   array(SELECT a.attname FROM unnest(ix.indkey::int2[]) WITH ORDINALITY k(attnum, ord)
+                         JOIN pg_catalog.pg_attribute a ON a.attrelid = ix.indrelid AND a.attnum = k.attnum
+                         WHERE k.ord <= ix.indnkeyatts
+                         ORDER BY k.ord),
+                   ix.indisunique
+            FROM pg_catalog.pg_index ix
+            JOIN pg_catalog.pg_class t ON t.oid = ix.indrelid
+            JOIN pg_catalog.pg_class i ON i.oid = ix.indexrelid
+            JOIN pg_catalog.pg_namespace n ON n.oid = t.relnamespace
+            WHERE n.nspname = %s
+        """, (schema,))
+        indexes = {}
+        for table, name, cols, unique in cursor.fetchall():
+            indexes.setdefault(table, []).append((name, tuple(cols), unique))
+
+        cursor.execute("""
+            SELECT c.relname, pt.partstrat, a.attname
+            FROM pg_catalog.pg_partitioned_table pt
+            JOIN pg_catalog.pg_class c ON c.oid = pt.partrelid
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_catalog.pg_attribute a ON a.attrelid = pt.partrelid AND a.attnum = pt.partattrs[0]
+            WHERE n.nspname = %s
+        """, (schema,))
+        partitioning = {table: (PARTITION_STRATEGIES.get(strategy, strategy), column) for table, strategy, column in cursor.fetchall()}
+
+        return cls(columns, constraints, indexes, partitioning)
+
+    def has_table(self, table_name: str) -> bool:
+        return table_name in self.columns
+
+    def has_unique(self, table_name: str, columns: list[str]) -> bool:
+        # ON CONFLICT only needs some unique index over exactly these columns, in any order
+        wanted = set(columns)
+        return any(unique and set(cols) == wanted for _, cols, unique in self.indexes.get(table_name, []))
+
+    def constraint(self, table_name: str, name: str):
+        return next((c for c in self.constraints.get(table_name, []) if c[0] == name), None)
+
+    def has_foreign_key(self, table_name: str, columns: list[str], ref_table: str) -> bool:
+        return any(contype == 'f' and list(cols) == columns and ref == ref_table
+                   for _, contype, cols, ref, _ in self.constraints.get(table_name, []))
+
+    def unvalidated_foreign_keys(self, table_name: str) -> list[str]:
+        # left NOT VALID by a bulk load whose rows failed them (scripts/bulk_load.py)
+        return [name for name, contype, _, _, validated in self.constraints.get(table_name, [])
+                if contype == 'f' and not validated]
+
+    def has_index(self, table_name: str, columns: list[str]) -> bool:
+        return any(list(cols) == columns for _, cols, _ in self.indexes.get(table_name, []))
+
+
+def expected_columns(table_name: str) -> dict[str, str]:
+    columns = get_schemaplan().pg_types(table_name)
+    if ROW_HASHES:
+        columns.update(HASH_COLUMN_TYPES)
+    return columns
+
+
+def _same_type(expected: str, actual: str) -> bool:
+    expected = expected.lower()
+    return actual == _TYPE_ALIASES.get(expected, expected) or actual.startswith(f"{expected}(")
+
+
+def plan_table(table_name: str, catalog: CatalogSnapshot) -> list[str]:
+    """
+    the DDL that brings DBSCHEMA.table_name in line with the schemaplan and the key
+    registry, given what the catalog already holds. empty when nothing differs.
+    """
+    table = f'{DBSCHEMA}."{table_name}"'
+    columns = expected_columns(table_name)
+    unique_keys = UNIQUE_KEYS.get(table_name)
+    is_header = table_name.lower() == "dataheader"
+    statements = []
+
+    if not catalog.has_table(table_name):
+        partitioning = planned_partitioning(table_name)
+        if partitioning:
+            # a primary key would have to include the partition column and make it NOT NULL
+            definitions = ["rid SERIAL NOT NULL"] + [f'"{col}" {pg_type}' for col, pg_type in columns.items()]
+            definitions.append(f'UNIQUE (rid, "{partitioning[1]}")')
+        else:
+            definitions = ["rid SERIAL PRIMARY KEY"] + [f'"{col}" {pg_type}' for col, pg_type in columns.items()]
+        if is_header:
+            definitions.append('UNIQUE ("PrimaryKey")')
+        else:
+            definitions.append(f'FOREIGN KEY ("PrimaryKey") REFERENCES {DBSCHEMA}."dataHeader"("PrimaryKey")')
+        if unique_keys and not (is_header and unique_keys == ["PrimaryKey"]):
+            quoted_keys = ', '.join([f'"{col}"' for col in conflict_columns(unique_keys, partitioning)])
+            definitions.append(f'CONSTRAINT "unique_{table_name}" UNIQUE ({quoted_keys})')
+        create = f"CREATE TABLE {table} ({', '.join(definitions)})"
+        if partitioning:
+            create += f' PARTITION BY {partitioning[0].upper()} ("{partitioning[1]}")'
+        statements.append(create)
+    else:
+        partitioning = catalog.partitioning.get(table_name)
+        if planned_partitioning(table_name) and not partitioning:
+            # converting means rewriting the whole table: reported, never done automatically
+            logger.warning(f"ddl:: {table_name} exists as a plain table, PARTITION_BY only applies to new tables.")
+        if unique_keys:
+            unique_keys = conflict_columns(unique_keys, partitioning)
+        existing = catalog.columns[table_name]
+        missing = [col for col in columns if col not in existing]
+        if missing:
+            statements.append(f"ALTER TABLE {table} " + ', '.join([f'ADD COLUMN "{col}" {columns[col]}' for col in missing]))
+        for col, pg_type in columns.items():
+            if col in existing and not _same_type(pg_type, existing[col]):
+                # changing a column type rewrites the table: reported, never done automatically
+                logger.warning(f'ddl:: {table_name}."{col}" is {existing[col]} in the database but {pg_type} in the schemaplan.')
+
+        if unique_keys and not catalog.has_unique(table_name, unique_keys):
+            quoted_keys = ', '.join([f'"{col}"' for col in unique_keys])
+            add = f'ADD CONSTRAINT "unique_{table_name}" UNIQUE ({quoted_keys})'
+            if catalog.constraint(table_name, f"unique_{table_name}"):
+                # the registry changed the key: the old constraint is dropped in the same statement
+                add = f'DROP CONSTRAINT "unique_{table_name}", {add}'
+            statements.append(f"ALTER TABLE {table} {add}")
+
+        if not is_header and not catalog.has_foreign_key(table_name, ["PrimaryKey"], "dataHeader"):
+            statements.append(f'ALTER TABLE {table} ADD FOREIGN KEY ("PrimaryKey") REFERENCES {DBSCHEMA}."dataHeader"("PrimaryKey")')
+
+    if ROW_HASHES and "ProjectKey" in columns and not (
+            catalog.has_table(table_name) and catalog.has_index(table_name, ["ProjectKey"])):
+        # the per-project hash read (scripts/row_hash.py) becomes an index only scan
+        statements.append(f'CREATE INDEX IF NOT EXISTS "{table_name}_projectkey_hash_idx" ON {table} '
+                          f'("ProjectKey") INCLUDE ("{KEY_HASH_COLUMN}", "{ROW_HASH_COLUMN}")')
+    return statements
+
+
+def reconcile_tables(table_names: list[str]) -> dict[str, list[str]]:
+    """
+    read the catalog once and apply plan_table to every table (dataHeader first, the
+    others reference it). returns the statements run per table; a table whose DDL failed
+    is logged and left out, so the next insert into it tries again.
+    """
+    table_names = sorted(set(table_names), key=lambda name: name != "dataHeader")
+    applied = {}
+    with get_connection() as conn, conn.cursor() as cursor:
+        catalog = CatalogSnapshot.read(cursor)
+        for table_name in table_names:
+            if not get_schemaplan().has_table(table_name):
+                logger.warning(f"ddl:: '{table_name}' is not in the schemaplan, no DDL generated.")
+                continue
+            statements = plan_table(table_name, catalog)
+            try:
+                for statement in statements:
+                    logger.info(f"ddl:: {table_name}: {statement}")
+                    cursor.execute(statement)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"ddl:: could not reconcile '{table_name}': {e}")
+                continue
+            run_metrics.increment("ddl.statements", len(statements))
+            applied[table_name] = statements
+            _reconciled.add(table_name)
+            validate_foreign_keys(conn, table_name, catalog.unvalidated_foreign_keys(table_name))
+
+    changed = {table: statements for table, statements in applied.items() if statements}
+    logger.info(f"ddl:: {len(applied)} tables checked against the catalog, "
+                f"{sum(len(s) for s in changed.values())} statements issued"
+                + (f" ({', '.join(changed)})." if changed else "."))
+    return applied
+
+
+def validate_foreign_keys(conn, table_name: str, names: list[str]) -> list[str]:
+    """
+    VALIDATE NOT VALID foreign keys, one committed statement each. this only takes a SHARE
+    UPDATE EXCLUSIVE lock, the table stays readable and writable meanwhile. returns the
+    constraints left NOT VALID because some rows fail them (logged).
+    """
+    invalid = []
+    for name in names:
+        try:
+            with conn.cursor() as cursor:
+                logger.info(f'ddl:: {table_name}: VALIDATE CONSTRAINT "{name}"')
+                cursor.execute(f'ALTER TABLE {DBSCHEMA}."{table_name}" VALIDATE CONSTRAINT "{name}"')
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            invalid.append(name)
+            logger.warning(f'ddl:: {table_name}: "{name}" stays NOT VALID, fix or remove the rows that fail it: {e}')
+    return invalid
+
+
+def reconcile_table(table_name: str):
+    # no-op for a table already checked in this run
+    if table_name not in _reconciled:
+        reconcile_tables([table_name])
+
+
+def reconciled_tables() -> set:
+    return set(_reconciled)
+
+
+def mark_reconciled(table_names):
+    _reconciled.update(table_names)
+
+
+def unmark_reconciled(table_name: str):
+    # compare the table against the catalog again before its next load
+    _reconciled.discard(table_name)
+
+
+def reset_reconciled():
+    _reconciled.clear()
@@ -0,0 +1,48 @@
+import logging
+
+import numpy as np
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+# little endian EWKB point with an SRID: byte order, geometry type | SRID flag, srid, x, y
+_EWKB_POINT_SRID = 0x20000001
+_EWKB_POINT_SIZE = 1 + 4 + 4 + 8 + 8
+_HEX_DIGITS = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+
+
+def valid_lonlat(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    # finite and inside the geographic range; nulls arrive here as NaN
+    return np.isfinite(lon) & np.isfinite(lat) & (np.abs(lon) <= 180) & (np.abs(lat) <= 90)
+
+
+def encode_points_hex(lon: pl.Series, lat: pl.Series, srid: int, name: str = "wkb_geometry") -> pl.Series:
+    """
+    hex EWKB points (the text form postgis reads straight into geometry) for every
+    lon/lat pair. the bytes of all rows are packed into one (n, 25) array and hex
+    encoded with a lookup table, no per-row python. rows with a null, non-finite or out of
+    range coordinate get a null geometry.
+    """
+    x = lon.cast(pl.Float64, strict=False).fill_null(np.nan).to_numpy()
+    y = lat.cast(pl.Float64, strict=False).fill_null(np.nan).to_numpy()
+    n_rows = len(x)
+
+    packed = np.empty((n_rows, _EWKB_POINT_SIZE), dtype=np.uint8)
+    packed[:, 0] = 1
+    packed[:, 1:5] = np.frombuffer(np.array(_EWKB_POINT_SRID, dtype="<u4").tobytes(), dtype=np.uint8)
+    packed[:, 5:9] = np.frombuffer(np.array(srid, dtype="<u4").tobytes(), dtype=np.uint8)
+    packed[:, 9:17] = x.astype("<f8").view(np.uint8).reshape(-1, 8)
+    packed[:, 17:25] = y.astype("<f8").view(np.uint8).reshape(-1, 8)
+
+    hexed = np.empty((n_rows, _EWKB_POINT_SIZE * 2), dtype=np.uint8)
+    hexed[:, 0::2] = _HEX_DIGITS[packed >> 4]
+    hexed[:, 1::2] = _HEX_DIGITS[packed & 0x0F]
+
+    encoded = pl.Series(name, hexed.view(f"S{_EWKB_POINT_SIZE * 2}").ravel(), dtype=pl.Binary).cast(pl.Utf8)
+    valid = valid_lonlat(x, y)
+    invalid = int(n_rows - valid.sum())
+    if invalid:
+        present = lon.is_not_null() & lat.is_not_null()
+        logger.warning(f"ewkb:: {invalid} of {n_rows} points have no valid coordinates "
+                       f"({int(present.sum()) - int(valid.sum())} out of range or not finite), geometry left null.")
+    return encoded.set(pl.Series(~valid), None)
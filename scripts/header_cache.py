@@ -0,0 +1,126 @@
+import io
+import logging
+
+import polars as pl
+
+from config import DBSCHEMA
+from scripts.db_pool import get_connection
+from scripts import run_metrics
+
+logger = logging.getLogger(__name__)
+
+# run-scoped PrimaryKey -> DateVisited lookup for dataHeader, shared by every table.
+# DateVisited is kept as text (as read from the csv / cast by postgres) so it round-trips
+# into the child tables exactly like the dataHeader value did.
+_LOOKUP_SCHEMA = {"PrimaryKey": pl.Utf8, "DateVisited": pl.Utf8}
+_lookup = None
+# True when _lookup holds the whole dataHeader table, so a key missing from it doesn't exist
+_complete = False
+# every PrimaryKey committed in dataHeader, used to drop orphan rows before they reach the foreign key
+_keys = None
+
+
+def set_header_lookup(header_df: pl.DataFrame, complete: bool = False):
+    """
+    seed the lookup from the dataHeader frame that was just processed in this run. a
+    lookup that is still cached (watch mode keeps it between loads) is extended instead:
+    the rows were just committed, so the cached keys and completeness stay valid.
+    """
+    global _lookup, _complete, _keys
+    loaded = (
+        header_df.select([pl.col("PrimaryKey").cast(pl.Utf8), pl.col("DateVisited").cast(pl.Utf8)])
+        .filter(pl.col("PrimaryKey").is_not_null())
+        .unique(subset=["PrimaryKey"], keep="last")
+    )
+    if _lookup is None:
+        _lookup, _complete = loaded, complete
+        # the committed key set is read again once every other table needs it
+        _keys = None
+        logger.info(f"header_cache:: DateVisited lookup seeded with {_lookup.height} dataHeader keys.")
+        return
+
+    _lookup = pl.concat([_lookup.filter(~pl.col("PrimaryKey").is_in(loaded["PrimaryKey"])), loaded])
+    _complete = _complete or complete
+    if _keys is not None:
+        _keys = pl.concat([_keys, loaded.select("PrimaryKey")]).unique()
+    logger.info(f"header_cache:: DateVisited lookup extended with {loaded.height} dataHeader keys ({_lookup.height} cached).")
+
+
+def export_header_lookup():
+    # (lookup, complete, keys) to hand to worker processes, see install_header_lookup
+    return _lookup, _complete, _keys
+
+
+def install_header_lookup(lookup: pl.DataFrame, complete: bool, keys: pl.DataFrame):
+    # ProcessPoolExecutor initializer: workers start with the parent's lookup and key set
+    global _lookup, _complete, _keys
+    _lookup, _complete, _keys = lookup, complete, keys
+
+
+def clear_header_lookup():
+    global _lookup, _complete, _keys
+    _lookup, _complete, _keys = None, False, None
+
+
+def _copy_to_frame(cursor, query: str, schema: dict = _LOOKUP_SCHEMA) -> pl.DataFrame:
+    # COPY TO STDOUT straight into an arrow-backed frame, no python tuple per row
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+    run_metrics.increment("copy.bytes_out", buffer.getbuffer().nbytes)
+    buffer.seek(0)
+    return pl.read_csv(buffer, schema=schema)
+
+
+def load_header_keys():
+    """
+    read the committed dataHeader key set once. call it in the parent after dataHeader
+    is loaded so the pool workers inherit it instead of each copying it.
+    """
+    global _keys
+    if _complete and _lookup is not None:
+        _keys = _lookup.select("PrimaryKey")
+    else:
+        with get_connection() as conn, conn.cursor() as cursor:
+            _keys = _copy_to_frame(cursor, f'SELECT DISTINCT "PrimaryKey" FROM {DBSCHEMA}."dataHeader"',
+                                   schema={"PrimaryKey": pl.Utf8})
+    logger.info(f"header_cache:: {_keys.height} dataHeader keys cached for the referential prefilter.")
+
+
+def header_keys() -> pl.DataFrame:
+    if _keys is None:
+        load_header_keys()
+    return _keys
+
+
+def load_header_lookup():
+    # one COPY of the whole dataHeader key/date table, used when dataHeader wasn't processed in this run
+    global _lookup, _complete
+    with get_connection() as conn, conn.cursor() as cursor:
+        _lookup = _copy_to_frame(cursor, f'SELECT "PrimaryKey", "DateVisited"::text FROM {DBSCHEMA}."dataHeader"')
+    _complete = True
+    logger.info(f"header_cache:: DateVisited lookup loaded from the database ({_lookup.height} keys).")
+
+
+def datevisited_for(primary_keys: pl.Series) -> pl.DataFrame:
+    """
+    PrimaryKey/DateVisited rows for the distinct keys in primary_keys. keys the lookup
+    doesn't hold yet are fetched in one query, deduplicated and passed as an array.
+    """
+    global _lookup
+    if _lookup is None:
+        load_header_lookup()
+
+    keys = primary_keys.cast(pl.Utf8).drop_nulls().unique()
+    if not _complete:
+        missing = keys.filter(~keys.is_in(_lookup["PrimaryKey"]))
+        if missing.len() > 0:
+            logger.info(f"header_cache:: fetching DateVisited for {missing.len()} keys not in this run's dataHeader.")
+            with get_connection() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT "PrimaryKey", "DateVisited"::text FROM {DBSCHEMA}."dataHeader" WHERE "PrimaryKey" = ANY(%s)',
+                    (missing.to_list(),),
+                )
+                fetched = pl.DataFrame(cursor.fetchall(), schema=_LOOKUP_SCHEMA, orient="row")
+            _lookup = pl.concat([_lookup, fetched])
+
+    return _lookup.filter(pl.col("PrimaryKey").is_in(keys))
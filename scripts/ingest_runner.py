@@ -0,0 +1,175 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import INGEST_WORKERS
+from scripts import run_metrics
+from scripts.data_loader import process_csv
+from scripts.readers import table_name_from_path
+from scripts.db_connector import insert_dataframe_to_db
+from scripts.manifest import source_fingerprint, is_unchanged, record_load
+from scripts.checkpoint import source_key, clear_journal
+from scripts.header_cache import set_header_lookup, export_header_lookup, install_header_lookup
+from scripts.ddl import reconciled_tables, mark_reconciled
+
+logger = logging.getLogger(__name__)
+
+
+def ingest_file(file_path: str, project_key: str = None, force: bool = False, run_id: str = None) -> dict:
+    """
+    parse, clean and load one input file (csv, compressed csv, parquet or arrow ipc). runs inside a pool worker, so it never raises: the
+    outcome (including any error) is returned for the run summary. files whose
+    fingerprint matches the manifest entry of their last load are skipped unless force.
+    with a run_id, committed batches are journaled under it (see checkpoint.py) and a
+    load of the same input that an earlier run left unfinished continues where it stopped.
+    """
+    table_name = table_name_from_path(file_path)
+    result = {
+        "table_name": table_name,
+        "file": file_path,
+        "status": "failed",
+        "rows": 0,
+        "rows_affected": 0,
+        "inserted": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "diverted": 0,
+        "seconds": 0.0,
+        "error": None,
+        "metrics": {},
+        "stages": [],
+    }
+    metrics_before = run_metrics.snapshot()
+    stages_before = run_metrics.stage_mark()
+    started = time.perf_counter()
+    try:
+        fingerprint = source_fingerprint(file_path)
+        if not force and is_unchanged(table_name, project_key, fingerprint):
+            logger.info(f"ingest_runner:: '{file_path}' is unchanged since its last load, skipping.")
+            result["status"] = "skipped"
+            return result
+
+        processed = process_csv(file_path, project_key)
+        if processed is None:
+            result["error"] = "process_csv did not return a dataframe (see log)"
+            return result
+
+        df = processed['dataframe']
+        result["table_name"] = processed['table_name']
+        result["rows"] = df.height
+        result["diverted"] = processed.get('diverted', 0)
+
+        geometry_column = "wkb_geometry" if "wkb_geometry" in df.columns else None
+        checkpoint = None
+        if run_id is not None:
+            checkpoint = {"run_id": run_id, "project_key": project_key, "source": source_key(fingerprint),
+                          "source_file": os.path.abspath(file_path)}
+        loaded = insert_dataframe_to_db(df, processed['table_name'], geometry_column=geometry_column, checkpoint=checkpoint)
+        if loaded is None:
+            result["error"] = "insert_dataframe_to_db failed (see log)"
+            return result
+
+        for count in ("rows_affected", "inserted", "updated", "unchanged"):
+            result[count] = loaded[count]
+        if result["table_name"] == "dataHeader":
+            # every other table in the run looks its DateVisited up here instead of querying dataHeader
+            set_header_lookup(df)
+        if result["diverted"]:
+            # left out of the manifest: once dataHeader has the missing keys, the next run loads the rest
+            logger.warning(f"ingest_runner:: {result['diverted']} rows of '{file_path}' were diverted to the "
+                           f"no-PrimaryKey parquet, not recording it in the manifest.")
+        else:
+            record_load(result["table_name"], project_key, file_path, fingerprint, result["rows"])
+        if run_id is not None:
+            clear_journal(result["table_name"], project_key)
+        result["status"] = "ok"
+        return result
+    except Exception as e:
+        logger.error(f"ingest_runner:: error ingesting '{file_path}': {e}")
+        result["error"] = str(e)
+        return result
+    finally:
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        result["metrics"] = run_metrics.delta(metrics_before)
+        result["stages"] = run_metrics.stages_since(stages_before)
+
+
+def _init_worker(header_lookup: tuple, reconciled: set):
+    # workers start with the parent's dataHeader lookup and DDL state instead of rebuilding them
+    install_header_lookup(*header_lookup)
+    mark_reconciled(reconciled)
+
+
+def ingest_files(file_paths: list[str], project_key: str = None, workers: int = INGEST_WORKERS,
+                 force: bool = False, run_id: str = None) -> list[dict]:
+    """
+    ingest independent tables concurrently, one worker process per table. each worker
+    opens its own database connections. returns one result dict per file.
+    """
+    if not file_paths:
+        return []
+
+    workers = max(1, min(workers, len(file_paths)))
+    if workers == 1:
+        return [ingest_file(file_path, project_key, force, run_id) for file_path in file_paths]
+
+    logger.info(f"ingest_runner:: ingesting {len(file_paths)} tables with {workers} worker processes.")
+    results = []
+    # spawn rather than fork: polars' thread pool and open connections don't survive fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(export_header_lookup(), reconciled_tables())) as executor:
+        futures = {executor.submit(ingest_file, file_path, project_key, force, run_id): file_path for file_path in file_paths}
+        for future in as_completed(futures):
+            file_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # the worker process itself died (e.g. out of memory)
+                logger.error(f"ingest_runner:: worker for '{file_path}' crashed: {e}")
+                result = {
+                    "table_name": table_name_from_path(file_path),
+                    "file": file_path,
+                    "status": "failed",
+                    "rows": 0,
+                    "rows_affected": 0,
+                    "inserted": 0,
+                    "updated": 0,
+                    "unchanged": 0,
+                    "diverted": 0,
+                    "seconds": 0.0,
+                    "error": str(e),
+                    "metrics": {},
+                    "stages": [],
+                }
+            # counters from other processes aren't visible here, fold them into this run's
+            run_metrics.merge(result["metrics"])
+            logger.info(f"ingest_runner:: {result['table_name']} finished: {result['status']} in {result['seconds']}s")
+            results.append(result)
+    return results
+
+
+def log_ingest_summary(results: list[dict]):
+    logger.info("ingest summary:")
+    for result in sorted(results, key=lambda r: r["table_name"]):
+        line = (f"  {result['table_name']:<28} {result['status']:<7} rows={result['rows']:<10} "
+                f"inserted={result['inserted']:<10} updated={result['updated']:<10} unchanged={result['unchanged']:<10} "
+                f"diverted={result['diverted']:<10} "
+                f"{result['seconds']:>9.3f}s")
+        if result["error"]:
+            line += f"  error: {result['error']}"
+        logger.info(line)
+    counters = run_metrics.snapshot()
+    if counters.get("db.connections_borrowed"):
+        logger.info(
+            f"  db connections: {int(counters.get('db.connections_opened', 0))} opened in "
+            f"{counters.get('db.connect_seconds', 0):.3f}s, {int(counters['db.connections_borrowed'])} borrowed from the pool, "
+            f"{int(counters.get('db.connections_discarded', 0))} discarded"
+        )
+    failed = [r["table_name"] for r in results if r["status"] not in ("ok", "skipped")]
+    if failed:
+        logger.warning(f"ingest summary:: {len(failed)} of {len(results)} tables failed: {', '.join(failed)}")
+    else:
+        skipped = len([r for r in results if r["status"] == "skipped"])
+        logger.info(f"ingest summary:: all {len(results)} tables ingested ({skipped} unchanged and skipped).")
@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import os
+
+from config import DBSCHEMA
+from scripts.db_pool import get_connection
+from scripts.schemaplan import get_schemaplan, file_sha256
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_TABLE = "ingest_manifest"
+
+# modules whose code decides what ends up in the tables: a change in any of them
+# changes the cleaner version and invalidates every manifest entry
+_CLEANER_MODULES = ("data_loader.py", "data_cleaner.py", "data_validator.py", "normalize.py", "schemaplan.py")
+
+
+def cleaner_version() -> str:
+    digest = hashlib.sha256()
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in _CLEANER_MODULES:
+        with open(os.path.join(scripts_dir, module), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def source_fingerprint(file_path: str) -> dict:
+    """
+    what a load depends on: the file content (hashed in 1MB blocks, so large files are
+    never held in memory), the schemaplan and the cleaning code
+    """
+    return {
+        "content_sha256": file_sha256(file_path),
+        "schemaplan_version": get_schemaplan().sha256,
+        "cleaner_version": cleaner_version(),
+    }
+
+
+def ensure_manifest_table():
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DBSCHEMA}."{MANIFEST_TABLE}" (
+                table_name TEXT NOT NULL,
+                project_key TEXT NOT NULL DEFAULT '',
+                source_file TEXT,
+                content_sha256 TEXT NOT NULL,
+                schemaplan_version TEXT NOT NULL,
+                cleaner_version TEXT NOT NULL,
+                row_count BIGINT,
+                loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+                PRIMARY KEY (table_name, project_key)
+            );
+        """)
+        conn.commit()
+
+
+def is_unchanged(table_name: str, project_key: str, fingerprint: dict) -> bool:
+    # True when the last successful load of this table/project used exactly this input
+    try:
+        with get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT content_sha256, schemaplan_version, cleaner_version
+                FROM {DBSCHEMA}."{MANIFEST_TABLE}"
+                WHERE table_name = %s AND project_key = %s
+            """, (table_name, project_key or ''))
+            row = cursor.fetchone()
+    except Exception as e:
+        logger.info(f"manifest:: could not read manifest for {table_name}: {e}")
+        return False
+    return row is not None and row == (
+        fingerprint["content_sha256"], fingerprint["schemaplan_version"], fingerprint["cleaner_version"]
+    )
+
+
+def record_load(table_name: str, project_key: str, file_path: str, fingerprint: dict, row_count: int):
+    try:
+        with get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {DBSCHEMA}."{MANIFEST_TABLE}"
+                    (table_name, project_key, source_file, content_sha256, schemaplan_version, cleaner_version, row_count, loaded_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, now())
+                ON CONFLICT (table_name, project_key) DO UPDATE SET
+                    source_file = EXCLUDED.source_file,
+                    content_sha256 = EXCLUDED.content_sha256,
+                    schemaplan_version = EXCLUDED.schemaplan_version,
+                    cleaner_version = EXCLUDED.cleaner_version,
+                    row_count = EXCLUDED.row_count,
+                    loaded_at = EXCLUDED.loaded_at
+            """, (table_name, project_key or '', os.path.basename(file_path), fingerprint["content_sha256"],
+                  fingerprint["schemaplan_version"], fingerprint["cleaner_version"], row_count))
+            conn.commit()
+    except Exception as e:
+        # a missing manifest entry only costs a reload next time
+        logger.warning(f"manifest:: could not record load of {table_name}: {e}")
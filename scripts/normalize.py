@@ -0,0 +1,44 @@
+import logging
+
+import polars as pl
+
+from scripts.schemaplan import get_schemaplan
+
+logger = logging.getLogger(__name__)
+
+
+def decide_mapping(values: list, rule: dict) -> dict:
+    """
+    value -> replacement for a column from its distinct values and a rule of
+    scripts.schemaplan.VALUE_RULES / COLUMN_VALUE_MAPS. only values that occur are mapped.
+    """
+    sentinels = set(rule.get("sentinels", []))
+    present = {value for value in values if value is not None}
+    mapping = {value: None for value in present & sentinels}
+    present -= sentinels
+    for vocabulary in rule.get("vocabularies", []):
+        if present & vocabulary.keys():
+            mapping.update({value: vocabulary[value] for value in present if value in vocabulary})
+            break
+    return mapping
+
+
+def normalize_values(df: pl.DataFrame, table_name: str) -> pl.DataFrame:
+    """
+    apply the schemaplan value rules of table_name. the mapping of every text column is
+    decided from its distinct values (usually a handful), then all columns are rewritten
+    in one with_columns.
+    """
+    rules = get_schemaplan().value_rules(table_name)
+    columns = [name for name, dtype in df.schema.items() if name in rules and dtype == pl.Utf8]
+    if not columns:
+        return df
+
+    distinct = df.select([pl.col(name).unique().implode() for name in columns]).row(0)
+    exprs = []
+    for name, values in zip(columns, distinct):
+        mapping = decide_mapping(values, rules[name])
+        if mapping:
+            logger.debug(f"normalize:: {table_name}.{name}: {mapping}")
+            exprs.append(pl.col(name).replace(mapping))
+    return df.with_columns(exprs) if exprs else df
@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import re
+
+import polars as pl
+
+from config import DBSCHEMA, PARTITION_BY
+from scripts.schemaplan import get_schemaplan
+
+logger = logging.getLogger(__name__)
+
+# PARTITION_BY -> (strategy, partition column)
+LAYOUTS = {"projectkey": ("list", "ProjectKey"), "datevisited": ("range", "DateVisited")}
+PARTITION_STRATEGIES = {"l": "list", "r": "range"}
+
+
+def planned_partitioning(table_name: str):
+    """
+    (strategy, column) a new table is created with, or None for a plain table. dataHeader
+    is never partitioned: its PrimaryKey is the foreign key target of every other table,
+    and a unique constraint on a partitioned table has to include the partition column.
+    """
+    layout = LAYOUTS.get((PARTITION_BY or "").lower())
+    if layout is None or table_name.lower() == "dataheader":
+        return None
+    return layout if layout[1] in get_schemaplan().pg_types(table_name) else None
+
+
+def table_partitioning(cursor, table_name: str):
+    # (strategy, column) of DBSCHEMA.table_name as it is in the database, None if it isn't partitioned
+    cursor.execute("""
+        SELECT pt.partstrat, a.attname
+        FROM pg_catalog.pg_partitioned_table pt
+        JOIN pg_catalog.pg_attribute a ON a.attrelid = pt.partrelid AND a.attnum = pt.partattrs[0]
+        WHERE pt.partrelid = to_regclass(%s)
+    """, (f'"{DBSCHEMA}"."{table_name}"',))
+    row = cursor.fetchone()
+    return (PARTITION_STRATEGIES.get(row[0], row[0]), row[1]) if row else None
+
+
+def conflict_columns(unique_keys: list[str], partitioning) -> list[str]:
+    # unique constraints (and so ON CONFLICT targets) of a partitioned table must include its partition column
+    if partitioning is None or partitioning[1] in unique_keys:
+        return list(unique_keys)
+    return list(unique_keys) + [partitioning[1]]
+
+
+def partition_name(table_name: str, value) -> str:
+    """
+    name of the LIST partition holding `value`: readable, plus a short digest so two
+    values that clean up to the same text never share a partition
+    """
+    if value is None:
+        return f"{table_name}_null"
+    label = re.sub(r"[^0-9A-Za-z]+", "_", str(value)).strip("_")[:24]
+    digest = hashlib.md5(str(value).encode()).hexdigest()[:8]
+    return f"{table_name}_{label}_{digest}"[:55]
+
+
+def _years(values: pl.Series) -> list[int]:
+    years = values.cast(pl.Utf8).str.slice(0, 4).drop_nulls().unique()
+    return sorted(int(year) for year in years.to_list() if year.isdigit())
+
+
+def ensure_partitions(cursor, table_name: str, df: pl.DataFrame, partitioning):
+    """
+    create the partitions the rows of df fall into, before they are merged into the
+    parent: one LIST partition per ProjectKey (NULL included), or one RANGE partition per
+    DateVisited year plus a DEFAULT partition for rows without a date
+    """
+    strategy, column = partitioning
+    parent = f'{DBSCHEMA}."{table_name}"'
+    values = df.get_column(column) if column in df.columns else pl.Series(column, [None], dtype=pl.Utf8)
+    statements = []
+    if strategy == "list":
+        for value in values.unique().to_list():
+            bound = "NULL" if value is None else cursor.mogrify("%s", (str(value),)).decode()
+            statements.append(f'CREATE TABLE IF NOT EXISTS {DBSCHEMA}."{partition_name(table_name, value)}" '
+                              f'PARTITION OF {parent} FOR VALUES IN ({bound})')
+    else:
+        for year in _years(values):
+            statements.append(f'CREATE TABLE IF NOT EXISTS {DBSCHEMA}."{table_name}_{year}" PARTITION OF {parent} '
+                              f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')")
+        if values.null_count():
+            statements.append(f'CREATE TABLE IF NOT EXISTS {DBSCHEMA}."{table_name}_default" PARTITION OF {parent} DEFAULT')
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def _index_definitions(cursor, table_name: str, target: str) -> list[str]:
+    # the parent's index definitions, rewritten for target (unnamed, postgres picks the names)
+    cursor.execute("""
+        SELECT pg_get_indexdef(i.indexrelid)
+        FROM pg_catalog.pg_index i
+        WHERE i.indrelid = to_regclass(%s)
+    """, (f'"{DBSCHEMA}"."{table_name}"',))
+    return [re.sub(r"^CREATE (UNIQUE )?INDEX \S+ ON ONLY \S+ ", lambda m: f"CREATE {m.group(1) or ''}INDEX ON {target} ", definition)
+            for definition, in cursor.fetchall()]
+
+
+def _foreign_keys(cursor, table_name: str) -> list[str]:
+    cursor.execute("""
+        SELECT pg_get_constraintdef(oid)
+        FROM pg_catalog.pg_constraint
+        WHERE conrelid = to_regclass(%s) AND contype = 'f'
+    """, (f'"{DBSCHEMA}"."{table_name}"',))
+    return [definition for definition, in cursor.fetchall()]
+
+
+def swap_partition(cursor, table_name: str, value, column: str, load) -> int:
+    """
+    replace the LIST partition holding `value` with a freshly built one:
+    1. a standalone table shaped like the parent is created and load(target) copies the
+       rows into it, without any index to maintain or conflict to check
+    2. the parent's indexes and foreign keys are built on it, plus a CHECK matching the
+       partition bound, so ATTACH neither rebuilds nor rescans anything
+    3. the old partition is detached and dropped and the new one attached in its place
+    the caller commits; until then readers keep seeing the old partition. returns the
+    number of rows the old partition held.
+    """
+    parent = f'{DBSCHEMA}."{table_name}"'
+    name = partition_name(table_name, value)
+    fresh = f'{DBSCHEMA}."{name}_load"'
+    bound = "NULL" if value is None else cursor.mogrify("%s", (str(value),)).decode()
+    bound_check = f'"{column}" IS NULL' if value is None else f'"{column}" IS NOT NULL AND "{column}" = {bound}'
+
+    cursor.execute(f"DROP TABLE IF EXISTS {fresh}")
+    cursor.execute(f"CREATE TABLE {fresh} (LIKE {parent} INCLUDING DEFAULTS)")
+    load(fresh)
+
+    for definition in _index_definitions(cursor, table_name, fresh):
+        cursor.execute(definition)
+    for definition in _foreign_keys(cursor, table_name):
+        cursor.execute(f"ALTER TABLE {fresh} ADD {definition}")
+    cursor.execute(f'ALTER TABLE {fresh} ADD CONSTRAINT "{name}_bound" CHECK ({bound_check})')
+    cursor.execute(f"ANALYZE {fresh}")
+
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_catalog.pg_inherits i
+        JOIN pg_catalog.pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s) AND c.relname = %s
+    """, (f'"{DBSCHEMA}"."{table_name}"', name))
+    replaced = 0
+    if cursor.fetchone():
+        cursor.execute(f'SELECT count(*) FROM {DBSCHEMA}."{name}"')
+        replaced = cursor.fetchone()[0]
+        cursor.execute(f'ALTER TABLE {parent} DETACH PARTITION {DBSCHEMA}."{name}"')
+        cursor.execute(f'DROP TABLE {DBSCHEMA}."{name}"')
+    cursor.execute(f"ALTER TABLE {parent} ATTACH PARTITION {fresh} FOR VALUES IN ({bound})")
+    cursor.execute(f'ALTER TABLE {fresh} RENAME TO "{name}"')
+    cursor.execute(f'ALTER TABLE {DBSCHEMA}."{name}" DROP CONSTRAINT "{name}_bound"')
+    logger.info(f"partitions:: swapped in {name} for {column} = {value!r} ({replaced} rows replaced).")
+    return replaced
@@ -0,0 +1,132 @@
+import io
+import struct
+
+import numpy as np
+import polars as pl
+
+# COPY ... WITH (FORMAT binary) framing: signature, flags, header extension length
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+
+# days between the unix epoch (polars Date) and the postgres epoch (2000-01-01)
+_PG_EPOCH_OFFSET_DAYS = 10957
+
+# encoder kind -> (postgres type of the staging column, bytes per value or None if variable)
+BINARY_KINDS = {
+    "float8": ("double precision", 8),
+    "int8": ("bigint", 8),
+    "date": ("date", 4),
+    "text": ("text", None),
+}
+
+_FLOAT_TARGETS = ("numeric", "decimal", "double precision", "real", "float", "float8", "float4")
+_INT_TARGETS = ("integer", "int", "int4", "int8", "bigint", "smallint", "int2")
+
+
+def binary_column_kinds(schema: pl.Schema, pg_types: dict[str, str]) -> dict[str, str]:
+    """
+    pick a binary encoding per column from its schemaplan type and the frame's dtype.
+    a column is only sent as a typed binary value when the frame already holds it in that
+    type (numericfix/integerfix/dateloadedfix ran); anything else goes as text and is cast
+    server side, same as with csv.
+    """
+    kinds = {}
+    for col, dtype in schema.items():
+        target = (pg_types.get(col) or "text").lower()
+        if target in _FLOAT_TARGETS and dtype in (pl.Float64, pl.Float32):
+            kinds[col] = "float8"
+        elif target in _INT_TARGETS and dtype in (pl.Int64, pl.Int32, pl.Int16, pl.Int8, pl.UInt8, pl.UInt16, pl.UInt32):
+            kinds[col] = "int8"
+        elif target == "date" and dtype == pl.Date:
+            kinds[col] = "date"
+        else:
+            kinds[col] = "text"
+    return kinds
+
+
+def staging_types(kinds: dict[str, str]) -> dict[str, str]:
+    return {col: BINARY_KINDS[kind][0] for col, kind in kinds.items()}
+
+
+def _column_payload(series: pl.Series, kind: str):
+    """
+    returns (field lengths, fixed width values as a (n, width) uint8 array or None,
+    concatenated variable width bytes or None). a length of -1 marks NULL.
+    """
+    nulls = series.is_null().to_numpy()
+    width = BINARY_KINDS[kind][1]
+
+    if kind == "text":
+        text = series.cast(pl.Utf8)
+        lengths = text.str.len_bytes().fill_null(-1).cast(pl.Int64).to_numpy()
+        # one string for the whole column: the per-value bytes are scattered by offset below
+        joined = text.drop_nulls().str.join("").item() if text.len() > text.null_count() else ""
+        return lengths, None, np.frombuffer(joined.encode("utf-8"), dtype=np.uint8)
+
+    if kind == "float8":
+        values = series.cast(pl.Float64).fill_null(0).to_numpy().astype(">f8")
+    elif kind == "int8":
+        values = series.cast(pl.Int64).fill_null(0).to_numpy().astype(">i8")
+    else:  # date
+        values = (series.cast(pl.Int32).fill_null(0).to_numpy() - _PG_EPOCH_OFFSET_DAYS).astype(">i4")
+
+    lengths = np.where(nulls, -1, width).astype(np.int64)
+    return lengths, values.view(np.uint8).reshape(-1, width), None
+
+
+def _scatter(out: np.ndarray, positions: np.ndarray, values: np.ndarray):
+    # out[positions[r] + j] = values[r, j] for every row r and byte j
+    width = values.shape[1]
+    out[(positions[:, None] + np.arange(width)).ravel()] = values.ravel()
+
+
+def encode_dataframe(df: pl.DataFrame, kinds: dict[str, str], header: bool = True, trailer: bool = True) -> bytes:
+    """
+    encode df as PGCOPY tuples in one vectorized pass per column: row and field offsets
+    are computed with cumulative sums, and every length/value is written with numpy
+    fancy indexing, so no python object is created per row or per field.
+    """
+    n_rows = df.height
+    columns = list(kinds)
+    payloads = [_column_payload(df[col], kinds[col]) for col in columns]
+
+    # per-row size: int16 field count + for each field int32 length + data
+    data_lengths = [np.maximum(lengths, 0) for lengths, _, _ in payloads]
+    row_sizes = np.full(n_rows, 2, dtype=np.int64)
+    for lengths in data_lengths:
+        row_sizes += 4 + lengths
+    row_starts = np.zeros(n_rows, dtype=np.int64)
+    if n_rows:
+        np.cumsum(row_sizes[:-1], out=row_starts[1:])
+
+    prefix = PGCOPY_HEADER if header else b""
+    suffix = PGCOPY_TRAILER if trailer else b""
+    body_size = int(row_sizes.sum())
+    out = np.empty(len(prefix) + body_size + len(suffix), dtype=np.uint8)
+    out[:len(prefix)] = np.frombuffer(prefix, dtype=np.uint8)
+    out[len(prefix) + body_size:] = np.frombuffer(suffix, dtype=np.uint8)
+    row_starts += len(prefix)
+
+    field_count = np.frombuffer(struct.pack(">h", len(columns)), dtype=np.uint8)
+    _scatter(out, row_starts, np.broadcast_to(field_count, (n_rows, 2)))
+
+    field_starts = row_starts + 2
+    for (lengths, fixed, variable), data_length in zip(payloads, data_lengths):
+        _scatter(out, field_starts, lengths.astype(">i4").view(np.uint8).reshape(-1, 4))
+        present = lengths >= 0
+        data_starts = field_starts + 4
+        if fixed is not None:
+            _scatter(out, data_starts[present], fixed[present])
+        elif variable.size:
+            sizes = data_length[present]
+            # byte k of the joined column belongs to value r at offset k - start_of_r
+            value_starts = np.repeat(np.cumsum(sizes) - sizes, sizes)
+            out[np.repeat(data_starts[present], sizes) + np.arange(variable.size) - value_starts] = variable
+        field_starts = data_starts + data_length
+
+    return out.tobytes()
+
+
+def dataframe_to_binary_buffer(df: pl.DataFrame, kinds: dict[str, str]) -> io.BytesIO:
+    # a complete COPY FROM STDIN (FORMAT binary) payload for df
+    return io.BytesIO(encode_dataframe(df, kinds))
@@ -0,0 +1,133 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from datetime import datetime
+
+from config import DBSCHEMA, COPY_FORMAT, LOAD_MODE, ROW_HASHES, PROFILE_DIR
+from scripts import run_metrics
+from scripts.data_loader import process_csv
+from scripts.db_connector import insert_dataframe_to_db
+from scripts.readers import table_name_from_path
+from scripts.run_report import aggregate_stages
+
+logger = logging.getLogger(__name__)
+
+# allocation sites listed per phase in memory.txt
+TOP_ALLOCATIONS = 25
+
+
+def _phase(name: str, profiler: cProfile.Profile, memory: dict, call):
+    """
+    run call() under the profiler and tracemalloc: memory[name] gets the phase's seconds,
+    python allocation peak, and the allocation sites that grew the most over it
+    """
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    stages_before = run_metrics.stage_mark()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        return call()
+    finally:
+        profiler.disable()
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        # every stage resets the peak, so the highest of theirs counts too
+        stage_peaks = [record.get("py_peak_bytes") or 0 for record in run_metrics.stages_since(stages_before)]
+        memory[name] = {
+            "seconds": round(time.perf_counter() - started, 3),
+            "py_peak_bytes": max([peak] + stage_peaks),
+            "py_current_bytes": current,
+            "top_allocations": [str(stat) for stat in after.compare_to(before, "lineno")[:TOP_ALLOCATIONS]],
+        }
+
+
+def _write(report_dir: str, name: str, text: str):
+    with open(os.path.join(report_dir, name), "w") as f:
+        f.write(text)
+
+
+def _profile_text(profiler: cProfile.Profile) -> str:
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out).strip_dirs()
+    out.write("by cumulative time\n\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(60)
+    out.write("\nby own time\n\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(40)
+    return out.getvalue()
+
+
+def _memory_text(memory: dict, stages: dict) -> str:
+    lines = ["python allocations (tracemalloc). polars and arrow buffers are allocated outside",
+             "python and only show up in peak_rss_bytes.", ""]
+    for name, phase in memory.items():
+        lines.append(f"{name}: {phase['seconds']}s, python peak {phase['py_peak_bytes']} bytes, "
+                     f"{phase['py_current_bytes']} bytes still held after it")
+        lines += [f"  {allocation}" for allocation in phase["top_allocations"]]
+        lines.append("")
+    lines.append("per stage")
+    for stage, totals in stages.items():
+        lines.append(f"  {stage:<14} calls={totals['calls']:<5} wall_s={totals.get('wall_s', 0):<10} "
+                     f"py_peak_bytes={totals.get('py_peak_bytes', '-'):<12} peak_rss_bytes={totals.get('peak_rss_bytes', '-')}")
+    return "\n".join(lines) + "\n"
+
+
+def profile_table(file_path: str, project_key: str = None) -> str:
+    """
+    load one input file the way ingest does (process_csv, then insert_dataframe_to_db,
+    manifest left alone) while recording where the time and memory go. writes into
+    PROFILE_DIR/<timestamp>_<table>/:
+      profile.prof / profile.txt   cProfile of both phases (binary for snakeviz, top functions as text)
+      memory.txt                   tracemalloc peak per phase and stage, top allocation sites per phase
+      polars_plan.txt              optimized polars plan of the cleaning steps
+      merge_explain.txt            EXPLAIN (ANALYZE, BUFFERS) of the merge statement
+      stages.json                  the run_metrics stages and the load's outcome
+    returns the report directory.
+    """
+    table_name = table_name_from_path(file_path)
+    report_dir = os.path.join(PROFILE_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{table_name}")
+    os.makedirs(report_dir, exist_ok=True)
+    logger.info(f"profiler:: profiling {file_path} into {DBSCHEMA}.\"{table_name}\", report in {report_dir}")
+
+    profiler = cProfile.Profile()
+    memory, plans, explain = {}, [], []
+    loaded = None
+    stages_before = run_metrics.stage_mark()
+    tracemalloc.start()
+    try:
+        processed = _phase("process_csv", profiler, memory, lambda: process_csv(file_path, project_key, plans=plans))
+        if processed is None:
+            logger.error("profiler:: process_csv did not return a dataframe (see log), nothing loaded.")
+        else:
+            df = processed['dataframe']
+            geometry_column = "wkb_geometry" if "wkb_geometry" in df.columns else None
+            loaded = _phase("insert_dataframe_to_db", profiler, memory,
+                            lambda: insert_dataframe_to_db(df, processed['table_name'], geometry_column=geometry_column,
+                                                           explain=explain))
+    finally:
+        tracemalloc.stop()
+
+    stages = aggregate_stages(run_metrics.stages_since(stages_before)).get(table_name, {})
+    profiler.dump_stats(os.path.join(report_dir, "profile.prof"))
+    _write(report_dir, "profile.txt", _profile_text(profiler))
+    _write(report_dir, "memory.txt", _memory_text(memory, stages))
+    _write(report_dir, "polars_plan.txt", "\n\n".join(plans) + "\n" if plans else "process_csv built no plan (see log)\n")
+    _write(report_dir, "merge_explain.txt", explain[0] + "\n" if explain else
+           "no merge statement ran: the load failed, or took the bulk load or partition swap path (see stages.json)\n")
+    with open(os.path.join(report_dir, "stages.json"), "w") as f:
+        json.dump({
+            "file": file_path,
+            "table": table_name,
+            "schema": DBSCHEMA,
+            "config": {"copy_format": COPY_FORMAT, "load_mode": LOAD_MODE, "row_hashes": ROW_HASHES},
+            "result": loaded,
+            "phases": {name: {k: v for k, v in phase.items() if k != "top_allocations"} for name, phase in memory.items()},
+            "stages": stages,
+        }, f, indent=2, default=str)
+    logger.info(f"profiler:: report written to {report_dir}")
+    return report_dir
@@ -0,0 +1,143 @@
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+
+import polars as pl
+
+from config import PARQUET_CACHE, PARQUET_CACHE_DIR
+from scripts.schemaplan import get_schemaplan, NA_SENTINELS
+
+try:
+    import zstandard
+except ImportError:  # optional: without it polars decompresses .zst inputs in memory
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# every input format, longest suffix first so "x.csv.gz" isn't mistaken for "x.csv"
+CSV_EXTENSIONS = (".csv.gz", ".csv.zst", ".csv")
+COLUMNAR_EXTENSIONS = (".parquet", ".arrow", ".ipc", ".feather")
+INPUT_EXTENSIONS = CSV_EXTENSIONS + COLUMNAR_EXTENSIONS
+NULL_VALUES = NA_SENTINELS
+_CHUNK = 1 << 20
+
+
+def input_extension(path: str):
+    # the input suffix of path, or None when it isn't a file we ingest
+    name = os.path.basename(path).lower()
+    return next((ext for ext in INPUT_EXTENSIONS if name.endswith(ext)), None)
+
+
+def is_input_file(path: str) -> bool:
+    return input_extension(path) is not None
+
+
+def table_name_from_path(path: str) -> str:
+    # "dataGap.csv.gz" -> "dataGap"; unknown extensions fall back to splitext
+    name = os.path.basename(path)
+    ext = input_extension(path)
+    return name[:-len(ext)] if ext else os.path.splitext(name)[0]
+
+
+def _decompress(path: str, scratch_dir: str) -> str:
+    """
+    stream a compressed csv into scratch_dir in 1MB blocks and return the plain copy, so
+    the scan below memory-maps it instead of holding the decompressed file in memory
+    """
+    target = os.path.join(scratch_dir, os.path.basename(path).rsplit(".", 1)[0])
+    with open(target, "wb") as out:
+        if path.lower().endswith(".gz"):
+            with gzip.open(path, "rb") as src:
+                shutil.copyfileobj(src, out, _CHUNK)
+        else:
+            with open(path, "rb") as src:
+                zstandard.ZstdDecompressor().copy_stream(src, out, read_size=_CHUNK, write_size=_CHUNK)
+    logger.info(f"readers:: decompressed {path} ({os.path.getsize(path)} -> {os.path.getsize(target)} bytes).")
+    return target
+
+
+def _scan_csv(path: str, table_name: str) -> pl.LazyFrame:
+    # typed from the schemaplan: no inference pass, and only schemaplan columns are ever parsed
+    header = pl.scan_csv(path, infer_schema_length=0).collect_schema().names()
+    scan_dtypes = {col: dtype for col, dtype in get_schemaplan().scan_dtypes(table_name).items() if col in header}
+    return pl.scan_csv(path, null_values=NULL_VALUES, infer_schema_length=0, schema_overrides=scan_dtypes)
+
+
+def _conform(lf: pl.LazyFrame, table_name: str) -> pl.LazyFrame:
+    """
+    give a columnar input the dtypes and nulls a csv scan would have. boolean columns are
+    kept as they are, the bit coercion takes them natively.
+    """
+    schema = lf.collect_schema()
+    exprs = []
+    for col, dtype in get_schemaplan().scan_dtypes(table_name).items():
+        if col not in schema:
+            continue
+        expr = pl.col(col)
+        if schema[col] == pl.Utf8:
+            expr = pl.when(expr.is_in(NULL_VALUES)).then(None).otherwise(expr)
+        if schema[col] not in (dtype, pl.Boolean):
+            expr = expr.cast(dtype)
+        exprs.append(expr.alias(col))
+    return lf.with_columns(exprs) if exprs else lf
+
+
+def _cache_path(path: str, table_name: str) -> str:
+    # one entry per source path; its name changes with the file's size, mtime and the schemaplan
+    stat = os.stat(path)
+    source = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:8]
+    state = hashlib.sha256(f"{stat.st_size}:{stat.st_mtime_ns}:{get_schemaplan().sha256}".encode()).hexdigest()[:12]
+    return os.path.join(PARQUET_CACHE_DIR, f"{table_name}_{source}_{state}.parquet")
+
+
+def _write_cache(lf: pl.LazyFrame, cache_path: str, table_name: str):
+    prefix = os.path.basename(cache_path).rsplit("_", 1)[0] + "_"
+    os.makedirs(PARQUET_CACHE_DIR, exist_ok=True)
+    # streamed to a temporary name and renamed, so a crash never leaves half a cache entry
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    schemaplan_columns = [col for col in lf.collect_schema().names() if col in get_schemaplan().scan_dtypes(table_name)]
+    try:
+        lf.select(schemaplan_columns).sink_parquet(tmp_path)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    # older entries of the same source are stale now
+    for name in os.listdir(PARQUET_CACHE_DIR):
+        if name.startswith(prefix) and name.endswith(".parquet") and name != os.path.basename(cache_path):
+            os.remove(os.path.join(PARQUET_CACHE_DIR, name))
+    logger.info(f"readers:: wrote parquet cache {cache_path}.")
+
+
+def scan_input(path: str, table_name: str, scratch_dir: str) -> pl.LazyFrame:
+    """
+    lazy frame for any input file, typed like the schemaplan csv scan. parquet and arrow
+    ipc are scanned (ipc memory-mapped) and conformed; .gz/.zst csvs are decompressed into
+    scratch_dir, which has to outlive the collect. with PARQUET_CACHE a csv is parsed once
+    into a typed parquet copy and later runs on the same file read that instead.
+    """
+    ext = input_extension(path)
+    if ext == ".parquet":
+        return _conform(pl.scan_parquet(path), table_name)
+    if ext in COLUMNAR_EXTENSIONS:
+        return _conform(pl.scan_ipc(path, memory_map=True), table_name)
+
+    cache_path = _cache_path(path, table_name) if PARQUET_CACHE else None
+    if cache_path and os.path.exists(cache_path):
+        logger.info(f"readers:: {path} is unchanged, reading its parquet cache {cache_path}.")
+        return pl.scan_parquet(cache_path)
+
+    csv_path = path
+    if ext == ".csv.gz" or (ext == ".csv.zst" and zstandard is not None):
+        csv_path = _decompress(path, scratch_dir)
+    lf = _scan_csv(csv_path, table_name)
+
+    if cache_path:
+        try:
+            _write_cache(lf, cache_path, table_name)
+            return pl.scan_parquet(cache_path)
+        except Exception as e:
+            logger.warning(f"readers:: could not write parquet cache for {path}, reading the csv: {e}")
+    return lf
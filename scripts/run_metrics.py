@@ -0,0 +1,92 @@
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+# process-wide counters for the current run (connection setup, rows, timings...).
+# worker processes send theirs back with their results and the parent merges them.
+_lock = threading.Lock()
+_counters = defaultdict(float)
+# one record per timed pipeline stage, see stage()
+_stages = []
+
+
+def increment(name: str, value: float = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def snapshot() -> dict:
+    with _lock:
+        return dict(_counters)
+
+
+def delta(before: dict) -> dict:
+    # counters accumulated since `before` was taken
+    current = snapshot()
+    return {name: value - before.get(name, 0) for name, value in current.items() if value != before.get(name, 0)}
+
+
+def merge(counters: dict):
+    with _lock:
+        for name, value in counters.items():
+            _counters[name] += value
+
+
+def peak_rss_bytes():
+    # peak resident set size of this process so far (ru_maxrss is KB on linux, bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def stage(table_name: str, name: str, rows_in: int = None):
+    """
+    time one pipeline stage of a table: wall and cpu seconds, and the process' peak RSS
+    when it ends. the yielded record can be filled in with rows_out, bytes, inserted and
+    updated. a stage entered several times (one per batch) is summed in the run report.
+    while tracemalloc is tracing (the profile command), the peak of python allocations
+    during the stage is recorded too; stages running at the same time on two threads
+    (serialize and copy) share that peak.
+    """
+    record = {"table": table_name, "stage": name, "rows_in": rows_in}
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall_s"] = time.perf_counter() - wall_started
+        record["cpu_s"] = time.process_time() - cpu_started
+        record["peak_rss_bytes"] = peak_rss_bytes()
+        if tracing and tracemalloc.is_tracing():
+            record["py_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        with _lock:
+            _stages.append(record)
+
+
+def stage_mark() -> int:
+    with _lock:
+        return len(_stages)
+
+
+def stages_since(mark: int) -> list[dict]:
+    # stage records taken after stage_mark() returned `mark`
+    with _lock:
+        return [dict(record) for record in _stages[mark:]]
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _stages.clear()
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from config import DBSCHEMA, COPY_FORMAT, LOAD_MODE, ROW_HASHES, RUN_REPORT_DIR, PROMETHEUS_TEXTFILE
+from scripts import run_metrics
+
+logger = logging.getLogger(__name__)
+
+_SUMMED = ("wall_s", "cpu_s", "rows_in", "rows_out", "bytes", "inserted", "updated", "replaced")
+
+
+def aggregate_stages(records: list[dict]) -> dict[str, dict[str, dict]]:
+    """
+    table -> stage -> totals. stages entered once per batch (serialize, copy, ...) are
+    summed, peak_rss_bytes and py_peak_bytes are the highest value seen.
+    """
+    tables = {}
+    for record in records:
+        totals = tables.setdefault(record["table"], {}).setdefault(record["stage"], {"calls": 0})
+        totals["calls"] += 1
+        for field in _SUMMED:
+            if record.get(field) is not None:
+                totals[field] = totals.get(field, 0) + record[field]
+        for field in ("peak_rss_bytes", "py_peak_bytes"):
+            if record.get(field) is not None:
+                totals[field] = max(totals.get(field, 0), record[field])
+    for stages in tables.values():
+        for totals in stages.values():
+            for field in ("wall_s", "cpu_s"):
+                if field in totals:
+                    totals[field] = round(totals[field], 4)
+    return tables
+
+
+def build_run_report(results: list[dict], started: float, workers: int, data_dir: str = None) -> dict:
+    finished = time.time()
+    stages = aggregate_stages([record for result in results for record in result.get("stages", [])])
+    tables = {}
+    for result in results:
+        tables[result["table_name"]] = {
+            field: result[field]
+            for field in ("file", "status", "rows", "rows_affected", "inserted", "updated", "unchanged", "diverted",
+                          "seconds", "error")
+        }
+        tables[result["table_name"]]["stages"] = stages.get(result["table_name"], {})
+    return {
+        "started": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+        "finished": datetime.fromtimestamp(finished).isoformat(timespec="seconds"),
+        "seconds": round(finished - started, 3),
+        "schema": DBSCHEMA,
+        "data_dir": data_dir,
+        "config": {"copy_format": COPY_FORMAT, "load_mode": LOAD_MODE, "row_hashes": ROW_HASHES, "workers": workers},
+        "totals": {
+            "tables": len(results),
+            "failed": len([r for r in results if r["status"] not in ("ok", "skipped")]),
+            "skipped": len([r for r in results if r["status"] == "skipped"]),
+            "rows": sum(r["rows"] for r in results),
+            "inserted": sum(r["inserted"] for r in results),
+            "updated": sum(r["updated"] for r in results),
+            "diverted": sum(r.get("diverted", 0) for r in results),
+            # workers report their own peak with every stage, the parent's is read now
+            "peak_rss_bytes": max([totals.get("peak_rss_bytes", 0) for totals in _all_stage_totals(stages)]
+                                  + [run_metrics.peak_rss_bytes() or 0]),
+        },
+        "counters": run_metrics.snapshot(),
+        "tables": tables,
+    }
+
+
+def _all_stage_totals(stages: dict) -> list[dict]:
+    return [totals for table_stages in stages.values() for totals in table_stages.values()]
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_lines(report: dict) -> list[str]:
+    # node_exporter textfile collector format, gauges describing the last run
+    metrics = {
+        "tall_ingest_last_run_timestamp_seconds": ("unix time the last ingest run finished", [("", time.time())]),
+        "tall_ingest_run_seconds": ("duration of the last ingest run", [("", report["seconds"])]),
+        "tall_ingest_tables_failed": ("tables that failed in the last run", [("", report["totals"]["failed"])]),
+        "tall_ingest_peak_rss_bytes": ("highest peak RSS of any ingest process in the last run",
+                                       [("", report["totals"]["peak_rss_bytes"])]),
+    }
+    table_metrics = {
+        "tall_ingest_table_rows": ("rows read per table", "rows"),
+        "tall_ingest_table_inserted": ("rows inserted per table", "inserted"),
+        "tall_ingest_table_updated": ("rows updated per table", "updated"),
+        "tall_ingest_table_diverted": ("rows diverted per table for a PrimaryKey missing from dataHeader", "diverted"),
+        "tall_ingest_table_seconds": ("seconds spent per table", "seconds"),
+    }
+    for name, (help_text, field) in table_metrics.items():
+        metrics[name] = (help_text, [(f'table="{_label(table)}",status="{_label(values["status"])}"', values[field])
+                                     for table, values in report["tables"].items()])
+    stage_metrics = {
+        "tall_ingest_stage_seconds": ("wall seconds per table and stage", "wall_s"),
+        "tall_ingest_stage_cpu_seconds": ("cpu seconds per table and stage", "cpu_s"),
+        "tall_ingest_stage_rows": ("rows out of each table stage", "rows_out"),
+        "tall_ingest_stage_bytes": ("bytes produced or sent by each table stage", "bytes"),
+    }
+    for name, (help_text, field) in stage_metrics.items():
+        metrics[name] = (help_text, [(f'table="{_label(table)}",stage="{_label(stage)}"', totals[field])
+                                     for table, values in report["tables"].items()
+                                     for stage, totals in values["stages"].items() if field in totals])
+
+    lines = []
+    for name, (help_text, samples) in metrics.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        lines += [f"{name}{{{labels}}} {value}" if labels else f"{name} {value}" for labels, value in samples]
+    return lines
+
+
+def write_run_report(results: list[dict], started: float, workers: int, data_dir: str = None) -> str:
+    """
+    write the run report as json to RUN_REPORT_DIR and, if PROMETHEUS_TEXTFILE is set,
+    the same numbers as a prometheus textfile. returns the report path. watch mode passes
+    the project folder, which is added to the file name.
+    """
+    report = build_run_report(results, started, workers, data_dir)
+    os.makedirs(RUN_REPORT_DIR, exist_ok=True)
+    suffix = f"_{os.path.basename(os.path.normpath(data_dir))}" if data_dir else ""
+    report_path = os.path.join(RUN_REPORT_DIR, f"run_{datetime.fromtimestamp(started).strftime('%Y%m%d_%H%M%S')}{suffix}.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    logger.info(f"run_report:: run report written to {report_path}")
+
+    if PROMETHEUS_TEXTFILE:
+        # written next to the target and renamed, so the collector never reads half a file
+        tmp_path = f"{PROMETHEUS_TEXTFILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(prometheus_lines(report)) + "\n")
+        os.replace(tmp_path, PROMETHEUS_TEXTFILE)
+        logger.info(f"run_report:: prometheus metrics written to {PROMETHEUS_TEXTFILE}")
+    return report_path
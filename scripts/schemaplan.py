@@ -0,0 +1,229 @@
+import hashlib
+import logging
+import os
+import pickle
+
+import polars as pl
+
+from config import SCHEMAPLAN_PATH, SCHEMAPLAN_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+# bump when the compiled (pickled) layout below changes
+_CACHE_FORMAT = 1
+
+# unique constraint columns per table. this is the only copy: the dataframe dedup, the
+# ON CONFLICT target and the database constraint are all generated from it.
+UNIQUE_KEYS = {
+    # already known
+    "dataGap": ["PrimaryKey","LineKey", "RecKey", "SeqNo", "Gap", "RecType"],
+    "dataHeight": ["PrimaryKey", "LineKey", "RecKey","Height", "PointLoc", "PointNbr", "type", "HeightOption", "Direction"],
+    "dataHorizontalFlux": ["PrimaryKey","BoxID", "StackID"],
+    "dataLPI": ["PrimaryKey","LineKey", "RecKey", "layer", "code", "PointLoc", "PointNbr", "Direction", "chckbox"],
+    "dataSoilStability": ["PrimaryKey","LineKey", "RecKey", "Position","Pos", "Veg"],
+    "dataSpeciesInventory": ["PrimaryKey","LineKey", "RecKey", "Species"],
+    "geoSpecies": ["PrimaryKey","DBKey", "ProjectKey", "Species", "Duration", "GrowthHabit","GrowthHabitSub", "Hgt_Species_Avg_n"],
+
+    # primary key exclusives
+    "geoIndicators": ["PrimaryKey"],
+    "dataHeader": ["PrimaryKey"],
+
+    # to be determined
+    "dataDustDeposition": ["PrimaryKey"],
+    "dataPlotCharacterization": ["PrimaryKey"],
+    "dataSoilHorizons": ["PrimaryKey"],
+    "tblRHEM": ["PrimaryKey","Precipitation_Long_Term_MEAN", "Runoff_Long_Term_MEAN"],
+    # Add more table names and their respective unique constraint columns
+}
+
+# text meaning "no value". the csv scan reads these as null (readers.NULL_VALUES), columnar
+# inputs keep them as text until a rule below maps them
+NA_SENTINELS = ["NA", "N/A", "null"]
+
+# value normalization by schemaplan DataType. sentinels become null; the first vocabulary
+# that any of the column's distinct values belongs to is applied, values outside it are kept
+# as they are. text bit and code columns are mapped by scripts/normalize.py after the
+# collect; numeric and integer text columns have their sentinels nulled right before the
+# cast in data_cleaner.coerce_types, inside the lazy plan.
+VALUE_RULES = {
+    "numeric": {"sentinels": NA_SENTINELS},
+    "integer": {"sentinels": NA_SENTINELS},
+    "bit": {
+        "sentinels": [""] + NA_SENTINELS,
+        "vocabularies": [
+            {"TRUE": "1", "true": "1", "FALSE": "0", "false": "0"},
+            {"Y": "1", "N": "0"},
+            {"D": "1", "L": "0"},
+            # "0"/"1" columns are already in their final form
+        ],
+    },
+}
+
+# fixed value maps for individual code columns, {table: {field: {value: replacement}}}.
+# they take precedence over the DataType rule of the field. the cleaners had no per-column
+# code translations to move here, so there are none yet.
+COLUMN_VALUE_MAPS = {
+}
+
+
+def map_pg_type_to_polars(pg_type: str) -> pl.DataType:
+    # Mapping PostgreSQL types to Polars types
+    pg_to_polars_map = {
+        "integer": pl.Int32,
+        "int": pl.Int32,
+        "smallint": pl.Int16,
+        "bigint": pl.Int64,
+        "serial": pl.Int32,
+        "bigserial": pl.Int64,
+        "real": pl.Float32,
+        "double precision": pl.Float64,
+        "numeric": pl.Float64,
+        "decimal": pl.Float64,
+        "boolean": pl.Boolean,
+        "bit": pl.Boolean,
+        "text": pl.Utf8,
+        "varchar": pl.Utf8,
+        "char": pl.Utf8,
+        "character varying": pl.Utf8,
+        "character": pl.Utf8,
+        "date": pl.Date,
+        "timestamp": pl.Datetime,
+        "timestamp without time zone": pl.Datetime,
+        "timestamp with time zone": pl.Datetime,
+        "time": pl.Time,
+        "time without time zone": pl.Time,
+        "time with time zone": pl.Time,
+        "json": pl.Object,  # or pl.Utf8
+        "jsonb": pl.Object,  # or pl.Utf8
+        "uuid": pl.Utf8,
+        "bytea": pl.Binary,
+    }
+
+    # Convert to lower case for case-insensitive matching
+    pg_type_lower = pg_type.lower()
+
+    # Return the corresponding polars type or None if not found
+    return pg_to_polars_map.get(pg_type_lower, None)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SchemaPlan:
+    """
+    the schemaplan csv parsed once and indexed by table. fields keep the schemaplan order.
+    use get_schemaplan() instead of building one directly so every module shares it.
+    """
+
+    def __init__(self, tables: dict[str, list[tuple[str, str]]], source_path: str, sha256: str):
+        self.source_path = source_path
+        self.sha256 = sha256
+        self._tables = tables
+
+    @classmethod
+    def from_csv(cls, path: str, sha256: str = None) -> "SchemaPlan":
+        schemaplan = pl.read_csv(path, encoding='ISO-8859-1', schema_overrides={"Description": pl.Utf8})
+        tables = {}
+        for table, field, datatype in schemaplan.select(["Table", "Field", "DataType"]).iter_rows():
+            tables.setdefault(table, []).append((field, datatype))
+        return cls(tables, path, sha256 or file_sha256(path))
+
+    @classmethod
+    def load(cls, path: str = SCHEMAPLAN_PATH, cache_path: str = SCHEMAPLAN_CACHE_PATH) -> "SchemaPlan":
+        """
+        load the compiled schemaplan from cache_path, rebuilding it from the csv when the
+        csv's mtime or content hash no longer match the cached ones
+        """
+        mtime_ns = os.stat(path).st_mtime_ns
+        sha256 = file_sha256(path)
+
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    cached = pickle.load(f)
+                if (cached.get("format") == _CACHE_FORMAT
+                        and cached.get("source_path") == os.path.abspath(path)
+                        and cached.get("mtime_ns") == mtime_ns
+                        and cached.get("sha256") == sha256):
+                    logger.debug(f"schemaplan:: using compiled cache '{cache_path}'")
+                    return cls(cached["tables"], path, sha256)
+                logger.info("schemaplan:: schemaplan changed since last compile, rebuilding cache.")
+            except Exception as e:
+                logger.warning(f"schemaplan:: could not read cache '{cache_path}': {e}")
+
+        plan = cls.from_csv(path, sha256)
+        if cache_path:
+            try:
+                with open(cache_path, "wb") as f:
+                    pickle.dump({
+                        "format": _CACHE_FORMAT,
+                        "source_path": os.path.abspath(path),
+                        "mtime_ns": mtime_ns,
+                        "sha256": sha256,
+                        "tables": plan._tables,
+                    }, f)
+            except OSError as e:
+                logger.warning(f"schemaplan:: could not write cache '{cache_path}': {e}")
+        return plan
+
+    @property
+    def version(self) -> str:
+        return f"{os.path.basename(self.source_path)}@{self.sha256[:12]}"
+
+    def tables(self) -> list[str]:
+        return list(self._tables)
+
+    def has_table(self, table_name: str) -> bool:
+        return table_name in self._tables
+
+    def fields(self, table_name: str) -> list[str]:
+        return [field for field, _ in self._tables.get(table_name, [])]
+
+    def pg_types(self, table_name: str) -> dict[str, str]:
+        return dict(self._tables.get(table_name, []))
+
+    def polars_dtypes(self, table_name: str) -> dict:
+        return {field: map_pg_type_to_polars(datatype) for field, datatype in self._tables.get(table_name, [])}
+
+    def scan_dtypes(self, table_name: str) -> dict:
+        """
+        dtypes handed to pl.scan_csv for a table: numeric and integer fields are parsed as
+        Float64 (integerfix narrows them afterwards), everything else is read as text and left
+        to the cleaners
+        """
+        scan_dtypes = {}
+        for field, datatype in self._tables.get(table_name, []):
+            if datatype.lower() in ("numeric", "integer"):
+                scan_dtypes[field] = pl.Float64
+            else:
+                scan_dtypes[field] = pl.Utf8
+        return scan_dtypes
+
+    def unique_keys(self, table_name: str) -> list[str]:
+        return UNIQUE_KEYS[table_name]
+
+    def value_rules(self, table_name: str) -> dict[str, dict]:
+        # field -> normalization rule, only for the fields that have one
+        rules = {}
+        for field, datatype in self._tables.get(table_name, []):
+            if field in COLUMN_VALUE_MAPS.get(table_name, {}):
+                rules[field] = {"sentinels": [], "vocabularies": [COLUMN_VALUE_MAPS[table_name][field]]}
+            elif datatype.lower() in VALUE_RULES:
+                rules[field] = VALUE_RULES[datatype.lower()]
+        return rules
+
+
+_schemaplan = None
+
+def get_schemaplan() -> SchemaPlan:
+    # one SchemaPlan per process, loaded on first use
+    global _schemaplan
+    if _schemaplan is None:
+        _schemaplan = SchemaPlan.load()
+        logger.info(f"schemaplan:: loaded {_schemaplan.version} ({len(_schemaplan.tables())} tables)")
+    return _schemaplan
@@ -0,0 +1,127 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+
+from config import DBSCHEMA, COPY_SHARDS, COPY_SHARD_ROWS, INGEST_WORKERS
+from scripts.db_pool import get_connection, get_pool
+from scripts import run_metrics
+
+logger = logging.getLogger(__name__)
+
+_SHARD_COLUMN = "__shard"
+_STAGING_PREFIX = "_staging_"
+
+
+def free_server_slots(cursor) -> int:
+    # client connections the server still accepts from non-superusers
+    cursor.execute("""
+        SELECT current_setting('max_connections')::int
+             - current_setting('superuser_reserved_connections')::int
+             - count(*)
+        FROM pg_catalog.pg_stat_activity
+        WHERE backend_type = 'client backend'
+    """)
+    return cursor.fetchone()[0]
+
+
+def shard_count(cursor, rows: int) -> int:
+    """
+    how many connections to COPY `rows` rows over: one per COPY_SHARD_ROWS rows, at most
+    COPY_SHARDS, and no more than this process' pool can lend right now or its share
+    (1/INGEST_WORKERS) of the server's free connection slots. 1 means don't shard.
+    """
+    wanted = min(COPY_SHARDS, rows // max(1, COPY_SHARD_ROWS))
+    if wanted < 2:
+        return 1
+    slots = min(get_pool().free_slots(), free_server_slots(cursor) // max(1, INGEST_WORKERS))
+    shards = max(1, min(wanted, slots))
+    if shards < wanted:
+        logger.info(f"sharded_copy:: {rows} rows would take {wanted} shards, only {slots} connections are free.")
+    return shards
+
+
+def shard_frame(df: pl.DataFrame, key_columns: list[str], shards: int) -> list[pl.DataFrame]:
+    # split by a hash of the unique key, so all rows of one key land in the same shard
+    key_columns = [col for col in key_columns if col in df.columns] or df.columns
+    shard_ids = pl.struct(key_columns).hash(seed=0) % shards
+    parts = df.with_columns(shard_ids.alias(_SHARD_COLUMN)).partition_by(_SHARD_COLUMN, as_dict=True)
+    return [part.drop(_SHARD_COLUMN) for part in parts.values()]
+
+
+def staging_names(cursor, table_name: str, shards: int) -> list[str]:
+    # named after the merging session's backend pid: unique while it runs, and sweep_stale_shards
+    # can tell a crashed run's leftovers apart. the table name goes last, where postgres truncates
+    cursor.execute("SELECT pg_backend_pid()")
+    pid = cursor.fetchone()[0]
+    return [f'"{DBSCHEMA}"."{_STAGING_PREFIX}{pid}_{i}_{table_name}"' for i in range(shards)]
+
+
+def sweep_stale_shards():
+    # drop the staging tables of sessions that are gone: a run that crashed between load_shards and drop_shards
+    try:
+        with get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT format('%%I.%%I', n.nspname, c.relname)
+                FROM pg_catalog.pg_class c
+                JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = %s AND c.relkind = 'r'
+                  AND c.relname ~ %s
+                  AND substring(c.relname FROM %s)::int NOT IN (SELECT pid FROM pg_catalog.pg_stat_activity)
+            """, (DBSCHEMA, f"^{_STAGING_PREFIX}[0-9]+_[0-9]+_", f"^{_STAGING_PREFIX}([0-9]+)_"))
+            stale = [row[0] for row in cursor.fetchall()]
+            for staging in stale:
+                cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+            conn.commit()
+        if stale:
+            logger.info(f"sharded_copy:: dropped {len(stale)} staging tables left behind by an earlier run: {', '.join(stale)}")
+    except Exception as e:
+        logger.warning(f"sharded_copy:: could not sweep stale staging tables: {e}")
+
+
+def load_shards(cursor, parts: list[pl.DataFrame], table_name: str, prepare, load) -> list[str]:
+    """
+    load every part into its own unlogged staging table, concurrently, each over its own
+    pooled connection: prepare(cursor, staging) creates the table and load(cursor, part,
+    staging) copies the part into it, then the shard commits so the caller's connection
+    (`cursor`, the one that merges) sees it. returns the staging table names; they are
+    committed tables, drop them once merged (drop_shards).
+    """
+    sweep_stale_shards()
+    stagings = staging_names(cursor, table_name, len(parts))
+
+    def load_one(i: int) -> int:
+        with get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {stagings[i]}")
+            prepare(cursor, stagings[i])
+            load(cursor, parts[i], stagings[i])
+            conn.commit()
+        return parts[i].height
+
+    with run_metrics.stage(table_name, "shard_copy", rows_in=sum(part.height for part in parts)) as stage:
+        try:
+            with ThreadPoolExecutor(max_workers=len(parts), thread_name_prefix="copy-shard") as executor:
+                # every shard is waited for before the first error, if any, is raised
+                futures = [executor.submit(load_one, i) for i in range(len(parts))]
+                stage["rows_out"] = sum(future.result() for future in futures)
+        except Exception:
+            drop_shards(stagings)
+            raise
+    run_metrics.increment("copy.shards", len(parts))
+    logger.info(f"sharded_copy:: {table_name}: {stage['rows_out']} rows copied over {len(parts)} connections.")
+    return stagings
+
+
+def union_source(stagings: list[str]) -> str:
+    # the shards as one merge source
+    return "(" + " UNION ALL ".join([f"SELECT * FROM {staging}" for staging in stagings]) + ") AS staged"
+
+
+def drop_shards(stagings: list[str]):
+    try:
+        with get_connection() as conn, conn.cursor() as cursor:
+            for staging in stagings:
+                cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"sharded_copy:: could not drop {', '.join(stagings)}: {e}")
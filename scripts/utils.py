@@ -1,69 +1,20 @@
-from config import SCHEMAPLAN_PATH, DBSCHEMA
-from scripts.data_cleaner import deduplicate_dataframe, bitfix, dateloadedfix, create_postgis_geometry, numericfix, integerfix
+from config import DBSCHEMA
+from scripts.schemaplan import get_schemaplan, UNIQUE_KEYS
 
-import polars as pl
 import logging
-import os
 
 
 logger = logging.getLogger(__name__)
 
-def schema_chooser(tablename):
-    fields = pl.read_csv(SCHEMAPLAN_PATH, encoding='ISO-8859-1', schema_overrides={"Description": pl.Utf8})
-    return fields.filter(pl.col("Table")==tablename)
-
 def schema_to_dictionary(tablename):
-    schema = schema_chooser(tablename)
-    return dict(zip(schema['Field'].to_list(), schema['DataType'].to_list()))
+    return get_schemaplan().pg_types(tablename)
 
 def generate_unique_constraint_standalone(table_name:str) -> list[str]:
-    table_columns = {
-        # already known
-        "dataGap": ["PrimaryKey","LineKey", "RecKey", "SeqNo", "Gap", "RecType"],
-        "dataHeight": ["PrimaryKey", "LineKey", "RecKey","Height", "PointLoc", "PointNbr", "type", "HeightOption", "Direction"],
-        "dataHorizontalFlux": ["PrimaryKey","BoxID", "StackID"],
-        "dataLPI": ["PrimaryKey","LineKey", "RecKey", "layer", "code", "PointLoc", "PointNbr", "Direction", "chckbox"],
-        "dataSoilStability": ["PrimaryKey","LineKey", "RecKey", "Position","Pos", "Veg"],
-        "dataSpeciesInventory": ["PrimaryKey","LineKey", "RecKey", "Species"],
-        "geoSpecies": ["PrimaryKey","DBKey", "ProjectKey", "Species", "Duration", "GrowthHabit","GrowthHabitSub"],
-
-        # primary key exclusives
-        "geoIndicators": ["PrimaryKey"],
-        "dataHeader": ["PrimaryKey"],
-
-        # to be determined
-        "dataDustDeposition": ["PrimaryKey"],
-        "dataPlotCharacterization": ["PrimaryKey"],
-        "dataSoilHorizons": ["PrimaryKey"],
-        "tblRHEM": ["PrimaryKey","Precipitation_Long_Term_MEAN", "Runoff_Long_Term_MEAN"],
-        # Add more table names and their respective unique constraint columns
-    }
-    return table_columns[table_name]
+    return get_schemaplan().unique_keys(table_name)
     
 
 def generate_unique_constraint_query(table_name: str) -> str:
-    # Define a mapping of table names to the columns for unique constraints
-    table_columns = {
-        # already known
-        "dataGap": ["PrimaryKey","LineKey", "RecKey", "SeqNo", "Gap", "RecType"],
-        "dataHeight": ["PrimaryKey", "LineKey", "RecKey","Height", "PointLoc", "PointNbr", "type", "HeightOption", "Direction"],
-        "dataHorizontalFlux": ["PrimaryKey","BoxID", "StackID"],
-        "dataLPI": ["PrimaryKey","LineKey", "RecKey", "layer", "code", "PointLoc", "PointNbr", "Direction", "chckbox"],
-        "dataSoilStability": ["PrimaryKey","LineKey", "RecKey", "Position","Pos", "Veg"],
-        "dataSpeciesInventory": ["PrimaryKey","LineKey", "RecKey", "Species"],
-        "geoSpecies": ["PrimaryKey","DBKey", "ProjectKey", "Species", "Duration", "GrowthHabit","GrowthHabitSub", "Hgt_Species_Avg_n"],
-
-        # primary key exclusives
-        "geoIndicators": ["PrimaryKey"],
-        "dataHeader": ["PrimaryKey"],
-
-        # to be determined
-        "dataDustDeposition": ["PrimaryKey"],
-        "dataPlotCharacterization": ["PrimaryKey"],
-        "dataSoilHorizons": ["PrimaryKey"],
-        "tblRHEM": ["PrimaryKey","Precipitation_Long_Term_MEAN", "Runoff_Long_Term_MEAN"],
-        # Add more table names and their respective unique constraint columns
-    }
+    table_columns = UNIQUE_KEYS
 
     # Check if the table exists in the dictionary
     if table_name in table_columns:
@@ -81,42 +32,3 @@ def generate_unique_constraint_query(table_name: str) -> str:
 
     return query
 
-
-def map_pg_type_to_polars(pg_type: str) -> pl.DataType:
-    # Mapping PostgreSQL types to Polars types
-    pg_to_polars_map = {
-        "integer": pl.Int32,
-        "int": pl.Int32,
-        "smallint": pl.Int16,
-        "bigint": pl.Int64,
-        "serial": pl.Int32,
-        "bigserial": pl.Int64,
-        "real": pl.Float32,
-        "double precision": pl.Float64,
-        "numeric": pl.Float64,
-        "decimal": pl.Float64,
-        "boolean": pl.Boolean,
-        "bit": pl.Boolean,
-        "text": pl.Utf8,
-        "varchar": pl.Utf8,
-        "char": pl.Utf8,
-        "character varying": pl.Utf8,
-        "character": pl.Utf8,
-        "date": pl.Date,
-        "timestamp": pl.Datetime,
-        "timestamp without time zone": pl.Datetime,
-        "timestamp with time zone": pl.Datetime,
-        "time": pl.Time,
-        "time without time zone": pl.Time,
-        "time with time zone": pl.Time,
-        "json": pl.Object,  # or pl.Utf8 
-        "jsonb": pl.Object,  # or pl.Utf8
-        "uuid": pl.Utf8,
-        "bytea": pl.Binary,
-    }
-
-    # Convert to lower case for case-insensitive matching
-    pg_type_lower = pg_type.lower()
-
-    # Return the corresponding polars type or None if not found
-    return pg_to_polars_map.get(pg_type_lower, None)
@@ -0,0 +1,89 @@
+import logging
+import os
+import time
+
+from config import DATA_DIR, WATCH_QUIET_SECONDS, WATCH_MARKER_FILE
+from scripts.readers import INPUT_EXTENSIONS, is_input_file
+
+logger = logging.getLogger(__name__)
+
+# files that make up a project drop; anything else (partial uploads, editor files...) is ignored
+DATA_EXTENSIONS = INPUT_EXTENSIONS + (".xlsx",)
+
+
+def folder_signature(folder: str, marker: str = WATCH_MARKER_FILE) -> tuple:
+    """
+    sorted (name, size, mtime) of the data files and marker directly in folder. the same
+    signature seen twice, some time apart, means nothing was written in between.
+    """
+    entries = []
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.is_file() and (entry.name.lower().endswith(DATA_EXTENSIONS) or entry.name == marker):
+                stat = entry.stat()
+                entries.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(entries))
+
+
+class FolderWatcher:
+    """
+    polls the project folders of a data directory (each subfolder, and the directory
+    itself when input files sit directly in it) and reports the ones that finished
+    landing: a folder is ready once it holds the marker file, or when its signature
+    hasn't changed for quiet_seconds. a folder is reported again only after it changes.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR, quiet_seconds: float = WATCH_QUIET_SECONDS,
+                 marker: str = WATCH_MARKER_FILE):
+        self.data_dir = data_dir
+        self.quiet_seconds = quiet_seconds
+        self.marker = marker
+        # folder -> (signature, monotonic time it was first seen with that signature)
+        self._pending = {}
+        # folder -> signature it was last handed out with
+        self._done = {}
+
+    def project_folders(self) -> list[str]:
+        folders = []
+        with os.scandir(self.data_dir) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        if any(entry.is_file() and is_input_file(entry.name) for entry in entries):
+            folders.append(self.data_dir)
+        # hidden and underscore folders are where uploads are usually staged
+        folders += [entry.path for entry in entries if entry.is_dir() and not entry.name.startswith((".", "_"))]
+        return folders
+
+    def poll(self) -> list[tuple[str, tuple]]:
+        # (folder, signature) of every folder that is ready; pass both to mark_done once it's loaded
+        now = time.monotonic()
+        folders = self.project_folders()
+        ready = []
+        for folder in folders:
+            try:
+                signature = folder_signature(folder, self.marker)
+            except OSError:
+                # removed while we were looking at it
+                continue
+            if self._done.get(folder) == signature or not any(is_input_file(name) for name, _, _ in signature):
+                self._pending.pop(folder, None)
+                continue
+
+            pending = self._pending.get(folder)
+            if pending is None or pending[0] != signature:
+                self._pending[folder] = pending = (signature, now)
+                logger.debug(f"watcher:: change in {folder}, waiting for it to settle.")
+
+            has_marker = any(name == self.marker for name, _, _ in signature)
+            if has_marker or now - pending[1] >= self.quiet_seconds:
+                ready.append((folder, signature))
+
+        for folder in set(self._done) - set(folders):
+            del self._done[folder]
+        for folder in set(self._pending) - set(folders):
+            del self._pending[folder]
+        return ready
+
+    def mark_done(self, folder: str, signature: tuple):
+        # the folder won't be reported again until its files differ from signature
+        self._done[folder] = signature
+        self._pending.pop(folder, None)
@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py opens ./logs/app.log when it's imported: import it from a scratch directory so
+# the tests don't need (or write into) the repo's logs folder
+_SCRATCH = tempfile.mkdtemp(prefix="tall_ingester_tests_")
+os.makedirs(os.path.join(_SCRATCH, "logs"))
+_cwd = os.getcwd()
+os.chdir(_SCRATCH)
+try:
+    import config  # noqa: E402,F401
+finally:
+    os.chdir(_cwd)
+
+from scripts import schemaplan  # noqa: E402
+
+
+@pytest.fixture
+def plan(monkeypatch):
+    # a small hand-built schemaplan in place of the LDC csv
+    tables = {
+        "dataHeader": [("PrimaryKey", "TEXT"), ("ProjectKey", "TEXT"), ("DateVisited", "DATE")],
+        "dataGap": [("PrimaryKey", "TEXT"), ("LineKey", "TEXT"), ("RecKey", "TEXT"), ("SeqNo", "INTEGER"),
+                    ("Gap", "NUMERIC"), ("RecType", "TEXT"), ("Perennials", "BIT"), ("ProjectKey", "TEXT")],
+    }
+    loaded = schemaplan.SchemaPlan(tables, "test_schemaplan.csv", "0" * 64)
+    monkeypatch.setattr(schemaplan, "_schemaplan", loaded)
+    return loaded
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from scripts.copy_pipeline import ByteBudgetQueue
+
+
+def test_put_waits_for_release_beyond_the_budget():
+    queue = ByteBudgetQueue(max_bytes=100)
+    queue.put("a", 60)
+    blocked = threading.Event()
+    done = threading.Event()
+
+    def producer():
+        blocked.set()
+        queue.put("b", 60)
+        done.set()
+
+    thread = threading.Thread(target=producer)
+    thread.start()
+    blocked.wait()
+    assert not done.wait(0.2)
+
+    assert queue.get() == ("a", 60)
+    # taken off the queue is not enough, the bytes are held until the consumer releases them
+    assert not done.wait(0.2)
+    queue.release(60)
+    assert done.wait(5)
+    thread.join()
+    assert queue.get() == ("b", 60)
+
+
+def test_batch_larger_than_the_budget_is_let_through():
+    queue = ByteBudgetQueue(max_bytes=10)
+    queue.put("big", 1000)
+    assert queue.get() == ("big", 1000)
+
+
+def test_close_ends_the_queue_after_the_queued_batches():
+    queue = ByteBudgetQueue(max_bytes=100)
+    queue.put("a", 1)
+    queue.close()
+    assert queue.get() == ("a", 1)
+    item, nbytes = queue.get()
+    assert nbytes == 0 and item != "a"
+
+
+def test_fail_wakes_a_blocked_producer():
+    queue = ByteBudgetQueue(max_bytes=10)
+    queue.put("a", 10)
+    errors = []
+
+    def producer():
+        try:
+            queue.put("b", 10)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=producer)
+    thread.start()
+    queue.fail(OSError("connection lost"))
+    thread.join(5)
+    assert not thread.is_alive()
+    assert isinstance(errors[0].__cause__, OSError)
+    with pytest.raises(RuntimeError):
+        queue.put("c", 1)
@@ -0,0 +1,102 @@
+import pytest
+
+from scripts import ddl, partitions
+from scripts.ddl import CatalogSnapshot, plan_table
+
+GAP_COLUMNS = {"rid": "integer", "PrimaryKey": "text", "LineKey": "text", "RecKey": "text", "SeqNo": "integer",
+               "Gap": "numeric", "RecType": "text", "Perennials": "bit(1)", "ProjectKey": "text"}
+GAP_KEYS = ("PrimaryKey", "LineKey", "RecKey", "SeqNo", "Gap", "RecType")
+FK = ('ALTER TABLE public_dev."dataGap" ADD FOREIGN KEY ("PrimaryKey") '
+      'REFERENCES public_dev."dataHeader"("PrimaryKey")')
+
+
+@pytest.fixture(autouse=True)
+def settings(plan, monkeypatch):
+    monkeypatch.setattr(ddl, "DBSCHEMA", "public_dev")
+    monkeypatch.setattr(ddl, "ROW_HASHES", False)
+    monkeypatch.setattr(partitions, "PARTITION_BY", "")
+
+
+def snapshot(columns=None, constraints=None, indexes=None):
+    # dataGap as reconcile_tables would have left it, unless overridden
+    columns = GAP_COLUMNS if columns is None else columns
+    if constraints is None:
+        constraints = [("dataGap_pkey", "p", ("rid",), None, True),
+                       ("unique_dataGap", "u", GAP_KEYS, None, True),
+                       ("dataGap_PrimaryKey_fkey", "f", ("PrimaryKey",), "dataHeader", True)]
+    if indexes is None:
+        indexes = [("dataGap_pkey", ("rid",), True), ("unique_dataGap", GAP_KEYS, True)]
+    return CatalogSnapshot({"dataGap": columns}, {"dataGap": constraints}, {"dataGap": indexes})
+
+
+def test_table_in_line_needs_nothing():
+    assert plan_table("dataGap", snapshot()) == []
+
+
+def test_missing_table_is_created_with_its_keys():
+    [create] = plan_table("dataGap", CatalogSnapshot({}, {}, {}))
+    assert create.startswith('CREATE TABLE public_dev."dataGap" (rid SERIAL PRIMARY KEY, "PrimaryKey" TEXT,')
+    assert 'FOREIGN KEY ("PrimaryKey") REFERENCES public_dev."dataHeader"("PrimaryKey")' in create
+    assert 'CONSTRAINT "unique_dataGap" UNIQUE ("PrimaryKey", "LineKey", "RecKey", "SeqNo", "Gap", "RecType")' in create
+
+
+def test_header_gets_a_unique_primarykey_and_no_foreign_key():
+    [create] = plan_table("dataHeader", CatalogSnapshot({}, {}, {}))
+    assert 'UNIQUE ("PrimaryKey")' in create
+    assert "FOREIGN KEY" not in create
+    assert "unique_dataHeader" not in create
+
+
+def test_missing_columns_are_added():
+    columns = {col: pg_type for col, pg_type in GAP_COLUMNS.items() if col not in ("Perennials", "ProjectKey")}
+    assert plan_table("dataGap", snapshot(columns=columns)) == [
+        'ALTER TABLE public_dev."dataGap" ADD COLUMN "Perennials" BIT, ADD COLUMN "ProjectKey" TEXT']
+
+
+def test_type_mismatch_is_only_reported(caplog):
+    assert plan_table("dataGap", snapshot(columns={**GAP_COLUMNS, "Gap": "text"})) == []
+    assert '"Gap" is text in the database but NUMERIC in the schemaplan' in caplog.text
+
+
+def test_changed_unique_key_replaces_the_constraint():
+    constraints = [("unique_dataGap", "u", ("PrimaryKey", "SeqNo"), None, True),
+                   ("dataGap_PrimaryKey_fkey", "f", ("PrimaryKey",), "dataHeader", True)]
+    indexes = [("unique_dataGap", ("PrimaryKey", "SeqNo"), True)]
+    assert plan_table("dataGap", snapshot(constraints=constraints, indexes=indexes)) == [
+        'ALTER TABLE public_dev."dataGap" DROP CONSTRAINT "unique_dataGap", ADD CONSTRAINT "unique_dataGap" '
+        'UNIQUE ("PrimaryKey", "LineKey", "RecKey", "SeqNo", "Gap", "RecType")']
+
+
+def test_unique_index_in_another_order_is_enough():
+    indexes = [("unique_dataGap", tuple(reversed(GAP_KEYS)), True)]
+    assert plan_table("dataGap", snapshot(indexes=indexes)) == []
+
+
+def test_missing_foreign_key_is_added():
+    constraints = [("unique_dataGap", "u", GAP_KEYS, None, True)]
+    assert plan_table("dataGap", snapshot(constraints=constraints)) == [FK]
+
+
+def test_not_valid_foreign_key_is_kept_and_listed():
+    constraints = [("unique_dataGap", "u", GAP_KEYS, None, True),
+                   ("dataGap_PrimaryKey_fkey", "f", ("PrimaryKey",), "dataHeader", False)]
+    catalog = snapshot(constraints=constraints)
+    assert plan_table("dataGap", catalog) == []
+    assert catalog.unvalidated_foreign_keys("dataGap") == ["dataGap_PrimaryKey_fkey"]
+
+
+def test_projectkey_partitioning_extends_the_unique_key(monkeypatch):
+    monkeypatch.setattr(partitions, "PARTITION_BY", "projectkey")
+    [create] = plan_table("dataGap", CatalogSnapshot({}, {}, {}))
+    assert create.startswith('CREATE TABLE public_dev."dataGap" (rid SERIAL NOT NULL,')
+    assert 'UNIQUE (rid, "ProjectKey")' in create
+    assert 'UNIQUE ("PrimaryKey", "LineKey", "RecKey", "SeqNo", "Gap", "RecType", "ProjectKey")' in create
+    assert create.endswith('PARTITION BY LIST ("ProjectKey")')
+
+
+def test_row_hashes_add_the_hash_columns_and_index(monkeypatch):
+    monkeypatch.setattr(ddl, "ROW_HASHES", True)
+    assert plan_table("dataGap", snapshot()) == [
+        'ALTER TABLE public_dev."dataGap" ADD COLUMN "key_hash" bigint, ADD COLUMN "row_hash" bigint',
+        'CREATE INDEX IF NOT EXISTS "dataGap_projectkey_hash_idx" ON public_dev."dataGap" ("ProjectKey") '
+        'INCLUDE ("key_hash", "row_hash")']
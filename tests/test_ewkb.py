@@ -0,0 +1,29 @@
+import struct
+
+import polars as pl
+
+from scripts.ewkb import encode_points_hex
+
+
+def expected_hex(lon: float, lat: float, srid: int) -> str:
+    return struct.pack("<BIIdd", 1, 0x20000001, srid, lon, lat).hex().upper()
+
+
+def test_valid_points():
+    lon = pl.Series([-106.75, 0.0, 180.0])
+    lat = pl.Series([32.6, 0.0, -90.0])
+    encoded = encode_points_hex(lon, lat, 4326)
+    assert encoded.to_list() == [expected_hex(x, y, 4326) for x, y in zip(lon, lat)]
+
+
+def test_text_coordinates_are_parsed():
+    assert encode_points_hex(pl.Series(["-106.75"]), pl.Series(["32.6"]), 4269).to_list() == [
+        expected_hex(-106.75, 32.6, 4269)]
+
+
+def test_invalid_coordinates_give_null_geometry():
+    lon = pl.Series(["-106.75", None, "181", "nan", "abc", "-106.75"])
+    lat = pl.Series(["32.6", "32.6", "32.6", "32.6", "32.6", "-91"])
+    encoded = encode_points_hex(lon, lat, 4326)
+    assert encoded.to_list()[0] == expected_hex(-106.75, 32.6, 4326)
+    assert encoded.to_list()[1:] == [None] * 5
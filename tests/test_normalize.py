@@ -0,0 +1,39 @@
+import polars as pl
+
+from scripts import schemaplan
+from scripts.normalize import decide_mapping, normalize_values
+from scripts.schemaplan import VALUE_RULES
+
+
+def test_sentinels_become_null():
+    assert decide_mapping(["NA", "1", None, ""], VALUE_RULES["bit"]) == {"NA": None, "": None}
+
+
+def test_first_matching_vocabulary_wins():
+    rule = {"vocabularies": [{"Y": "1", "N": "0"}, {"Y": "yes", "D": "1"}]}
+    # "D" only exists in the second vocabulary, but the first one already matched
+    assert decide_mapping(["Y", "D"], rule) == {"Y": "1"}
+
+
+def test_later_vocabulary_when_the_first_doesnt_match():
+    assert decide_mapping(["D", "L"], VALUE_RULES["bit"]) == {"D": "1", "L": "0"}
+
+
+def test_values_already_final_are_left_alone():
+    assert decide_mapping(["0", "1", None], VALUE_RULES["bit"]) == {}
+
+
+def test_column_map_takes_precedence_over_the_datatype_rule(plan, monkeypatch):
+    monkeypatch.setattr(schemaplan, "COLUMN_VALUE_MAPS", {"dataGap": {"Perennials": {"Y": "yes"}}})
+    rules = plan.value_rules("dataGap")
+    assert rules["Perennials"] == {"sentinels": [], "vocabularies": [{"Y": "yes"}]}
+    assert rules["Gap"] is VALUE_RULES["numeric"]
+    assert "RecType" not in rules
+
+
+def test_normalize_values_rewrites_bit_columns(plan):
+    df = pl.DataFrame({"Perennials": ["TRUE", "false", "NA", None], "RecType": ["TRUE", "NA", "x", None]})
+    out = normalize_values(df, "dataGap")
+    assert out["Perennials"].to_list() == ["1", "0", None, None]
+    # no rule for text columns
+    assert out["RecType"].to_list() == df["RecType"].to_list()
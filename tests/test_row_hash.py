@@ -0,0 +1,32 @@
+import polars as pl
+
+from scripts.row_hash import KEY_HASH_COLUMN, ROW_HASH_COLUMN, add_row_hashes, split_by_hash
+
+KEYS = ["PrimaryKey", "SeqNo"]
+
+
+def frame(gaps):
+    return pl.DataFrame({"PrimaryKey": ["a", "a", "b"], "SeqNo": [1, 2, 1], "Gap": gaps, "DateLoadedInDb": ["x", "y", "z"]})
+
+
+def test_unchanged_rows_are_left_out():
+    stored = add_row_hashes(frame([1.0, 2.0, 3.0]), KEYS, ["DateLoadedInDb"]).select([KEY_HASH_COLUMN, ROW_HASH_COLUMN])
+    incoming = add_row_hashes(frame([1.0, 2.5, 3.0]).with_columns(pl.lit("later").alias("DateLoadedInDb")),
+                              KEYS, ["DateLoadedInDb"])
+    changed, unchanged = split_by_hash(incoming, stored)
+    assert unchanged == 2
+    assert changed.select(KEYS).rows() == [("a", 2)]
+
+
+def test_everything_is_new_without_stored_hashes():
+    incoming = add_row_hashes(frame([1.0, 2.0, 3.0]), KEYS)
+    empty = pl.DataFrame(schema={KEY_HASH_COLUMN: pl.Int64, ROW_HASH_COLUMN: pl.Int64})
+    changed, unchanged = split_by_hash(incoming, empty)
+    assert (changed.height, unchanged) == (3, 0)
+
+
+def test_hashes_are_stable():
+    # the stored hashes must come out the same in every run
+    first = add_row_hashes(frame([1.0, 2.0, 3.0]), KEYS)
+    second = add_row_hashes(frame([1.0, 2.0, 3.0]), KEYS)
+    assert first.select([KEY_HASH_COLUMN, ROW_HASH_COLUMN]).equals(second.select([KEY_HASH_COLUMN, ROW_HASH_COLUMN]))
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from scripts import watcher
+from scripts.watcher import FolderWatcher
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(watcher.time, "monotonic", clock)
+    return clock
+
+
+def write(path, text="PrimaryKey\nA\n"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_folder_is_ready_once_it_stops_changing(tmp_path, clock):
+    write(tmp_path / "proj" / "dataHeader.csv")
+    files = FolderWatcher(str(tmp_path), quiet_seconds=30, marker="_READY")
+    assert files.poll() == []
+
+    clock.now += 20
+    write(tmp_path / "proj" / "dataGap.csv")
+    # the change restarts the quiet period
+    clock.now += 20
+    assert files.poll() == []
+    clock.now += 30
+    [(folder, signature)] = files.poll()
+    assert folder == str(tmp_path / "proj")
+    assert [name for name, _, _ in signature] == ["dataGap.csv", "dataHeader.csv"]
+
+
+def test_marker_makes_a_folder_ready_at_once(tmp_path, clock):
+    write(tmp_path / "proj" / "dataHeader.csv")
+    write(tmp_path / "proj" / "_READY", "")
+    assert [folder for folder, _ in FolderWatcher(str(tmp_path), 30, "_READY").poll()] == [str(tmp_path / "proj")]
+
+
+def test_done_folder_is_reported_again_only_after_a_change(tmp_path, clock):
+    write(tmp_path / "proj" / "dataHeader.csv")
+    files = FolderWatcher(str(tmp_path), quiet_seconds=0, marker="_READY")
+    [(folder, signature)] = files.poll()
+    files.mark_done(folder, signature)
+    assert files.poll() == []
+
+    write(tmp_path / "proj" / "dataHeader.csv", "PrimaryKey\nA\nB\n")
+    assert [folder for folder, _ in files.poll()] == [folder]
+
+
+def test_folders_without_input_files_are_ignored(tmp_path, clock):
+    write(tmp_path / "proj" / "notes.txt")
+    write(tmp_path / "_upload" / "dataHeader.csv")
+    write(tmp_path / ".hidden" / "dataHeader.csv")
+    assert FolderWatcher(str(tmp_path), quiet_seconds=0, marker="_READY").poll() == []
+
+
+def test_input_files_in_the_data_dir_itself(tmp_path, clock):
+    write(tmp_path / "dataHeader.csv")
+    assert [folder for folder, _ in FolderWatcher(str(tmp_path), 0, "_READY").poll()] == [str(tmp_path)]